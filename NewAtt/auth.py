@@ -1,14 +1,23 @@
+import asyncio
+import heapq
 import os
+import re
+import threading
+import time
+import uuid
 import jwt
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 from fastapi import Request, HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from models import User
+from models import RevokedToken, User
 from dotenv import load_dotenv
 from logger import logger
 
@@ -17,7 +26,13 @@ load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "YOUR_SUPER_SECRET_KEY_CHANGE_ME")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
+# Access-токен короткий, долгую сессию держит refresh-токен (ротируется при обновлении)
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+# Как часто подтягивать отзывы, сделанные другими процессами
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", 30))
+# Сколько секунд держать роли пользователя в кэше (без запроса к БД)
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 60))
 
 security = HTTPBearer(auto_error=False)
 
@@ -29,56 +44,273 @@ PUBLIC_PATHS = [
     "/verify-code",
     "/resend-code",
     "/auth/token",
+    "/auth/refresh",
 ]
 
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+def _encode_token(data: dict, token_type: str, expires_delta: timedelta) -> str:
     to_encode = data.copy()
 
     if "sub" in to_encode:
         to_encode["sub"] = str(to_encode["sub"])
 
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({
+        "exp": datetime.now(timezone.utc) + expires_delta,
+        "jti": uuid.uuid4().hex,
+        "type": token_type,
+    })
 
-    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
 
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    return _encode_token(data, "access", expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+
+def create_refresh_token(user_id: int) -> str:
+    return _encode_token({"sub": user_id}, "refresh", timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+
+def create_token_pair(user_id: int) -> Tuple[str, str]:
+    """Пара (access, refresh) для входа и обновления токена."""
+    return create_access_token(data={"sub": user_id}), create_refresh_token(user_id)
+
+
+class RevocationList:
+    """
+    Отозванные jti в памяти процесса: проверка — поиск в dict (O(1)), без запроса к БД.
+    Куча по времени истечения позволяет выбрасывать записи, которые больше не нужны
+    (токен с истёкшим exp и так не пройдёт проверку подписи). Отзывы сохраняются
+    в таблицу revoked_tokens, поэтому переживают перезапуск; другие процессы
+    подтягивают их через sync().
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, float] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._synced_at: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self._entries
+
+    def add(self, jti: str, expires_at: float) -> None:
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            if jti not in self._entries:
+                self._entries[jti] = expires_at
+                heapq.heappush(self._expiry_heap, (expires_at, jti))
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        evicted = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                _, jti = heapq.heappop(self._expiry_heap)
+                self._entries.pop(jti, None)
+                evicted += 1
+        return evicted
+
+    def revoke(self, db: Session, jti: str, expires_at: float) -> None:
+        """Отзывает токен: запись в БД и в память процесса."""
+        db.merge(RevokedToken(
+            jti=jti,
+            expires_at=datetime.fromtimestamp(expires_at, timezone.utc).replace(tzinfo=None),
+            revoked_at=datetime.utcnow(),
+        ))
+        db.commit()
+        self.add(jti, expires_at)
+
+    def claim(self, db: Session, jti: str, expires_at: float) -> bool:
+        """
+        Отзывает токен, только если его ещё никто не отозвал: обычный INSERT по
+        первичному ключу jti. False — строка уже есть (повторное использование,
+        в том числе параллельным запросом или другим процессом).
+        """
+        try:
+            db.execute(insert(RevokedToken).values(
+                jti=jti,
+                expires_at=datetime.fromtimestamp(expires_at, timezone.utc).replace(tzinfo=None),
+                revoked_at=datetime.utcnow(),
+            ))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            claimed = False
+        else:
+            claimed = True
+        self.add(jti, expires_at)
+        return claimed
+
+    def sync(self, db: Session) -> None:
+        """Загружает из БД отзывы, появившиеся после прошлой синхронизации (при первом вызове — все)."""
+        now = datetime.utcnow()
+        query = db.query(RevokedToken.jti, RevokedToken.expires_at).filter(RevokedToken.expires_at > now)
+        if self._synced_at is not None:
+            # Небольшой запас на расхождение часов и незакоммиченные на момент прошлой синхронизации записи
+            query = query.filter(RevokedToken.revoked_at >= self._synced_at - timedelta(seconds=5))
+        for jti, expires_at in query:
+            self.add(jti, expires_at.replace(tzinfo=timezone.utc).timestamp())
+        self._synced_at = now
+        self.evict_expired()
+
+    @staticmethod
+    def purge(db: Session) -> int:
+        """Удаляет из БД записи об уже истёкших токенах."""
+        deleted = db.query(RevokedToken).filter(RevokedToken.expires_at <= datetime.utcnow()).delete()
+        db.commit()
+        return deleted
+
+
+revocation_list = RevocationList()
+
+
+def _sync_revocations(session_factory: Callable[[], Session]) -> None:
+    db = session_factory()
+    try:
+        revocation_list.sync(db)
+        revocation_list.purge(db)
+    finally:
+        db.close()
+
+
+async def revocation_sync_loop(session_factory: Callable[[], Session], interval: float = None) -> None:
+    """Фоновая задача: периодически подтягивает отзывы из БД и чистит истёкшие."""
+    interval = REVOCATION_SYNC_INTERVAL if interval is None else interval
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(_sync_revocations, session_factory)
+        except Exception as e:
+            logger.error("Revocation list sync failed: %s", e)
 
-class JWTAuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Пропускаем публичные пути
-        for path in PUBLIC_PATHS:
-            if request.url.path.startswith(path):
-                return await call_next(request)
 
-        token = None
-        try:
-            auth_header = request.headers.get("authorization")
-            if auth_header:
-                scheme, _, param = auth_header.partition(" ")
-                if scheme.lower() == "bearer":
-                    token = param
+def decode_refresh_token(token: str) -> dict:
+    """Проверяет refresh-токен (подпись, срок, тип, отзыв) и возвращает payload."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        payload = None
+
+    if (not payload or payload.get("type") != "refresh" or not payload.get("sub")
+            or not payload.get("jti") or revocation_list.is_revoked(payload["jti"])):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return payload
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Кто выполняет запрос: id и роли пользователя. Хранится в request.state.principal."""
+    user_id: int
+    is_admin: bool = False
+    is_cook: bool = False
+
+
+class PrincipalCache:
+    """Кэш Principal по user_id с коротким TTL; сбрасывается при смене ролей."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[Principal, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        principal, expires_at = entry
+        if expires_at < time.monotonic():
+            self.invalidate(user_id)
+            return None
+        return principal
+
+    def put(self, principal: Principal) -> None:
+        with self._lock:
+            self._entries[principal.user_id] = (principal, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL)
+
+
+# Один предкомпилированный регэксп вместо перебора PUBLIC_PATHS со startswith
+_PUBLIC_PATH_RE = re.compile("|".join(re.escape(path) for path in PUBLIC_PATHS))
 
+
+def _bearer_token(scope: Scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, param = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                return param
+            return None
+    return None
+
+
+class JWTAuthMiddleware:
+    """
+    Чистый ASGI-middleware: декодирует JWT и кладёт user_id (и Principal из кэша)
+    в request.state. Ответ не оборачивается и не буферизуется.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            # Путь относительно точки монтирования (/api у render_front)
+            path = scope["path"]
+            root_path = scope.get("root_path", "")
+            if root_path and path.startswith(root_path):
+                path = path[len(root_path):]
+
+            # Пропускаем публичные пути
+            if not _PUBLIC_PATH_RE.match(path):
+                self._authenticate(scope)
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _authenticate(scope: Scope) -> None:
+        try:
+            token = _bearer_token(scope)
             if not token:
-                return await call_next(request)
+                return
 
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             user_id = payload.get("sub")
             if not user_id:
-                return await call_next(request)
-
-            request.state.user_id = int(user_id)
+                return
+
+            # Refresh-токен не даёт доступа к API; отозванные токены отклоняем
+            if payload.get("type", "access") != "access":
+                return
+            jti = payload.get("jti")
+            if jti and revocation_list.is_revoked(jti):
+                return
+
+            state = scope.setdefault("state", {})
+            state["user_id"] = int(user_id)
+            state["token_jti"] = jti
+            state["token_exp"] = payload.get("exp")
+            principal = principal_cache.get(state["user_id"])
+            if principal is not None:
+                state["principal"] = principal
         except Exception as e:
-            logger.debug(f"JWT decode error: {e}")
+            logger.debug("JWT decode error: %s", e)
             # Не шлём 401 здесь, чтобы публичные страницы работали корректно
 
-        return await call_next(request)
-
 
 def get_current_user_id(
         request: Request,
@@ -95,41 +327,47 @@ def get_current_user_id(
     return user_id
 
 
-def require_admin(request: Request, db: Session) -> User:
+def get_principal(request: Request, db: Session) -> Principal:
+    """Principal текущего запроса: из request.state, из кэша или (при промахе) из БД."""
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
+
     user_id = get_current_user_id(request)
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        row = db.query(User.id, User.is_admin, User.is_cook).filter(User.id == user_id).first()
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        principal = Principal(user_id=row.id, is_admin=bool(row.is_admin), is_cook=bool(row.is_cook))
+        principal_cache.put(principal)
 
-    user = db.query(User).filter(User.id == user_id).first()
+    request.state.principal = principal
+    return principal
 
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
 
-    if not user.is_admin:
+def require_admin(request: Request, db: Session) -> Principal:
+    principal = get_principal(request, db)
+
+    if not principal.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough privileges (Admin required)"
         )
 
-    return user
+    return principal
 
 
-def require_cook_or_admin(request: Request, db: Session) -> User:
-    user_id = get_current_user_id(request)
-
-    user = db.query(User).filter(User.id == user_id).first()
-
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
+def require_cook_or_admin(request: Request, db: Session) -> Principal:
+    principal = get_principal(request, db)
 
-    if not (user.is_admin or user.is_cook):
+    if not (principal.is_admin or principal.is_cook):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough privileges (Cook or Admin required)"
         )
 
-    return user
+    return principal
@@ -0,0 +1,214 @@
+"""
+Общие помощники бенчмарков: временная база, запуск API отдельным процессом,
+нагрузка параллельными клиентами и сводка задержек.
+
+Сравнение «до/после» — тот же бенчмарк против другого дерева кода:
+    git worktree add /tmp/before <commit>~1
+    python bench/bench_orders.py --app-dir /tmp/before/NewAtt
+    python bench/bench_orders.py
+Деревья до появления database.py пишут в ./app.db, поэтому и API, и подготовка
+данных работают в отдельном временном каталоге (он же cwd).
+
+Нужны зависимости из requirements-dev.txt (httpx).
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from types import ModuleType
+from typing import Awaitable, Callable, Dict, Iterator, List
+
+import httpx
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parser(description: str, requests: int, concurrency: int) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--app-dir", default=APP_DIR, help="каталог NewAtt проверяемого дерева")
+    parser.add_argument("--requests", type=int, default=requests, help="всего запросов")
+    parser.add_argument("--concurrency", type=int, default=concurrency, help="параллельных клиентов")
+    return parser
+
+
+def bench_env(work_dir: str) -> Dict[str, str]:
+    return {
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'app.db')}",
+        "LOG_DIR": os.path.join(work_dir, "logs"),
+        "LOG_LEVEL": "WARNING",
+        "UPLOAD_DIR": os.path.join(work_dir, "uploads"),
+        "REPORT_CACHE_DIR": os.path.join(work_dir, "reports"),
+        "MAIL_BACKEND": "console",
+        "MAIL_WORKER": "0",
+        "METRICS_SLOW_REQUEST_SECONDS": "3600",
+        "SECRET_KEY": "bench-secret-key-" + "0" * 32,
+    }
+
+
+@contextlib.contextmanager
+def work_dir() -> Iterator[str]:
+    with tempfile.TemporaryDirectory(prefix="newatt-bench-") as path:
+        yield path
+
+
+def load_app(app_dir: str, work_dir: str, env: Dict[str, str] = None) -> ModuleType:
+    """Импортирует main проверяемого дерева с базой в work_dir и создаёт схему."""
+    os.environ.update(env or bench_env(work_dir))
+    os.chdir(work_dir)
+    sys.path.insert(0, os.path.abspath(app_dir))
+    main = importlib.import_module("main")
+    try:
+        migrate = importlib.import_module("migrate")
+    except ImportError:
+        pass  # дерево до миграций: таблицы создаются при импорте main
+    else:
+        migrate.upgrade(main.engine)
+    return main
+
+
+def access_token(user_id: int) -> str:
+    return importlib.import_module("auth").create_access_token({"sub": str(user_id)})
+
+
+def week_start(today: date = None) -> date:
+    today = today or date.today()
+    return today - timedelta(days=today.weekday()) + timedelta(days=7)
+
+
+def seed_menu(main: ModuleType, days: int = 5, dishes_per_day: int = 6) -> Dict[int, List[int]]:
+    """Блюда и меню на следующую неделю: {день недели: [dish_id, ...]}."""
+    models = importlib.import_module("models")
+    db = main.SessionLocal()
+    try:
+        menu = {}
+        week = week_start()
+        for day in range(1, days + 1):
+            dishes = [
+                models.Dish(name=f"Блюдо {day}-{i}", type=models.DishType.MAIN, composition="",
+                            quantity_grams=200, price_rub=50.0 + i)
+                for i in range(dishes_per_day)
+            ]
+            db.add_all(dishes)
+            db.flush()
+            db.add_all([models.ModuleMenu(day_of_week=day, dish_id=d.id, week_start_date=week) for d in dishes])
+            menu[day] = [d.id for d in dishes]
+        db.commit()
+        return menu
+    finally:
+        db.close()
+
+
+def seed_users(main: ModuleType, count: int, password_hash: str = None) -> List[int]:
+    models = importlib.import_module("models")
+    db = main.SessionLocal()
+    try:
+        users = [
+            models.User(name=f"Ученик{i}", secondary_name="Тестовый", email=f"bench{i}@example.com",
+                        status="10A", email_verified=True, password_hash=password_hash)
+            for i in range(count)
+        ]
+        db.add_all(users)
+        db.commit()
+        return [u.id for u in users]
+    finally:
+        db.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def api_server(app_dir: str, work_dir: str, env: Dict[str, str] = None, workers: int = 1) -> Iterator[str]:
+    """Запускает uvicorn main:app проверяемого дерева; отдаёт базовый URL."""
+    port = _free_port()
+    process_env = {**os.environ, **(env or bench_env(work_dir))}
+    process_env["PYTHONPATH"] = os.path.abspath(app_dir)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=work_dir, env=process_env,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"API server exited with code {process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                    break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("API server did not start in 30 s")
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+@dataclass
+class LoadResult:
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    statuses: Dict[int, int] = field(default_factory=dict)
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self, title: str) -> str:
+        statuses = ", ".join(f"{code}: {count}" for code, count in sorted(self.statuses.items()))
+        return (
+            f"{title}: {len(self.latencies)} requests in {self.elapsed:.2f} s, {self.throughput:.1f} req/s, "
+            f"p50 {self.percentile(50) * 1000:.1f} ms, p95 {self.percentile(95) * 1000:.1f} ms, "
+            f"p99 {self.percentile(99) * 1000:.1f} ms ({statuses})"
+        )
+
+
+Request = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+async def run_load(client: httpx.AsyncClient, request: Request, total: int, concurrency: int) -> LoadResult:
+    """total запросов от concurrency клиентов; request(client, i) отправляет i-й запрос."""
+    result = LoadResult()
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                code = (await request(client, i)).status_code
+            except httpx.HTTPError:
+                code = 0  # ошибка соединения или таймаут
+            result.latencies.append(time.perf_counter() - started)
+            result.statuses[code] = result.statuses.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def http_client(base_url: str, concurrency: int, timeout: float = 120) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    return httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout)
@@ -0,0 +1,79 @@
+"""
+Задержки горячих эндпоинтов (GET /menu, /orders, /users/me) при 500 параллельных клиентах.
+
+Запуск:
+    python bench/bench_latency.py [--requests 10000] [--concurrency 500] [--timeout 30] [--app-dir DIR]
+Печатает p50/p95/p99 по каждому эндпоинту и в целом; для сравнения «до/после»
+запустите с --app-dir на дереве до async-сессии (см. bench/_common.py).
+Запрос, не получивший ответа за --timeout секунд, считается со статусом 0.
+"""
+import asyncio
+import importlib
+import time
+
+import _common
+
+ENDPOINTS = ("/menu", "/orders", "/users/me")
+
+
+def seed_orders(app, user_ids: list, menu: dict, per_user: int = 3) -> None:
+    models = importlib.import_module("models")
+    db = app.SessionLocal()
+    try:
+        for user_id in user_ids:
+            for _ in range(per_user):
+                order = models.Order(user_id=user_id, week_start_date=_common.week_start(),
+                                     status=models.OrderStatus.PENDING, total_amount=250.0)
+                db.add(order)
+                db.flush()
+                db.add_all([models.OrderItem(order_id=order.id, dish_id=dish_ids[0], day_of_week=day, quantity=1)
+                            for day, dish_ids in menu.items()])
+        db.commit()
+    finally:
+        db.close()
+
+
+async def bench(base_url: str, tokens: list, total: int, concurrency: int, timeout: float) -> dict:
+    per_endpoint = {path: _common.LoadResult() for path in ENDPOINTS}
+
+    async def request(client, i):
+        path = ENDPOINTS[i % len(ENDPOINTS)]
+        started = time.perf_counter()
+        result = per_endpoint[path]
+        try:
+            response = await client.get(path, headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"})
+        except Exception:
+            result.statuses[0] = result.statuses.get(0, 0) + 1
+            raise
+        finally:
+            result.latencies.append(time.perf_counter() - started)
+        result.statuses[response.status_code] = result.statuses.get(response.status_code, 0) + 1
+        return response
+
+    async with _common.http_client(base_url, concurrency, timeout) as client:
+        await _common.run_load(client, request, concurrency, concurrency)
+        per_endpoint = {path: _common.LoadResult() for path in ENDPOINTS}
+        overall = await _common.run_load(client, request, total, concurrency)
+    for result in per_endpoint.values():
+        result.elapsed = overall.elapsed
+    return {"all": overall, **per_endpoint}
+
+
+def main() -> None:
+    parser = _common.parser(__doc__.strip().splitlines()[0], requests=10000, concurrency=500)
+    parser.add_argument("--timeout", type=float, default=30, help="таймаут запроса, с")
+    args = parser.parse_args()
+    with _common.work_dir() as work_dir:
+        app = _common.load_app(args.app_dir, work_dir)
+        menu = _common.seed_menu(app)
+        user_ids = _common.seed_users(app, 500)
+        seed_orders(app, user_ids, menu)
+        tokens = [_common.access_token(user_id) for user_id in user_ids]
+        with _common.api_server(args.app_dir, work_dir) as base_url:
+            results = asyncio.run(bench(base_url, tokens, args.requests, args.concurrency, args.timeout))
+    for name, result in results.items():
+        print(result.summary(f"{name} ({args.concurrency} clients)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Пропускная способность запросов с включённым и выключенным логированием.
+
+Гоняет GET /menu и GET /users/me прямо через ASGI-приложение (без сети), сначала
+с логированием по настройкам дерева, затем с logging.disable. Разница — цена
+логирования на пути запроса. Отдельно меряется время одного вызова logger.info
+в потоке запроса. stdout на время замера направляется в /dev/null.
+Запуск:
+    python bench/bench_logging.py [--requests 3000] [--concurrency 8] [--log-calls 20000]
+                                  [--log-level DEBUG] [--app-dir DIR]
+Для сравнения «до/после» запустите с --app-dir на дереве до QueueHandler
+(см. bench/_common.py).
+"""
+import asyncio
+import contextlib
+import logging
+import importlib
+import os
+import sys
+import time
+
+import httpx
+
+import _common
+
+ENDPOINTS = ("/menu", "/users/me")
+
+
+@contextlib.contextmanager
+def stdout_to_devnull():
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+async def bench(app, tokens: list, total: int, concurrency: int) -> _common.LoadResult:
+    async def request(client, i):
+        headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        return await client.get(ENDPOINTS[i % len(ENDPOINTS)], headers=headers)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await _common.run_load(client, request, concurrency * 10, concurrency)
+        return await _common.run_load(client, request, total, concurrency)
+
+
+def log_call_seconds(logger: logging.Logger, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        logger.info("Order %s created for user %s", i, i % 50)
+    return (time.perf_counter() - started) / calls
+
+
+def main() -> None:
+    parser = _common.parser(__doc__.strip().splitlines()[0], requests=3000, concurrency=8)
+    parser.add_argument("--log-calls", type=int, default=20000, help="вызовов logger.info для замера")
+    parser.add_argument("--log-level", default="DEBUG", help="LOG_LEVEL для прогона с логированием")
+    args = parser.parse_args()
+    with _common.work_dir() as work_dir:
+        env = {**_common.bench_env(work_dir), "LOG_LEVEL": args.log_level}
+        app = _common.load_app(args.app_dir, work_dir, env)
+        _common.seed_menu(app)
+        tokens = [_common.access_token(user_id) for user_id in _common.seed_users(app, 50)]
+        with stdout_to_devnull():
+            enabled = asyncio.run(bench(app.app, tokens, args.requests, args.concurrency))
+            per_call = log_call_seconds(importlib.import_module("logger").logger, args.log_calls)
+            logging.disable(logging.CRITICAL)
+            disabled = asyncio.run(bench(app.app, tokens, args.requests, args.concurrency))
+            logging.disable(logging.NOTSET)
+    print(enabled.summary(f"logging on ({args.log_level})"))
+    print(disabled.summary("logging off"))
+    print(f"logging overhead: {(1 - enabled.throughput / disabled.throughput) * 100:.1f}% of throughput")
+    print(f"logger.info in the calling thread: {per_call * 1e6:.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Всплеск входов: параллельные POST /auth/token и задержка чтения меню в это время.
+
+Имитирует начало учебного дня: --requests входов от --concurrency клиентов,
+одновременно 20 клиентов читают GET /menu. Печатает пропускную способность
+входов и p99 меню в покое и во время всплеска.
+Запуск:
+    python bench/bench_login.py [--requests 300] [--concurrency 50] [--app-dir DIR]
+Для сравнения «до/после» запустите с --app-dir на дереве с хешированием в
+потоке запроса (см. bench/_common.py).
+"""
+import asyncio
+import time
+
+import _common
+
+PASSWORD = "bench-password"
+READERS = 20
+
+
+async def read_menu_until(client, stop: asyncio.Event) -> _common.LoadResult:
+    result = _common.LoadResult()
+
+    async def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                code = (await client.get("/menu")).status_code
+            except Exception:
+                code = 0
+            result.latencies.append(time.perf_counter() - started)
+            result.statuses[code] = result.statuses.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(reader() for _ in range(READERS)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def bench(base_url: str, users: int, total: int, concurrency: int) -> dict:
+    async def login(client, i):
+        return await client.post("/auth/token", json={"email": f"bench{i % users}@example.com", "password": PASSWORD})
+
+    async with _common.http_client(base_url, concurrency + READERS) as client:
+        idle = await _common.run_load(client, lambda c, i: c.get("/menu"), 1000, READERS)
+
+        stop = asyncio.Event()
+        readers = asyncio.create_task(read_menu_until(client, stop))
+        burst = await _common.run_load(client, login, total, concurrency)
+        stop.set()
+        during = await readers
+    return {"GET /menu, idle": idle, "POST /auth/token burst": burst, "GET /menu during burst": during}
+
+
+def main() -> None:
+    args = _common.parser(__doc__.strip().splitlines()[0], requests=300, concurrency=50).parse_args()
+    with _common.work_dir() as work_dir:
+        app = _common.load_app(args.app_dir, work_dir)
+        _common.seed_menu(app)
+        users = min(args.requests, 200)
+        _common.seed_users(app, users, password_hash=app.get_password_hash(PASSWORD))
+        with _common.api_server(args.app_dir, work_dir) as base_url:
+            results = asyncio.run(bench(base_url, users, args.requests, args.concurrency))
+    for name, result in results.items():
+        print(result.summary(name))
+
+
+if __name__ == "__main__":
+    main()
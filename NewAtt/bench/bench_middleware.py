@@ -0,0 +1,83 @@
+"""
+Микробенчмарк накладных расходов JWTAuthMiddleware на запрос.
+
+Middleware вызывается напрямую как ASGI-приложение поверх пустого приложения,
+без сети и сервера; из времени вычитается вызов самого пустого приложения.
+Запуск:
+    python bench/bench_middleware.py [--requests 20000] [--app-dir DIR]
+Для сравнения «до/после» запустите с --app-dir на дереве с BaseHTTPMiddleware
+(см. bench/_common.py).
+"""
+import asyncio
+import importlib
+import time
+
+import _common
+
+
+async def empty_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-length", b"2")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def make_scope(path: str, token: str = None) -> dict:
+    headers = [(b"host", b"bench"), (b"user-agent", b"bench")]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": headers, "server": ("bench", 80), "client": ("127.0.0.1", 50000),
+    }
+
+
+async def per_request_seconds(app, scope: dict, requests: int) -> float:
+    request_message = {"type": "http.request", "body": b"", "more_body": False}
+    never = asyncio.Event()
+
+    async def receive():
+        nonlocal request_message
+        if request_message is not None:
+            message, request_message = request_message, None
+            return message
+        await never.wait()
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_message = {"type": "http.request", "body": b"", "more_body": False}
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+async def bench(auth, token: str, requests: int) -> list:
+    middleware = auth.JWTAuthMiddleware(empty_app)
+    cases = [
+        ("public path", "/auth/token", None),
+        ("protected, no token", "/menu", None),
+        ("protected, valid token", "/menu", token),
+    ]
+    # Прогрев
+    await per_request_seconds(middleware, make_scope("/menu", token), 1000)
+    bare = await per_request_seconds(empty_app, make_scope("/menu", token), requests)
+    rows = []
+    for name, path, case_token in cases:
+        total = await per_request_seconds(middleware, make_scope(path, case_token), requests)
+        rows.append((name, total, total - bare))
+    return [("empty app", bare, 0.0)] + rows
+
+
+def main() -> None:
+    args = _common.parser(__doc__.strip().splitlines()[0], requests=20000, concurrency=1).parse_args()
+    with _common.work_dir() as work_dir:
+        _common.load_app(args.app_dir, work_dir)
+        auth = importlib.import_module("auth")
+        rows = asyncio.run(bench(auth, _common.access_token(1), args.requests))
+    for name, total, overhead in rows:
+        print(f"{name:24} {total * 1e6:8.1f} us/request  (middleware overhead {overhead * 1e6:6.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Пропускная способность POST /orders (заказов в секунду) под параллельной нагрузкой.
+
+Каждый заказ — полная неделя: 5 дней × 6 блюд. Запуск:
+    python bench/bench_orders.py [--requests 2000] [--concurrency 32] [--app-dir DIR]
+Для сравнения «до/после» запустите его ещё раз с --app-dir на дереве до
+пакетной загрузки блюд (см. bench/_common.py).
+"""
+import asyncio
+
+import _common
+
+
+async def bench(base_url: str, tokens: list, menu: dict, total: int, concurrency: int) -> _common.LoadResult:
+    payload = {
+        "week_start_date": _common.week_start().isoformat(),
+        "days": [
+            {"day_of_week": day, "items": [{"dish_id": dish_id, "quantity": 1} for dish_id in dish_ids]}
+            for day, dish_ids in menu.items()
+        ],
+    }
+
+    async def create_order(client, i):
+        headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        return await client.post("/orders", json=payload, headers=headers)
+
+    async with _common.http_client(base_url, concurrency) as client:
+        # Прогрев: соединения, кэши, JIT-ы драйверов
+        await _common.run_load(client, create_order, concurrency, concurrency)
+        return await _common.run_load(client, create_order, total, concurrency)
+
+
+def main() -> None:
+    args = _common.parser(__doc__.strip().splitlines()[0], requests=2000, concurrency=32).parse_args()
+    with _common.work_dir() as work_dir:
+        app = _common.load_app(args.app_dir, work_dir)
+        menu = _common.seed_menu(app)
+        tokens = [_common.access_token(user_id) for user_id in _common.seed_users(app, 100)]
+        with _common.api_server(args.app_dir, work_dir) as base_url:
+            result = asyncio.run(bench(base_url, tokens, menu, args.requests, args.concurrency))
+    print(result.summary(f"POST /orders ({sum(len(d) for d in menu.values())} items, "
+                         f"{args.concurrency} clients)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
 from docx import Document
 from docx.shared import Cm, Pt
-import os
 
 
-def generate_table_setting_report(orders_data, filename="table_report.docx", period: str = None, grand_total: float = None):
+def _format_dishes(dishes) -> str:
+    # Компактная запись: одна строка на блюдо, количество — через «×N»
+    lines = []
+    for name, qty in dishes:
+        lines.append(str(name) if qty == 1 else f"{name} ×{qty}")
+    return "\n".join(lines)
+
+
+def generate_table_setting_report(orders_data, file_path: str, period: str = None) -> str:
+    """
+    Формирует DOCX-отчёт для накрытия столов и сохраняет его один раз в file_path.
+
+    orders_data — итерируемый источник (можно генератор) блоков вида
+    { 'user_name': 'Имя Фамилия', 'dishes': [('Суп', 2), ...], 'total': float }.
+    Итог по всем пользователям считается по ходу обхода.
+    """
     document = Document()
 
     sections = document.sections
@@ -26,43 +40,29 @@ def generate_table_setting_report(orders_data, filename="table_report.docx", per
         run_h.font.size = Pt(12)
         p_header.paragraph_format.space_after = Pt(6)
 
-    for order in orders_data:
-        # Ожидаем структуру: { 'user_name': 'Имя Фамилия', 'dishes': [...], 'total': float }
-        name = order.get('user_name', '').strip()
-        dishes = order.get('dishes', []) or []
-        total = order.get('total', 0.0) or 0.0
+    table = document.add_table(rows=1, cols=3)
+    table.style = 'Table Grid'
+    header_cells = table.rows[0].cells
+    for cell, title in zip(header_cells, ("Ученик", "Блюда", "Итого")):
+        cell.paragraphs[0].add_run(title).bold = True
 
-        # Имя пользователя
-        p_name = document.add_paragraph()
-        run = p_name.add_run(name)
-        run.bold = True
-        run.font.size = Pt(11)
-
-        # Список блюд (каждое в новую строку или через запятую если кратко)
-        if dishes:
-            # Ограничим длинные списки — покажем по одному на строку
-            for d in dishes:
-                p_d = document.add_paragraph()
-                p_d.paragraph_format.left_indent = Cm(0.5)
-                run_d = p_d.add_run(str(d))
-                run_d.font.size = Pt(11)
+    grand_total = 0.0
+    for order in orders_data:
+        name = (order.get('user_name') or '').strip()
+        dishes = order.get('dishes') or []
+        total = order.get('total') or 0.0
+        grand_total += total
 
-        # Итоговая сумма
-        p_total = document.add_paragraph()
-        p_total.paragraph_format.space_after = Pt(8)
-        run_t = p_total.add_run(f"Итого: {total:.2f} ₽")
-        run_t.bold = True
-        run_t.font.size = Pt(11)
+        name_cell, dishes_cell, total_cell = table.add_row().cells
+        name_cell.paragraphs[0].add_run(name).bold = True
+        dishes_cell.text = _format_dishes(dishes)
+        total_cell.text = f"{total:.2f} ₽"
 
-    os.makedirs("reports", exist_ok=True)
-    file_path = os.path.join("reports", filename)
-    document.save(file_path)
     # Итог по всем пользователям
-    if grand_total is not None:
-        p_final = document.add_paragraph()
-        run_f = p_final.add_run(f"Итого по всем: {grand_total:.2f} ₽")
-        run_f.bold = True
-        run_f.font.size = Pt(12)
+    final_cells = table.add_row().cells
+    label_cell = final_cells[0].merge(final_cells[1])
+    label_cell.paragraphs[0].add_run("Итого по всем").bold = True
+    final_cells[2].paragraphs[0].add_run(f"{grand_total:.2f} ₽").bold = True
 
     document.save(file_path)
-    return file_path
\ No newline at end of file
+    return file_path
@@ -0,0 +1,256 @@
+"""
+Статика и HTML-страницы фронтенда (front12345) из памяти.
+
+При старте все файлы с расширениями из STATIC_EXTENSIONS читаются в память,
+для текстовых заранее готовятся gzip- и (если установлен пакет brotli)
+br-варианты, ETag считается по хэшу содержимого. Запрос статики — поиск
+в словаре без обращения к диску и БД; If-None-Match отвечается 304.
+
+Поиск по имени файла как раньше: сначала <front>/<имя>, затем <front>/<расширение>/<имя>
+(например, /js/script.js и /script.js -> front12345/js/script.js).
+
+Кэширование в браузере: по умолчанию Cache-Control: no-cache (браузер
+перепроверяет ETag и получает 304); если в URL передана версия ?v=<etag> —
+ответ кэшируется на STATIC_MAX_AGE секунд как immutable. Ссылки на статику
+в страницах при загрузке дополняются такой версией.
+
+PageRouter — таблица маршрутов страниц: каждый алиас (и алиас.html) заранее
+связан с готовой страницей, 404 и ошибки тоже отдаются из памяти. В режиме
+разработки (FRONTEND_DEV=1) watch() следит за файлами и перезагружает изменённые.
+"""
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import urllib.parse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+from starlette.requests import Request
+from starlette.responses import RedirectResponse, Response
+
+from logger import logger
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен
+    brotli = None
+
+STATIC_EXTENSIONS = (".js", ".css", ".png", ".jpg", ".jpeg", ".svg", ".ico")
+# Сжимаем только текстовые форматы; картинки уже сжаты
+COMPRESSIBLE_EXTENSIONS = (".js", ".css", ".svg", ".html")
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 365 * 24 * 3600))
+FRONTEND_DEV = os.getenv("FRONTEND_DEV", "0").lower() in ("1", "true", "yes")
+FRONTEND_RELOAD_INTERVAL = float(os.getenv("FRONTEND_RELOAD_INTERVAL", 1.0))
+_MIN_COMPRESS_SIZE = 512
+
+
+@dataclass(frozen=True)
+class Asset:
+    body: bytes
+    media_type: str
+    etag: str
+    gzip_body: Optional[bytes] = None
+    br_body: Optional[bytes] = None
+
+    @property
+    def version(self) -> str:
+        """Версия для URL (?v=...) — хэш содержимого без кавычек."""
+        return self.etag.strip('"')
+
+    def response(self, request: Request, status_code: int = 200, cache_control: str = None) -> Response:
+        if cache_control is None:
+            versioned = request.query_params.get("v") == self.version
+            cache_control = f"public, max-age={STATIC_MAX_AGE}, immutable" if versioned else "no-cache"
+        headers = {"ETag": self.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+        if status_code == 200 and self.etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        body = self.body
+        accept_encoding = request.headers.get("accept-encoding", "")
+        if self.br_body is not None and "br" in accept_encoding:
+            body = self.br_body
+            headers["Content-Encoding"] = "br"
+        elif self.gzip_body is not None and "gzip" in accept_encoding:
+            body = self.gzip_body
+            headers["Content-Encoding"] = "gzip"
+        return Response(content=body, status_code=status_code, media_type=self.media_type, headers=headers)
+
+
+def load_asset(path: Path) -> Asset:
+    return make_asset(path.read_bytes(), path.name)
+
+
+def make_asset(body: bytes, name: str) -> Asset:
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    gzip_body = br_body = None
+    if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS and len(body) >= _MIN_COMPRESS_SIZE:
+        # mtime=0 — одинаковый результат для одинакового содержимого
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            gzip_body = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                br_body = compressed
+    return Asset(body=body, media_type=media_type, etag=etag, gzip_body=gzip_body, br_body=br_body)
+
+
+class AssetIndex:
+    """Статические файлы фронтенда в памяти, ключ — имя файла."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._assets: Dict[str, Asset] = {}
+        self.load()
+
+    def load(self) -> None:
+        assets: Dict[str, Asset] = {}
+        # Файлы в каталогах по расширению (js/, css/, ...) — ниже приоритетом, чем в корне
+        for extension in STATIC_EXTENSIONS:
+            directory = self.root / extension[1:]
+            if directory.is_dir():
+                for path in directory.iterdir():
+                    if path.is_file() and path.suffix.lower() == extension:
+                        assets[path.name] = load_asset(path)
+        if self.root.is_dir():
+            for path in self.root.iterdir():
+                if path.is_file() and path.suffix.lower() in STATIC_EXTENSIONS:
+                    assets[path.name] = load_asset(path)
+
+        self._assets = assets
+        total = sum(len(asset.body) for asset in assets.values())
+        logger.info("Static assets loaded: %d files, %d bytes (brotli: %s)", len(assets), total, brotli is not None)
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        return self._assets.get(os.path.basename(path))
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+
+# src="js/script.js", href="../css/dashboard.css" и т.п. (без схемы и без своего query)
+_ASSET_URL_RE = re.compile(
+    r'((?:src|href)=")((?![a-z]+:|//)[^"?#]+(?:' + "|".join(re.escape(e) for e in STATIC_EXTENSIONS) + r'))"'
+)
+
+
+def _version_asset_urls(html: bytes, assets: AssetIndex) -> bytes:
+    """Добавляет ?v=<версия> к ссылкам на известную статику, чтобы её можно было кэшировать надолго."""
+    text = html.decode("utf-8")
+
+    def replace(match: re.Match) -> str:
+        asset = assets.lookup(match.group(2))
+        if asset is None:
+            return match.group(0)
+        return f'{match.group(1)}{match.group(2)}?v={asset.version}"'
+
+    return _ASSET_URL_RE.sub(replace, text).encode("utf-8")
+
+
+class PageRouter:
+    """
+    Маршруты HTML-страниц: один поиск в словаре на запрос.
+    Алиас, чей файл отсутствует, заранее превращается в редирект на страницу ошибки.
+    """
+
+    def __init__(self, root: Path, mapping: Mapping[str, str], assets: AssetIndex,
+                 not_found_page: str = "404.html", error_page: str = "error.html"):
+        self.root = root
+        self.mapping = dict(mapping)
+        self.assets = assets
+        self.not_found_page = not_found_page
+        self.error_page = error_page
+        self._pages: Dict[str, Asset] = {}
+        self._broken: Dict[str, str] = {}
+        self._not_found: Optional[Asset] = None
+        self.load()
+
+    def _error_url(self, message: str) -> str:
+        query = urllib.parse.urlencode({
+            "code": 500,
+            "message": message,
+            "details": "Exception occurred: FileNotFoundError",
+        })
+        return f"/{self.error_page}?{query}"
+
+    def load(self) -> None:
+        files: Dict[str, Optional[Asset]] = {}
+
+        def page(file: str) -> Optional[Asset]:
+            if file not in files:
+                path = self.root / file
+                files[file] = (
+                    make_asset(_version_asset_urls(path.read_bytes(), self.assets), path.name)
+                    if path.is_file() else None
+                )
+            return files[file]
+
+        pages: Dict[str, Asset] = {}
+        broken: Dict[str, str] = {}
+        for alias, file in self.mapping.items():
+            asset = page(file)
+            # Один словарь и для "main", и для "main.html"
+            for key in (alias, f"{alias}.html"):
+                if asset is not None:
+                    pages[key] = asset
+                else:
+                    broken[key] = self._error_url(f"File {self.root / file} doesn't exist")
+
+        missing = sorted({file for file, asset in files.items() if asset is None})
+        if missing:
+            logger.warning("Frontend pages not found: %s", ", ".join(missing))
+
+        self._pages = pages
+        self._broken = broken
+        self._not_found = page(self.not_found_page)
+        logger.info("Frontend pages loaded: %d routes, %d files", len(pages), len(files) - len(missing))
+
+    def respond(self, path: str, request: Request) -> Response:
+        asset = self._pages.get(path)
+        if asset is not None:
+            return asset.response(request, cache_control="no-cache")
+
+        redirect_url = self._broken.get(path)
+        if redirect_url is not None:
+            return RedirectResponse(url=redirect_url, status_code=307)
+
+        if self._not_found is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        return self._not_found.response(request, status_code=404, cache_control="no-cache")
+
+
+def _snapshot(root: Path) -> Dict[str, int]:
+    snapshot = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                snapshot[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                pass
+    return snapshot
+
+
+async def watch(assets: AssetIndex, pages: PageRouter, interval: float = None) -> None:
+    """Режим разработки: опрашивает mtime файлов фронтенда и перезагружает всё при изменении."""
+    interval = FRONTEND_RELOAD_INTERVAL if interval is None else interval
+    previous = await asyncio.to_thread(_snapshot, assets.root)
+    while True:
+        await asyncio.sleep(interval)
+        current = await asyncio.to_thread(_snapshot, assets.root)
+        if current == previous:
+            continue
+        previous = current
+        try:
+            # Сначала статика — страницы берут из неё версии ссылок
+            await asyncio.to_thread(assets.load)
+            await asyncio.to_thread(pages.load)
+        except Exception as e:
+            logger.error("Frontend reload failed: %s", e)
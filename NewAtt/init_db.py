@@ -1,14 +1,13 @@
 from __future__ import annotations
 
-from sqlalchemy import create_engine
-
+import migrate
+from database import DATABASE_URL, create_db_engine
 from logger import logger
-from models import Base
 
 
-def init_db(database_url: str = "sqlite:///./app.db") -> None:
-    engine = create_engine(database_url, echo=True)
-    Base.metadata.create_all(bind=engine)
+def init_db(database_url: str = None) -> None:
+    engine = create_db_engine(database_url)
+    migrate.upgrade(engine)
 
     from dotenv import load_dotenv
 
@@ -23,7 +22,7 @@ def init_db(database_url: str = "sqlite:///./app.db") -> None:
     session = SessionLocal()
     existing = session.query(User).filter(User.email == admin_email).first()
     if existing:
-        logger.debug(f"Admin user already exists: {admin_email}")
+        logger.debug("Admin user already exists: %s", admin_email)
     else:
         admin_name = os.getenv("ADMIN_NAME", "129Admin")
         admin_secondary = os.getenv("ADMIN_SECONDARY", "1")
@@ -35,20 +34,21 @@ def init_db(database_url: str = "sqlite:///./app.db") -> None:
             status=admin_status,
             is_admin=True,
             email_verified=True,
-            verification_code=None,
         )
         session.add(new_admin)
         session.commit()
         session.refresh(new_admin)
         logger.info(new_admin.id)
         token = create_access_token({"sub": new_admin.id})
-        logger.info(f"Default admin created: {admin_email}")
-        logger.debug(f"ADMIN_ACCESS_TOKEN={token}")
+        logger.info("Default admin created: %s", admin_email)
+        logger.debug("ADMIN_ACCESS_TOKEN=%s", token)
+
+    session.close()
 
 
 
 if __name__ == "__main__":
     import sys
 
-    database_url = sys.argv[1] if len(sys.argv) > 1 else "sqlite:///./app.db"
+    database_url = sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL
     init_db(database_url)
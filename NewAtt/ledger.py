@@ -0,0 +1,107 @@
+"""
+Баланс пользователей в целых копейках и журнал движений balance_ledger.
+
+Баланс меняется одним условным UPDATE, например при списании:
+    UPDATE users SET balance_kopecks = balance_kopecks - :amount
+    WHERE id = :user_id AND balance_kopecks >= :amount
+    RETURNING balance_kopecks
+Проверку и списание выполняет сама БД, поэтому параллельные списания не могут
+оба пройти проверку и увести баланс в минус — без блокировок в приложении и
+без чтения баланса в Python. В той же транзакции в журнал добавляется запись
+с суммой и остатком после операции. Коммитит вызывающий код.
+
+Проверка, что журнал сходится с балансами: python ledger.py check [database_url]
+"""
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import BalanceLedger, LedgerEntryKind, User
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+def to_kopecks(amount) -> int:
+    """Рубли (float/str/Decimal) -> целые копейки с округлением до ближайшей."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_rubles(kopecks: int) -> float:
+    return kopecks / 100
+
+
+def _apply(db: Session, user_id: int, kind: LedgerEntryKind, amount_kopecks: int,
+           order_id: int = None, topup_id: int = None) -> Optional[int]:
+    statement = update(User).where(User.id == user_id)
+    if amount_kopecks < 0:
+        statement = statement.where(User.balance_kopecks >= -amount_kopecks)
+    balance = db.execute(
+        statement.values(balance_kopecks=User.balance_kopecks + amount_kopecks).returning(User.balance_kopecks)
+    ).scalar_one_or_none()
+    if balance is None:
+        return None
+
+    db.execute(insert(BalanceLedger).values(
+        user_id=user_id, kind=kind, amount_kopecks=amount_kopecks, balance_after_kopecks=balance,
+        order_id=order_id, topup_id=topup_id, created_at=datetime.utcnow(),
+    ))
+    return balance
+
+
+def credit(db: Session, user_id: int, kopecks: int, kind: LedgerEntryKind, topup_id: int = None) -> Optional[int]:
+    """Зачисление. Возвращает новый баланс в копейках или None, если пользователя нет."""
+    if kopecks < 0:
+        raise ValueError("Credit amount must not be negative")
+    return _apply(db, user_id, kind, kopecks, topup_id=topup_id)
+
+
+def debit(db: Session, user_id: int, kopecks: int, kind: LedgerEntryKind, order_id: int = None) -> int:
+    """Списание, только если хватает средств. Возвращает новый баланс в копейках."""
+    if kopecks < 0:
+        raise ValueError("Debit amount must not be negative")
+    balance = _apply(db, user_id, kind, -kopecks, order_id=order_id)
+    if balance is None:
+        raise InsufficientFunds()
+    return balance
+
+
+def check(db: Session) -> List[Tuple[int, int, int]]:
+    """Пользователи, у которых баланс не равен сумме журнала: (user_id, баланс, сумма журнала)."""
+    totals = (
+        select(BalanceLedger.user_id, func.sum(BalanceLedger.amount_kopecks).label("total"))
+        .group_by(BalanceLedger.user_id)
+        .subquery()
+    )
+    total = func.coalesce(totals.c.total, 0)
+    rows = db.execute(
+        select(User.id, User.balance_kopecks, total)
+        .outerjoin(totals, totals.c.user_id == User.id)
+        .where(User.balance_kopecks != total)
+    ).all()
+    return [tuple(row) for row in rows]
+
+
+if __name__ == "__main__":
+    import sys
+
+    from sqlalchemy.orm import sessionmaker
+
+    from database import DATABASE_URL, create_db_engine
+
+    if len(sys.argv) < 2 or sys.argv[1] != "check":
+        print("Usage: python ledger.py check [database_url]")
+        sys.exit(1)
+
+    database_url = sys.argv[2] if len(sys.argv) > 2 else DATABASE_URL
+    session_factory = sessionmaker(bind=create_db_engine(database_url), autoflush=False)
+    with session_factory() as session:
+        mismatches = check(session)
+    for user_id, balance, total in mismatches:
+        print(f"user {user_id}: balance {balance} kopecks, ledger {total} kopecks")
+    print("ok" if not mismatches else f"{len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
@@ -1,177 +1,177 @@
+"""
+Логирование приложения.
+
+Код пишет в logger, у которого один обработчик — QueueHandler: в потоке
+запроса в сообщение только подставляются аргументы (msg % args), и запись
+кладётся в очередь без I/O. Время, формат уровня, трассировки исключений и
+запись в stdout и файлы logger_logs/ выполняет QueueListener в отдельном
+потоке. Форматтеры создаются один раз при импорте.
+
+Настройки (.env):
+    LOG_LEVEL  — минимальный уровень (DEBUG, INFO, WARNING, ERROR), по умолчанию INFO
+    LOG_FORMAT — text или json (одна JSON-строка на запись)
+    LOG_COLOR  — цветные метки уровней (1/0)
+    LOG_DIR    — каталог файлов логов; LOG_FILES=0 — писать только в stdout
+
+Сообщения передавайте с аргументами (logger.info("user %s", user_id)), а не
+f-строкой: если уровень отключён, строка не форматируется.
+"""
+import atexit
+import copy
+import json
 import logging
-import sys, os
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_COLOR = os.getenv("LOG_COLOR", "0").lower() in ("1", "true", "yes")
+LOG_FILES = os.getenv("LOG_FILES", "1").lower() in ("1", "true", "yes")
+log_dir = os.getenv("LOG_DIR", os.path.join(os.path.dirname(__file__), "logger_logs"))
 
-is_server = False
 # Создание логгера
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
 
 log_text = "%(asctime)s - %(message)s"
-log_dir = os.path.join(os.path.dirname(__file__),"logger_logs")
-debug_path = os.path.join(log_dir, "debug.log")
-info_path = os.path.join(log_dir, "info.log")
-warning_path = os.path.join(log_dir, "warning.log")
-error_path = os.path.join(log_dir, "error.log")
-fatal_path = os.path.join(log_dir, "fatal.log")
-all_path = os.path.join(log_dir, "all.log")
-warning_error_fatal_path = os.path.join(log_dir, "warning_error_fatal.log")
-
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-class DebugFilter(logging.Filter):
-    def filter(self, record):
-        return record.levelno <= logging.DEBUG
+log_location = "{%(filename)s - %(funcName)s - %(lineno)d}"
 
-class InfoFilter(logging.Filter):
-    def filter(self, record):
-        return logging.DEBUG < record.levelno <= logging.INFO
 
-class WarningFilter(logging.Filter):
-    def filter(self, record):
-        return logging.INFO < record.levelno <= logging.WARNING
+def _color(*codes: int) -> str:
+    """ANSI-коды цвета (пустая строка, если LOG_COLOR выключен)."""
+    return "".join(f"\x1b[{code}m" for code in codes) if LOG_COLOR else ""
 
-class ErrorFilter(logging.Filter):
-    def filter(self, record):
-        return logging.WARNING < record.levelno <= logging.ERROR
 
-class FatalFilter(logging.Filter):
-    def filter(self, record):
-        return logging.ERROR < record.levelno
+# Шаблоны по уровням; ERROR выделяется цветом всегда
+LEVEL_FORMATS = {
+    logging.DEBUG: f"{_color(100)}DEBUG{_color(49)}   | {_color(90)}{log_text}{_color(39)}",
+    logging.INFO: f"{_color(30, 47)}INFO{_color(39, 49)}    | {log_text}",
+    logging.WARNING: f"{_color(43, 91)}WARNING{_color(39, 49)} | {_color(93)}{log_text}{_color(39)}",
+    logging.ERROR: f"\x1b[41m\x1b[30mERROR\x1b[49m\x1b[39m   | \x1b[31m{log_text}\x1b[39m {log_location}",
+    logging.CRITICAL: f"{_color(1, 4, 6, 101, 93)}FATAL{_color(0)}   | {_color(91)}{log_text}{_color(39)} {log_location}",
+}
 
 
-class ColoredFormatter(logging.Formatter):
-    """
-    Logging Formatter to add colors to log messages
-    """
-    grey = "\x1b[90m"
-    standard = "\x1b[39m"
-    yellow = "\x1b[93m"
-    error = "\x1b[91m"
-    critical = "\x1b[91;1;4;7m"
-    reset = "\x1b[0m"
-    format = "%(asctime)s - %(message)s"
-
-    FORMATS = {
-        logging.DEBUG: f'{"\033[100m" if is_server else ""}DEBUG{"\033[49m" if is_server else ""}   | {"\033[90m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""}',
-        logging.INFO: f'{"\033[30m\033[47m" if is_server else ""}INFO{"\033[39m\033[49m" if is_server else ""}    | {"\033[39m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""}',
-        logging.WARNING: f'{"\033[43m\033[91m" if is_server else ""}WARNING{"\033[39m\033[49m" if is_server else ""} | {"\033[93m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""}',
-        logging.ERROR: f'\033[41m\033[30mERROR\033[49m\033[39m   | \033[31m{log_text}\033[39m {{%(filename)s - %(funcName)s - %(lineno)d}}',
-        logging.CRITICAL: f'{"\033[1m\033[4m\033[6m\033[101m\033[93m" if is_server else ""}FATAL{"\033[0m" if is_server else ""}   | {"\033[91m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""} {{%(filename)s - %(funcName)s - %(lineno)d}}',
-    }
+class LevelFormatter(logging.Formatter):
+    """Формат по уровню записи; по одному Formatter на уровень, созданному заранее."""
+
+    def __init__(self):
+        super().__init__()
+        self._formatters = {level: logging.Formatter(fmt) for level, fmt in LEVEL_FORMATS.items()}
 
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        if log_fmt is None:
-            logger.warning(f"Unknown log level: {record.levelno}")
-            log_fmt = self.FORMATS[logging.WARNING]
-        formatter = logging.Formatter(log_fmt)
+        formatter = self._formatters.get(record.levelno)
+        if formatter is None:
+            # Нестандартный уровень — ближайший стандартный не выше него
+            level = max((lvl for lvl in self._formatters if lvl <= record.levelno), default=logging.DEBUG)
+            formatter = self._formatters[level]
         return formatter.format(record)
 
-all_handler = logging.StreamHandler(sys.stdout)
-all_handler.setLevel(logging.DEBUG)
-all_handler.setFormatter(ColoredFormatter())
-logger.addHandler(all_handler)
-
-
-debug_file_handler = RotatingFileHandler(
-maxBytes=5<<20,  # 5MB
-    backupCount=3,
-    mode='a',
-    filename=debug_path,
-    encoding='utf-8')
-debug_file_handler.setLevel(logging.DEBUG)
-debug_file_handler.addFilter(DebugFilter())
-debug_file_handler.setFormatter(logging.Formatter(
-    f'{"\033[100m" if is_server else ""}DEBUG{"\033[49m" if is_server else ""} | {"\033[90m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""}'
-))
-
-info_file_handler = RotatingFileHandler(
-maxBytes=10<<20,  # 20MB
-    backupCount=3,
-    mode='a',
-    filename=info_path,
-    encoding='utf-8')
-info_file_handler.setLevel(logging.INFO)
-info_file_handler.addFilter(InfoFilter())
-info_file_handler.setFormatter(logging.Formatter(
-    f'{"\033[30m\033[47m" if is_server else ""}INFO{"\033[39m\033[49m" if is_server else ""}  | {"\033[39m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""}'
-))
-warning_file_handler = RotatingFileHandler(
-maxBytes=5<<20,  # 5MB
-    backupCount=3,
-    mode='a',
-    filename=warning_path,
-    encoding='utf-8')
-warning_file_handler.setLevel(logging.WARNING)
-warning_file_handler.addFilter(WarningFilter())
-warning_file_handler.setFormatter(logging.Formatter(
-    f'{"\033[43m\033[31m" if is_server else ""}WARNING{"\033[39m\033[49m" if is_server else ""}| {"\033[93m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""}'
-))
-error_file_handler = RotatingFileHandler(
-maxBytes=5<<20,  # 5MB
-    backupCount=3,
-    mode='a',
-    filename=error_path,
-    encoding='utf-8')
-error_file_handler.setLevel(logging.ERROR)
-error_file_handler.addFilter(ErrorFilter())
-error_file_handler.setFormatter(logging.Formatter(
-    f'\033[41m\033[30mERROR\033[49m\033[39m | \033[31m{log_text}\033[39m {{%(filename)s - %(funcName)s - %(lineno)d}}'))
-fatal_file_handler = RotatingFileHandler(
-maxBytes=5<<20,  # 5MB
-    backupCount=3,
-    mode='a',
-    filename=fatal_path,
-    encoding='utf-8')
-fatal_file_handler.setLevel(logging.CRITICAL)
-fatal_file_handler.addFilter(FatalFilter())
-fatal_file_handler.setFormatter(logging.Formatter(
-    f'{"\033[1m\033[4m\033[6m\033[101m\033[93m" if is_server else ""}FATAL{"\033[0m" if is_server else ""} | {"\033[91m" if is_server else ""}{log_text}{"\033[39m" if is_server else ""} {{%(filename)s - %(funcName)s - %(lineno)d}}'
-))
-
-
-logger.addHandler(debug_file_handler)
-logger.addHandler(info_file_handler)
-logger.addHandler(warning_file_handler)
-logger.addHandler(error_file_handler)
-logger.addHandler(fatal_file_handler)
-
-all_file_handler = RotatingFileHandler(
-    maxBytes=20<<20,  # 20MB
-    backupCount=3,
-    mode='a',
-    filename=all_path,
-    encoding='utf-8')
-all_file_handler.setLevel(logging.DEBUG)
-all_file_handler.setFormatter(ColoredFormatter())
-logger.addHandler(all_file_handler)
-
-warning_error_fatal_path_file_handler = RotatingFileHandler(
-    maxBytes=20<<20,  # 20MB
-    backupCount=3,
-    mode='a',
-    filename=warning_error_fatal_path,
-    encoding='utf-8')
-warning_error_fatal_path_file_handler.setLevel(logging.WARNING)
-warning_error_fatal_path_file_handler.setFormatter(
-    ColoredFormatter()
-)
-logger.addHandler(warning_error_fatal_path_file_handler)
 
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись (для сборщиков логов)."""
 
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.levelno >= logging.ERROR:
+            entry.update(file=record.filename, func=record.funcName, line=record.lineno)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LevelRangeFilter(logging.Filter):
+    """Пропускает записи с уровнем в (low, high]."""
+
+    def __init__(self, low: int, high: int):
+        super().__init__()
+        self.low = low
+        self.high = high
+
+    def filter(self, record):
+        return self.low < record.levelno <= self.high
+
+
+formatter = JsonFormatter() if LOG_FORMAT == "json" else LevelFormatter()
+
+
+def _file_handler(filename: str, max_bytes: int, level: int, level_range=None) -> RotatingFileHandler:
+    handler = RotatingFileHandler(
+        filename=os.path.join(log_dir, filename),
+        maxBytes=max_bytes,
+        backupCount=3,
+        mode='a',
+        encoding='utf-8',
+        delay=True)
+    handler.setLevel(level)
+    if level_range is not None:
+        handler.addFilter(LevelRangeFilter(*level_range))
+    handler.setFormatter(formatter)
+    return handler
+
+
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(formatter)
+handlers = [stdout_handler]
+
+if LOG_FILES:
+    os.makedirs(log_dir, exist_ok=True)
+    handlers += [
+        # Файл на каждый уровень
+        _file_handler("debug.log", 5 << 20, logging.DEBUG, (logging.NOTSET, logging.DEBUG)),
+        _file_handler("info.log", 10 << 20, logging.INFO, (logging.DEBUG, logging.INFO)),
+        _file_handler("warning.log", 5 << 20, logging.WARNING, (logging.INFO, logging.WARNING)),
+        _file_handler("error.log", 5 << 20, logging.ERROR, (logging.WARNING, logging.ERROR)),
+        _file_handler("fatal.log", 5 << 20, logging.CRITICAL, (logging.ERROR, logging.CRITICAL)),
+        # Сводные файлы
+        _file_handler("all.log", 20 << 20, logging.DEBUG),
+        _file_handler("warning_error_fatal.log", 20 << 20, logging.WARNING),
+    ]
+
+class RecordQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в потоке запроса. Стандартный prepare() вызывает
+    format() (время, трассировка); здесь подставляются только аргументы — объекты
+    в args (например, ORM-объекты) нельзя читать из другого потока, — а exc_info
+    остаётся в записи и форматируется listener.
+    """
 
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
-logger.debug("Logger created and loaded")
 
-#   # Testing logs
-#
-# logger.debug("Debug log")
-# logger.info("Info log")
-# logger.warning("Warning log")
-# logger.error("Error log")
-# logger.critical("Critical log")
-#
+log_queue = queue.SimpleQueue()
+queue_handler = RecordQueueHandler(log_queue)
+logger.addHandler(queue_handler)
 
+listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+listener.start()
+_listener_running = True
 
+
+def shutdown() -> None:
+    """Дописывает оставшиеся в очереди записи и останавливает поток (повторный вызов безопасен)."""
+    global _listener_running
+    if _listener_running:
+        _listener_running = False
+        listener.stop()
+
+
+atexit.register(shutdown)
+
+logger.debug("Logger created and loaded")
@@ -0,0 +1,308 @@
+"""
+Исходящая почта через очередь (outbox).
+
+Эндпоинты не ходят в SMTP: enqueue() добавляет письмо в таблицу email_outbox
+в той же транзакции, что и остальные изменения, и после commit будит воркер.
+Фоновый воркер (mail_worker_loop, запускается в lifespan) забирает письма
+пачками и отправляет их через одно постоянное SMTP-соединение; при ошибке
+письмо откладывается с экспоненциальной задержкой, после MAIL_MAX_ATTEMPTS
+попыток помечается FAILED.
+
+Настройки (.env):
+    MAIL_BACKEND   — smtp или console (по умолчанию smtp, если задан SMTP_USER)
+    SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_FROM
+    SMTP_STARTTLS  — включать TLS (1/0), SMTP_TIMEOUT — таймаут соединения
+    MAIL_WORKER    — запускать воркер в процессе приложения (1/0)
+    MAIL_BATCH_SIZE, MAIL_POLL_INTERVAL, MAIL_MAX_ATTEMPTS,
+    MAIL_RETRY_BASE_SECONDS, MAIL_RETRY_MAX_SECONDS
+
+Отдельный процесс-воркер: python mailer.py run [database_url]
+"""
+import asyncio
+import os
+import random
+import smtplib
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from logger import logger
+from models import EmailOutbox, EmailStatus
+
+load_dotenv()
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER or "noreply@localhost")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 10))
+# Соединение закрывается, если писем не было дольше этого времени
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", 60))
+
+MAIL_BACKEND = os.getenv("MAIL_BACKEND", "smtp" if SMTP_USER else "console")
+MAIL_WORKER = os.getenv("MAIL_WORKER", "1").lower() in ("1", "true", "yes")
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", 5))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 8))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", 30))
+MAIL_RETRY_MAX_SECONDS = float(os.getenv("MAIL_RETRY_MAX_SECONDS", 3600))
+# На это время письмо «захватывается» воркером, чтобы другой процесс не отправил его повторно
+MAIL_CLAIM_SECONDS = float(os.getenv("MAIL_CLAIM_SECONDS", 300))
+
+
+# --- Постановка в очередь ---
+
+def enqueue(db: Session, to_email: str, subject: str, body_html: str) -> EmailOutbox:
+    """Добавляет письмо в очередь; отправка — после commit вызывающего кода."""
+    message = EmailOutbox(to_email=to_email, subject=subject, body_html=body_html)
+    db.add(message)
+    db.info["outbox_pending"] = True
+    return message
+
+
+def enqueue_verification_code(db: Session, to_email: str, code: str) -> EmailOutbox:
+    body = f"""
+    <html>
+        <body>
+            <h2>Код подтверждения</h2>
+            <p>Ваш код для входа: <b>{code}</b></p>
+            <p>Никому не сообщайте этот код.</p>
+        </body>
+    </html>
+    """
+    return enqueue(db, to_email, "Ваш код подтверждения", body)
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+def notify() -> None:
+    """Будит воркер этого процесса (потокобезопасно)."""
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session: Session) -> None:
+    if session.info.pop("outbox_pending", False):
+        notify()
+
+
+# --- Отправка ---
+
+class ConsoleSender:
+    """Без SMTP: письма только пишутся в лог (разработка)."""
+
+    def send(self, message: EmailMessage) -> None:
+        logger.info("--- EMAIL SIMULATION: to %s: %s ---\n%s", message['To'], message['Subject'], message.get_content())
+
+    def close_if_idle(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SMTPSender:
+    """Одно SMTP-соединение на все письма; переподключается, если сервер его закрыл."""
+
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        server.ehlo()
+        if SMTP_STARTTLS:
+            server.starttls()
+            server.ehlo()
+        if SMTP_USER:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+        return server
+
+    def send(self, message: EmailMessage) -> None:
+        if self._server is None:
+            self._server = self._connect()
+        try:
+            self._server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # Сервер закрыл простаивающее соединение — одна повторная попытка с новым
+            self._server = self._connect()
+            self._server.send_message(message)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+
+def create_sender():
+    return SMTPSender() if MAIL_BACKEND == "smtp" else ConsoleSender()
+
+
+@dataclass
+class _Claimed:
+    id: int
+    to_email: str
+    subject: str
+    body_html: str
+    attempts: int
+
+
+def _build_message(item: _Claimed) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = SMTP_FROM
+    message["To"] = item.to_email
+    message["Subject"] = item.subject
+    message.set_content(item.body_html, subtype="html")
+    return message
+
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная задержка с небольшим случайным разбросом."""
+    delay = min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAIL_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.9, 1.1)
+
+
+def _is_permanent(error: Exception) -> bool:
+    # 5xx и отказ по всем получателям повторять бессмысленно
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def _claim_due(db: Session) -> List[_Claimed]:
+    now = datetime.utcnow()
+    due = (
+        db.query(EmailOutbox)
+        .filter(EmailOutbox.status == EmailStatus.PENDING, EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(MAIL_BATCH_SIZE)
+        .all()
+    )
+    claimed = []
+    lease_until = now + timedelta(seconds=MAIL_CLAIM_SECONDS)
+    for row in due:
+        # Условный UPDATE: если другой воркер уже забрал письмо, rowcount будет 0
+        result = db.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id == row.id, EmailOutbox.next_attempt_at == row.next_attempt_at)
+            .values(next_attempt_at=lease_until)
+        )
+        if result.rowcount:
+            claimed.append(_Claimed(row.id, row.to_email, row.subject, row.body_html, row.attempts))
+    db.commit()
+    return claimed
+
+
+def process_batch(session_factory: Callable[[], Session], sender) -> int:
+    """Отправляет одну пачку писем. Возвращает число взятых в работу писем."""
+    db = session_factory()
+    try:
+        claimed = _claim_due(db)
+        if not claimed:
+            return 0
+
+        sent = failed = 0
+        connection_error = None
+        for item in claimed:
+            now = datetime.utcnow()
+            if connection_error is not None:
+                # SMTP недоступен — остаток пачки откладываем, не тратя попытки
+                db.execute(
+                    update(EmailOutbox).where(EmailOutbox.id == item.id)
+                    .values(next_attempt_at=now + timedelta(seconds=retry_delay(1)))
+                )
+                continue
+            try:
+                sender.send(_build_message(item))
+            except Exception as e:
+                attempts = item.attempts + 1
+                values = {"attempts": attempts, "last_error": str(e)[:1000]}
+                if attempts >= MAIL_MAX_ATTEMPTS or _is_permanent(e):
+                    values["status"] = EmailStatus.FAILED
+                    logger.error("Email %s to %s failed permanently: %s", item.id, item.to_email, e)
+                else:
+                    values["next_attempt_at"] = now + timedelta(seconds=retry_delay(attempts))
+                    logger.warning("Email %s to %s failed (attempt %s): %s", item.id, item.to_email, attempts, e)
+                db.execute(update(EmailOutbox).where(EmailOutbox.id == item.id).values(**values))
+                failed += 1
+                if isinstance(e, (OSError, smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+                    connection_error = e
+                    sender.close()
+            else:
+                db.execute(
+                    update(EmailOutbox).where(EmailOutbox.id == item.id)
+                    .values(status=EmailStatus.SENT, sent_at=now, attempts=item.attempts + 1, last_error=None)
+                )
+                sent += 1
+        db.commit()
+        logger.info("Email batch: %s sent, %s failed, %s deferred", sent, failed, len(claimed) - sent - failed)
+        return len(claimed)
+    finally:
+        db.close()
+
+
+async def mail_worker_loop(session_factory: Callable[[], Session]) -> None:
+    """Фоновая задача: отправляет очередь пачками; SMTP работает в потоке, не блокируя event loop."""
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    sender = create_sender()
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                processed = await asyncio.to_thread(process_batch, session_factory, sender)
+            except Exception as e:
+                logger.error("Email worker error: %s", e)
+                processed = 0
+
+            # Полная пачка — вероятно, есть ещё письма, продолжаем сразу
+            if processed >= MAIL_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(_wakeup.wait(), MAIL_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                await asyncio.to_thread(sender.close_if_idle)
+    finally:
+        _loop = None
+        _wakeup = None
+        sender.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from sqlalchemy.orm import sessionmaker
+
+    from database import DATABASE_URL, create_db_engine
+
+    if len(sys.argv) < 2 or sys.argv[1] != "run":
+        print("Usage: python mailer.py run [database_url]")
+        sys.exit(1)
+
+    database_url = sys.argv[2] if len(sys.argv) > 2 else DATABASE_URL
+    session_factory = sessionmaker(bind=create_db_engine(database_url), autoflush=False)
+    try:
+        asyncio.run(mail_worker_loop(session_factory))
+    except KeyboardInterrupt:
+        pass
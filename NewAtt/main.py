@@ -1,20 +1,15 @@
-import random
-import string
 import os
 import csv
 import io
-import hashlib
-import secrets
-from datetime import date, datetime, timedelta
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime
 from typing import List, Dict, Optional
 
 from dotenv import load_dotenv
 
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
 load_dotenv()
@@ -23,14 +18,20 @@ import uvicorn
 from fastapi import Depends, FastAPI, File, HTTPException, Request, UploadFile, status
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
+from sqlalchemy import insert
+from pydantic import TypeAdapter
 
-from auth import JWTAuthMiddleware, create_access_token, require_admin, get_current_user_id, require_cook_or_admin
-from passlib.context import CryptContext
+from auth import (
+    JWTAuthMiddleware, Principal, create_token_pair, require_admin, get_current_user_id,
+    require_cook_or_admin, get_principal, principal_cache, revocation_list, revocation_sync_loop,
+    decode_refresh_token
+)
+import passwords
+from passwords import verify_password, get_password_hash, login_throttle
 from menu_parser import parse_menu_text
 from models import (
     Dish, DishType, User, ModuleMenu, Order, OrderItem, OrderStatus, TopupStatus, BalanceTopup,
-    Base
+    CodePurpose, Blob, LedgerEntryKind
 )
 from schemas import (
     DishCreate, DishResponse, DishUpdate, RegisterResponse, UserCreate,
@@ -38,228 +39,61 @@ from schemas import (
     ResendCodeResponse, AdminUpdateRequest, ModuleMenuRequest,
     OrderCreate, OrderResponse, DishBase, AdminUpdateByEmailRequest,
     ModuleMenuResponse, LoginRequest, TokenResponse, SetPasswordRequest,
-    ChangePasswordRequest, PasswordResetConfirmRequest, TopupCreateRequest, TopupResponse
+    ChangePasswordRequest, PasswordResetConfirmRequest, TopupCreateRequest, TopupResponse,
+    RefreshRequest, LogoutRequest
 )
 import docx_utils
-
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import reports
+import report_cache
+import migrate
+import mailer
+import metrics
+import one_time_codes
+import ledger
+import upload_store
+import thumbnails
+from menu_cache import menu_cache, cached_json_response
+
+from database import engine, SessionLocal, get_db, get_async_db
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import HTTPBearer
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
 
-engine = create_engine("sqlite:///./app.db", connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base.metadata.create_all(bind=engine)
-
-# Ensure DB has the new column `password_hash` to stay backward compatible
-def ensure_password_hash_column():
-    try:
-        with engine.connect() as conn:
-            res = conn.execute(text("PRAGMA table_info('users')")).all()
-            cols = [row[1] for row in res]
-            if 'password_hash' not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN password_hash TEXT"))
-                logger.info('Added column password_hash to users table')
-    except Exception as e:
-        logger.warning(f'Could not ensure password_hash column: {e}')
-
-ensure_password_hash_column()
-
-# Ensure DB has the new column `is_cook` for the new role
-def ensure_is_cook_column():
-    try:
-        with engine.connect() as conn:
-            res = conn.execute(text("PRAGMA table_info('users')")).all()
-            cols = [row[1] for row in res]
-            if 'is_cook' not in cols:
-                # SQLite uses INTEGER for booleans
-                conn.execute(text("ALTER TABLE users ADD COLUMN is_cook BOOLEAN DEFAULT 0"))
-                logger.info('Added column is_cook to users table')
-    except Exception as e:
-        logger.warning(f'Could not ensure is_cook column: {e}')
-
-ensure_is_cook_column()
-
-# Ensure DB has the new column `password_reset_code` for password reset flow
-def ensure_password_reset_code_column():
-    try:
-        with engine.connect() as conn:
-            res = conn.execute(text("PRAGMA table_info('users')")).all()
-            cols = [row[1] for row in res]
-            if 'password_reset_code' not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN password_reset_code TEXT"))
-                logger.info('Added column password_reset_code to users table')
-    except Exception as e:
-        logger.warning(f'Could not ensure password_reset_code column: {e}')
-
-ensure_password_reset_code_column()
-
-# Ensure DB has the new column `balance`
-def ensure_balance_column():
-    try:
-        with engine.connect() as conn:
-            res = conn.execute(text("PRAGMA table_info('users')")).all()
-            cols = [row[1] for row in res]
-            if 'balance' not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN balance REAL DEFAULT 0.0"))
-                logger.info('Added column balance to users table')
-    except Exception as e:
-        logger.warning(f'Could not ensure balance column: {e}')
-
-ensure_balance_column()
-
-# Ensure table balance_topups exists (simple check)
-def ensure_balance_topups_table():
-    try:
-        with engine.connect() as conn:
-            res = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='balance_topups';")).all()
-            if not res:
-                conn.execute(text('''
-                    CREATE TABLE balance_topups (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        amount REAL DEFAULT 0.0,
-                        status TEXT DEFAULT 'PENDING',
-                        payment_proof_path TEXT,
-                        created_at TEXT
-                    )
-                '''))
-                logger.info('Created table balance_topups')
-    except Exception as e:
-        logger.warning(f'Could not ensure balance_topups table: {e}')
-
-ensure_balance_topups_table()
-
-# Ensure DB has the new column `allergies` for storing user allergies text
-def ensure_allergies_column():
-    try:
-        with engine.connect() as conn:
-            res = conn.execute(text("PRAGMA table_info('users')")).all()
-            cols = [row[1] for row in res]
-            if 'allergies' not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN allergies TEXT"))
-                logger.info('Added column allergies to users table')
-    except Exception as e:
-        logger.warning(f'Could not ensure allergies column: {e}')
-
-ensure_allergies_column()
-
-# Инициализация контекста для хеширования паролей
-# Используем PBKDF2-SHA256 как основной метод
-# Поддерживаем bcrypt для обратной совместимости со старыми хешами
-pwd_context = CryptContext(
-    schemes=["pbkdf2_sha256"],
-    deprecated="auto",
-    pbkdf2_sha256__rounds=100000  # Уменьшено для совместимости
-)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверка пароля против хеша"""
-    if not hashed_password:
-        return False
-
-    try:
-        # Очищаем пароль
-        plain_password = plain_password.strip()
-
-        # bcrypt имеет ограничение в 72 байта
-        if len(plain_password) > 72:
-            plain_password = plain_password[:72]
-
-        # Пробуем встроенную верификацию passlib
-        is_valid = pwd_context.verify(plain_password, hashed_password)
-        return is_valid
-    except Exception as e:
-        logger.debug(f"CryptContext verification failed: {e}")
-
-        # Резервная попытка: проверить вручную если это наш формат
-        if hashed_password.startswith("pbkdf2:sha256:"):
-            try:
-                parts = hashed_password.split("$")
-                if len(parts) == 3:
-                    rounds = int(parts[0].split(":")[-1])
-                    salt = parts[1]
-                    stored_hash = parts[2]
-
-                    test_hash = hashlib.pbkdf2_hmac(
-                        'sha256',
-                        plain_password.encode(),
-                        salt.encode(),
-                        rounds
-                    )
-
-                    is_valid = test_hash.hex() == stored_hash
-                    if is_valid:
-                        logger.debug(f"Password verified using fallback method")
-                    return is_valid
-            except Exception as e2:
-                logger.debug(f"Fallback verification failed: {e2}")
-
-        logger.error(f"Error verifying password: {e}")
-        return False
-
-
-def get_password_hash(password: str) -> str:
-    """Хеширование пароля с безопасностью"""
-    # Убедимся, что пароль это строка
-    if not isinstance(password, str):
-        password = str(password)
-
-    # Очищаем от пробелов
-    password = password.strip()
-
-    # bcrypt имеет ограничение в 72 байта
-    if len(password) > 72:
-        logger.warning(f"Password truncated from {len(password)} to 72 bytes")
-        password = password[:72]
+security_scheme = HTTPBearer(auto_error=False)
 
-    try:
-        # Используем встроенный PBKDF2 из passlib
-        hash_result = pwd_context.hash(password)
-        logger.debug(f"Password hashed successfully using pbkdf2_sha256")
-        return hash_result
-    except Exception as e:
-        logger.error(f"Error with CryptContext: {e}")
-        # Резервный вариант - ручной PBKDF2
-        try:
-            salt = secrets.token_hex(32)
-            password_hash = hashlib.pbkdf2_hmac(
-                'sha256',
-                password.encode(),
-                salt.encode(),
-                100000
-            )
-            # Формат совместимый с нашей верификацией
-            hash_result = f"pbkdf2:sha256:100000${salt}${password_hash.hex()}"
-            logger.debug(f"Password hashed using fallback PBKDF2 method")
-            return hash_result
-        except Exception as e2:
-            logger.critical(f"Critical error hashing password: {e2}")
-            raise HTTPException(status_code=500, detail="Error hashing password")
-
-
-def get_db():
-    """Dependency generator that yields a DB session and ensures it's closed after use.
-
-    Previously this function returned a session and closed it immediately in a finally block,
-    which resulted in closed sessions being used by request handlers and eventually exhausted
-    the connection pool. FastAPI expects database dependencies to be generator functions that
-    yield the session so the framework can manage lifecycle correctly.
-    """
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Единственная проверка версии схемы при старте (импорт модуля БД не трогает)
+    migrate.ensure_schema(engine)
+    # Список отозванных токенов держим в памяти и периодически досинхронизируем из БД
     db = SessionLocal()
     try:
-        yield db
+        revocation_list.sync(db)
     finally:
         db.close()
+    tasks = [
+        asyncio.create_task(revocation_sync_loop(SessionLocal)),
+        asyncio.create_task(one_time_codes.sweep_loop(SessionLocal)),
+    ]
+    # Очередь писем; при MAIL_WORKER=0 её отправляет отдельный процесс (python mailer.py run)
+    if mailer.MAIL_WORKER:
+        tasks.append(asyncio.create_task(mailer.mail_worker_loop(SessionLocal)))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        thumbnails.shutdown()
 
 
-security_scheme = HTTPBearer(auto_error=False)
-
 app = FastAPI(
     title="Canteen API",
-    dependencies=[Depends(security_scheme)]
+    dependencies=[Depends(security_scheme)],
+    lifespan=lifespan
 )
 
 
@@ -277,13 +111,15 @@ app.add_middleware(
 )
 
 app.add_middleware(JWTAuthMiddleware)
+# Последним — чтобы быть внешним и замерять запрос целиком
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 
-def get_admin_user(request: Request, db: Session = Depends(get_db)) -> User:
+def get_admin_user(request: Request, db: Session = Depends(get_db)) -> Principal:
     return require_admin(request, db)
 
 # Wrapper to use require_cook_or_admin as a dependency (so FastAPI can resolve get_db correctly)
-def get_cook_or_admin_user(request: Request, db: Session = Depends(get_db)) -> User:
+def get_cook_or_admin_user(request: Request, db: Session = Depends(get_db)) -> Principal:
     return require_cook_or_admin(request, db)
 
 
@@ -296,52 +132,13 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
     return user
 
 
-def generate_verification_code() -> str:
-    return ''.join(random.choices(string.digits, k=6))
-
-def generate_random_code(length: int = 6) -> str:
-    return ''.join(random.choices(string.digits, k=length))
-
-
-SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
-SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
-SMTP_USER = os.getenv("SMTP_USER")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-
-
-def send_verification_email(to_email: str, code: str) -> None:
-    print(f"--- EMAIL SIMULATION (No Credentials): Code for {to_email} is {code} ---")
-    # print(to_email, code)
-    # if not SMTP_USER or not SMTP_PASSWORD:
-    #     return
-    # msg = MIMEMultipart()
-    # msg['From'] = SMTP_USER
-    # msg['To'] = to_email
-    # msg['Subject'] = "Ваш код подтверждения"
-    #
-    # body = f"""
-    # <html>
-    #     <body>
-    #         <h2>Код подтверждения</h2>
-    #         <p>Ваш код для входа: <b>{code}</b></p>
-    #         <p>Никому не сообщайте этот код.</p>
-    #     </body>
-    # </html>
-    # """
-    #
-    # msg.attach(MIMEText(body, 'html'))
-    #
-    # server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-    # server.ehlo()
-    # server.starttls()
-    # server.ehlo()
-    #
-    # server.login(SMTP_USER, SMTP_PASSWORD)
-    #
-    # server.sendmail(SMTP_USER, to_email, msg.as_string())
-    #
-    # server.quit()
-
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)) -> User:
+    # То же, что get_current_user, но через AsyncSession (для async-эндпоинтов)
+    user_id = get_current_user_id(request)
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
 
 
 @app.post("/register", status_code=status.HTTP_201_CREATED)
@@ -349,11 +146,10 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
     existing = db.query(User).filter(User.email == user_data.email).first()
 
     if existing:
-        code = generate_verification_code()
-        existing.verification_code = code
+        code = one_time_codes.issue(db, existing.id, CodePurpose.VERIFY_EMAIL)
+        mailer.enqueue_verification_code(db, user_data.email, code)
         db.commit()
         db.refresh(existing)
-        send_verification_email(user_data.email, code)
         return RegisterResponse(message="Code resent", user=UserResponse.model_validate(existing))
 
     # Создание нового пользователя
@@ -362,27 +158,26 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
     if user_data.status not in {"active", "inactive"}:
         raise HTTPException(status_code=400, detail="Статус должен быть 'активен' или 'неактивен'")
 
-    code = generate_verification_code()
-
     # При регистрации допускаем, что клиент может передать пароль в body (необязательно)
     password_hash = None
     if user_data.password:
         # Пароль передан при регистрации
-        password_hash = get_password_hash(user_data.password)
+        password_hash = passwords.run_sync(get_password_hash, user_data.password)
 
     new_user = User(
         name=user_data.name,
         secondary_name=user_data.secondary_name,
         email=user_data.email,
         status=user_data.status,
-        verification_code=code,
         password_hash=password_hash
     )
 
     db.add(new_user)
+    db.flush()
+    code = one_time_codes.issue(db, new_user.id, CodePurpose.VERIFY_EMAIL)
+    mailer.enqueue_verification_code(db, new_user.email, code)
     db.commit()
     db.refresh(new_user)
-    send_verification_email(new_user.email, code)
     return RegisterResponse(message="Registered", user=UserResponse.model_validate(new_user))
 
 @app.post('/password/reset')
@@ -391,51 +186,41 @@ def password_reset_request(data: ResendCodeRequest, db: Session = Depends(get_db
     user = db.query(User).filter(User.email == data.email).first()
     if not user:
         # Не раскрываем, что пользователя нет — возвращаем 200
-        logger.info(f'Password reset requested for unknown email: {data.email}')
+        logger.info('Password reset requested for unknown email: %s', data.email)
         return ResendCodeResponse(message='If the email exists, a code has been sent')
 
-    code = generate_random_code()
-    user.password_reset_code = code
+    code = one_time_codes.issue(db, user.id, CodePurpose.PASSWORD_RESET)
+    mailer.enqueue_verification_code(db, str(user.email), code)
     db.commit()
-    db.refresh(user)
-    logger.info(f'Password reset code generated for {user.email}: {code}')
-    # Отправим на почту тот же текст (симуляция)
-    send_verification_email(str(user.email), code)
+    logger.info('Password reset code generated for %s', user.email)
     return ResendCodeResponse(message='If the email exists, a code has been sent')
 
 
 @app.post('/password/reset/confirm', response_model=UserResponse)
 def password_reset_confirm(data: PasswordResetConfirmRequest, db: Session = Depends(get_db)):
     """Подтверждение кода сброса и установка нового пароля"""
-    # Нормализуем входные данные
-    code = (data.code or '').strip()
-    email = (data.email or '').strip().lower() if getattr(data, 'email', None) else None
-
-    # Ищем пользователя по коду и опционально по email (если передан)
-    if email:
-        user = db.query(User).filter(func.lower(User.email) == email, User.password_reset_code == code).first()
-        if not user:
-            logger.info(f'No user found by email+code, trying by code only (email provided was {email})')
-            user = db.query(User).filter(User.password_reset_code == code).first()
-    else:
-        user = db.query(User).filter(User.password_reset_code == code).first()
-
-    logger.info(f'Password reset confirm attempt - email: {email}, code: {code}, found_user: {bool(user)}')
-
-    if not user:
-        raise HTTPException(status_code=400, detail='Неверный код')
-
     if data.password != data.password_confirm:
         raise HTTPException(status_code=400, detail='Пароли не совпадают')
 
     if len(data.password) < 6:
         raise HTTPException(status_code=400, detail='Пароль должен быть не менее 6 символов')
 
-    user.password_hash = get_password_hash(data.password)
-    user.password_reset_code = None
+    # Код должен принадлежать владельцу email — неверные попытки идут в счётчик его кода
+    owner = db.query(User.id).filter(func.lower(User.email) == data.email.strip().lower()).first()
+    if not owner:
+        raise HTTPException(status_code=400, detail='Неверный код')
+
+    user_id = one_time_codes.consume(db, CodePurpose.PASSWORD_RESET, data.code, owner.id)
+    user = db.get(User, user_id) if user_id else None
+    logger.info('Password reset confirm attempt - email: %s, found_user: %s', data.email, bool(user))
+
+    if not user:
+        raise HTTPException(status_code=400, detail='Неверный код')
+
+    user.password_hash = passwords.run_sync(get_password_hash, data.password)
     db.commit()
     db.refresh(user)
-    logger.info(f'Password reset successful for {user.email}')
+    logger.info('Password reset successful for %s', user.email)
     return UserResponse.model_validate(user)
 
 
@@ -445,14 +230,14 @@ def change_password_for_current_user(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Сменить пароль: либо указать старый пароль, либо использовать подтверждение по почте (password_reset_code).
+    """Сменить пароль: либо указать старый пароль, либо использовать подтверждение по почте (код сброса).
     Если передан old_password — проверяем его и меняем. Если не передан, отправляем код на почту предварительно или ожидаем, что код был подтвержден через /password/reset/confirm.
     """
     # Если указан old_password, проверяем
     if data.old_password:
         if not current_user.password_hash:
             raise HTTPException(status_code=400, detail='У вас не настроен старый пароль')
-        if not verify_password(data.old_password, current_user.password_hash):
+        if not passwords.run_sync(verify_password, data.old_password, current_user.password_hash):
             raise HTTPException(status_code=400, detail='Старый пароль неверен')
 
         # В этом случае просто обновляем пароль
@@ -461,7 +246,7 @@ def change_password_for_current_user(
         if len(data.password) < 6:
             raise HTTPException(status_code=400, detail='Пароль должен быть не менее 6 символов')
 
-        current_user.password_hash = get_password_hash(data.password)
+        current_user.password_hash = passwords.run_sync(get_password_hash, data.password)
         db.commit()
         db.refresh(current_user)
         return UserResponse.model_validate(current_user)
@@ -470,17 +255,17 @@ def change_password_for_current_user(
     raise HTTPException(status_code=400, detail='Нужен старый пароль или подтвердите смену через письмо (см. /password/reset)')
 
 @app.get("/users/me", response_model=UserResponse)
-def read_users_me(current_user: User = Depends(get_current_user)):
-    logger.debug(f"Current user id: {getattr(current_user, 'id', None)}")
+async def read_users_me(current_user: User = Depends(get_current_user_async)):
+    logger.debug("Current user id: %s", getattr(current_user, 'id', None))
     # Явно сериализуем модель пользователя в pydantic-схему — это предотвращает случаи, когда
     # FastAPI/ResponseModel по каким-то причинам не сериализует ORM-объект правильно.
     return UserResponse.model_validate(current_user)
 
 @app.patch("/users/me", response_model=UserResponse)
-def update_user_me(
+async def update_user_me(
     user_update: UserUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Обновление данных текущего пользователя"""
     update_data = user_update.model_dump(exclude_unset=True)
@@ -493,40 +278,99 @@ def update_user_me(
     for field, value in update_data.items():
         setattr(current_user, field, value)
     
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
     # Явно возвращаем Pydantic-сериализованный ответ (включая новое поле allergies)
     return UserResponse.model_validate(current_user)
 
 @app.post("/verify-code", response_model=VerifyCodeResponse)
 def verify_code(data: VerifyCodeRequest, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.email == data.email).first()
-    if not user or user.verification_code != data.code:
+    if not user or not one_time_codes.consume(db, CodePurpose.VERIFY_EMAIL, data.code, user.id):
         raise HTTPException(status_code=400, detail="Неверный код")
 
     user.email_verified = True
-    user.verification_code = None
     db.commit()
-    token = create_access_token(data={"sub": str(user.id)})
-    return VerifyCodeResponse(access_token=token, token_type="bearer", user=UserResponse.model_validate(user))
+    token, refresh_token = create_token_pair(user.id)
+    return VerifyCodeResponse(
+        access_token=token, token_type="bearer", user=UserResponse.model_validate(user),
+        refresh_token=refresh_token
+    )
 
 
 @app.post("/auth/token", response_model=TokenResponse)
-def login_for_access_token(login_data: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == login_data.email).first()
+async def login_for_access_token(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    login_throttle.check(login_data.email)
+
+    result = await db.execute(select(User).where(User.email == login_data.email))
+    user = result.scalar_one_or_none()
     if not user:
         # Для обратной совместимости можно отправить код подтверждения
+        login_throttle.record_failure(login_data.email)
         raise HTTPException(status_code=400, detail="Пользователь не найден или неверные данные")
 
     if user.password_hash:
-        if not verify_password(login_data.password, user.password_hash):
+        if not await passwords.run_async(verify_password, login_data.password, user.password_hash):
+            login_throttle.record_failure(login_data.email)
             raise HTTPException(status_code=400, detail="Неверный пароль")
     else:
         # Пользователь не имеет пароля — отвергаем попытку входа по паролю
         raise HTTPException(status_code=400, detail="У пользователя не настроен пароль. Войдите через подтверждение по почте.")
 
-    token = create_access_token(data={"sub": str(user.id)})
-    return TokenResponse(access_token=token, token_type="bearer", user=UserResponse.model_validate(user))
+    login_throttle.reset(login_data.email)
+
+    # Прозрачно переводим старые хеши (резервный формат pbkdf2:sha256:) на текущую схему
+    if passwords.needs_rehash(user.password_hash):
+        user.password_hash = await passwords.run_async(get_password_hash, login_data.password)
+        await db.commit()
+        logger.info("Password hash upgraded for user %s", user.id)
+
+    token, refresh_token = create_token_pair(user.id)
+    return TokenResponse(
+        access_token=token, token_type="bearer", user=UserResponse.model_validate(user),
+        refresh_token=refresh_token
+    )
+
+
+@app.post("/auth/refresh", response_model=TokenResponse)
+def refresh_access_token(data: RefreshRequest, db: Session = Depends(get_db)):
+    """Выдаёт новую пару токенов; использованный refresh-токен отзывается (ротация)."""
+    payload = decode_refresh_token(data.refresh_token)
+    user = db.query(User).filter(User.id == int(payload["sub"])).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
+    # Отзыв фиксируется до выдачи новой пары: из параллельных запросов с одним токеном проходит один
+    if not revocation_list.claim(db, payload["jti"], payload["exp"]):
+        logger.info("Refresh token reuse for user %s", user.id)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    token, refresh_token = create_token_pair(user.id)
+    return TokenResponse(
+        access_token=token, token_type="bearer", user=UserResponse.model_validate(user),
+        refresh_token=refresh_token
+    )
+
+
+@app.post("/auth/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(request: Request, data: Optional[LogoutRequest] = None, db: Session = Depends(get_db)):
+    """Отзывает текущий access-токен и переданный refresh-токен."""
+    jti = getattr(request.state, "token_jti", None)
+    exp = getattr(request.state, "token_exp", None)
+    if jti and exp:
+        revocation_list.revoke(db, jti, exp)
+
+    if data and data.refresh_token:
+        try:
+            payload = decode_refresh_token(data.refresh_token)
+        except HTTPException:
+            payload = None
+        if payload:
+            revocation_list.revoke(db, payload["jti"], payload["exp"])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @app.post("/set-password", response_model=UserResponse)
@@ -544,26 +388,34 @@ def set_password(
         raise HTTPException(status_code=400, detail="Пароль должен быть не менее 6 символов")
 
     # Установка хеша пароля
-    current_user.password_hash = get_password_hash(password_data.password)
+    current_user.password_hash = passwords.run_sync(get_password_hash, password_data.password)
     db.commit()
     db.refresh(current_user)
     return UserResponse.model_validate(current_user)
 
 
 
+_dish_list_adapter = TypeAdapter(List[DishResponse])
+_module_menu_list_adapter = TypeAdapter(List[ModuleMenuResponse])
+
+
 @app.get("/menu", response_model=List[DishResponse])
-def get_global_menu(db: Session = Depends(get_db)):
-    temp = db.query(Dish).all()
-    logger.debug(f"Global menu: {temp}")
-    return temp
+async def get_global_menu(request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def build() -> bytes:
+        dishes = (await db.execute(select(Dish))).scalars().all()
+        return _dish_list_adapter.dump_json(dishes)
+
+    payload = await menu_cache.get_or_build_async("menu", build)
+    return cached_json_response(request, payload)
 
 
 @app.post("/menu/dish", response_model=DishResponse)
-def create_dish(dish: DishCreate, db: Session = Depends(get_db), admin: User = Depends(get_cook_or_admin_user)):
+def create_dish(dish: DishCreate, db: Session = Depends(get_db), admin: Principal = Depends(get_cook_or_admin_user)):
     new_dish = Dish(**dish.model_dump())
     db.add(new_dish)
     db.commit()
     db.refresh(new_dish)
+    menu_cache.bump()
     return new_dish
 
 
@@ -572,7 +424,7 @@ async def upload_menu_file(
     file: UploadFile = File(...),
     is_provider: bool = True,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_cook_or_admin_user)
+    admin: Principal = Depends(get_cook_or_admin_user)
 ):
     content = await file.read()
     content_str = content.decode("utf-8")
@@ -601,6 +453,7 @@ async def upload_menu_file(
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка в базе данных: {e}")
+    menu_cache.bump()
 
     return {
         "message": "Menu updated successfully",
@@ -615,7 +468,7 @@ async def upload_menu_file(
 def set_module_menu(
         menu_data: ModuleMenuRequest,
         db: Session = Depends(get_db),
-        admin: User = Depends(get_cook_or_admin_user)
+        admin: Principal = Depends(get_cook_or_admin_user)
 ):
     db.query(ModuleMenu).filter(ModuleMenu.week_start_date == menu_data.week_start_date).delete()
 
@@ -639,53 +492,86 @@ def set_module_menu(
             db.add(mm)
 
     db.commit()
+    menu_cache.bump()
     return {"message": "Module menu saved successfully for week starting " + str(menu_data.week_start_date)}
 
 
 @app.get("/module-menu", response_model=List[ModuleMenuResponse])
-def get_module_menu(week_start_date: date, db: Session = Depends(get_db)):
-    menu_items = db.query(ModuleMenu).filter(ModuleMenu.week_start_date == week_start_date).all()
-    return menu_items
+def get_module_menu(week_start_date: date, request: Request, db: Session = Depends(get_db)):
+    payload = menu_cache.get_or_build(
+        ("module-menu", week_start_date),
+        lambda: _module_menu_list_adapter.dump_json(
+            db.query(ModuleMenu).filter(ModuleMenu.week_start_date == week_start_date).all()
+        )
+    )
+    return cached_json_response(request, payload)
 
 
 
 @app.post("/orders", response_model=OrderResponse)
-def create_order(
+async def create_order(
         order_data: OrderCreate,
         request: Request,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    user = get_current_user(request, db)
+    user_id = get_current_user_id(request)
+
+    requested = [
+        (day_req.day_of_week, item)
+        for day_req in order_data.days
+        for item in day_req.items
+        if item.quantity > 0
+    ]
+
+    # Все блюда заказа — одним запросом IN
+    dish_ids = {item.dish_id for _, item in requested}
+    dishes = {}
+    if dish_ids:
+        result = await db.execute(select(Dish).where(Dish.id.in_(dish_ids)))
+        dishes = {d.id: d for d in result.scalars().all()}
+
+    # Разрешённые пары (день, блюдо) из модульного меню недели
+    result = await db.execute(
+        select(ModuleMenu.day_of_week, ModuleMenu.dish_id)
+        .where(ModuleMenu.week_start_date == order_data.week_start_date)
+    )
+    menu_pairs = set(result.tuples().all())
 
     total_price = 0.0
+    items_rows = []
+    for day_of_week, item in requested:
+        dish = dishes.get(item.dish_id)
+        if not dish: continue
+        if (day_of_week, dish.id) not in menu_pairs:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Блюдо «{dish.name}» отсутствует в меню на день {day_of_week} недели {order_data.week_start_date}"
+            )
+
+        total_price += dish.price_rub * item.quantity
+        items_rows.append({
+            "dish_id": dish.id,
+            "day_of_week": day_of_week,
+            "quantity": item.quantity,
+        })
+
     new_order = Order(
-        user_id=user.id,
+        user_id=user_id,
         week_start_date=order_data.week_start_date,
-        status=OrderStatus.PENDING
+        status=OrderStatus.PENDING,
+        total_amount=total_price
     )
     db.add(new_order)
-    db.flush()
+    await db.flush()
 
-    for day_req in order_data.days:
-        for item in day_req.items:
-            if item.quantity > 0:
-                dish = db.query(Dish).filter(Dish.id == item.dish_id).first()
-                if not dish: continue
-
-                cost = dish.price_rub * item.quantity
-                total_price += cost
-
-                order_item = OrderItem(
-                    order_id=new_order.id,
-                    dish_id=dish.id,
-                    day_of_week=day_req.day_of_week,
-                    quantity=item.quantity
-                )
-                db.add(order_item)
+    if items_rows:
+        for row in items_rows:
+            row["order_id"] = new_order.id
+        # Вставка всех позиций одним executemany
+        await db.execute(insert(OrderItem), items_rows)
 
-    new_order.total_amount = total_price
-    db.commit()
-    db.refresh(new_order)
+    await db.commit()
+    await db.refresh(new_order)
     return new_order
 
 
@@ -694,100 +580,89 @@ async def pay_order(
         order_id: int,
         request: Request,
         file: UploadFile = File(...),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    user = get_current_user(request, db)
-    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user.id).first()
+    user_id = get_current_user_id(request)
+    result = await db.execute(select(Order).where(Order.id == order_id, Order.user_id == user_id))
+    order = result.scalar_one_or_none()
 
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
 
-    # Проверка типа файла
-    allowed_mime_types = [
-        "application/pdf",
-        "image/jpeg",
-        "image/jpg",
-        "image/png",
-        "image/bmp",
-        "image/webp",
-    ]
-    if file.content_type not in allowed_mime_types:
-        raise HTTPException(status_code=400, detail="Недопустимый тип файла. Разрешены только PDF и изображения (JPEG, PNG, JPG, BMP, WEBP).")
-
-    # Дополнительная проверка по расширению
-    forbidden_extensions = {".exe", ".zip", ".rar", ".7z", ".tar", ".gz", ".sh", ".bat", ".cmd", ".msi", ".dmg"}
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext in forbidden_extensions:
-        raise HTTPException(status_code=400, detail="Загрузка исполняемых файлов и архивов запрещена.")
-
-    os.makedirs("uploads", exist_ok=True)
-    file_location = f"uploads/{order_id}_{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        file_object.write(await file.read())
+    # Тип проверяется по содержимому файла, а не по content_type и расширению
+    stored = await upload_store.save_upload(file)
 
-    order.payment_proof_path = file_location
+    order.payment_proof_path = await db.run_sync(upload_store.replace_reference, order.payment_proof_path, stored)
     order.status = OrderStatus.ON_REVIEW
 
-    db.commit()
+    await db.commit()
+    thumbnails.schedule(stored)
     return {"message": "Payment proof uploaded"}
 
 
-@app.get("/orders/{order_id}/receipt")
-async def download_receipt(
-        order_id: int,
-        request: Request,
-        db: Session = Depends(get_db)
-):
-    user = get_current_user(request, db)
-    if user.is_admin:
-        order = db.query(Order).filter(Order.id == order_id).first()
-    else:
-        order = db.query(Order).filter(Order.id == order_id, Order.user_id == user.id).first()
-
-    if not order:
-        logger.debug(f"Order not found for user {user.id}: {order_id}")
+def _proof_row(db: Session, model, object_id: int):
+    # Владелец, путь и данные файла из blobs одним запросом (без загрузки ORM-объекта)
+    return db.execute(
+        select(model.user_id, model.payment_proof_path, Blob.sha256, Blob.media_type, Blob.created_at)
+        .outerjoin(Blob, Blob.path == model.payment_proof_path)
+        .where(model.id == object_id)
+    ).first()
+
+
+async def _proof_preview(request: Request, row) -> Response:
+    # Маленькая WebP-картинка вместо оригинала (thumbnails.py); 404 — превью сделать нельзя
+    if row.sha256 is None:
+        raise HTTPException(status_code=404, detail="Превью недоступно")
+    headers = {"Cache-Control": "private, max-age=300"}
+    headers.update(upload_store.validators(row.sha256, row.created_at, variant="-preview"))
+    if upload_store.not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    preview = await thumbnails.ensure_preview(row.sha256, row.payment_proof_path, row.media_type)
+    if preview is None:
+        raise HTTPException(status_code=404, detail="Превью недоступно")
+    return upload_store.file_response(preview, thumbnails.PREVIEW_MEDIA_TYPE, headers, not_found_detail="Превью недоступно")
+
+
+def _order_proof_row(order_id: int, request: Request, db: Session):
+    principal = get_principal(request, db)
+    row = _proof_row(db, Order, order_id)
+    if not row or (row.user_id != principal.user_id and not principal.is_admin):
+        logger.debug("Order not found for user %s: %s", principal.user_id, order_id)
         raise HTTPException(status_code=404, detail="Заказ не найден")
-    
-    if not order.payment_proof_path:
-        logger.debug(f"Receipt not found for order {order_id}")
+    if not row.payment_proof_path:
+        logger.debug("Receipt not found for order %s", order_id)
         raise HTTPException(status_code=404, detail="Квитанция не найдена")
-    
-    if not os.path.exists(order.payment_proof_path):
-        logger.debug(f"Receipt file not found for order {order_id}: {order.payment_proof_path}")
-        raise HTTPException(status_code=404, detail="Файл квитанции не найден")
-    logger.debug(f"Returning receipt file for order {order_id}: {order.payment_proof_path}")
-    # Определяем Content-Type по расширению файла
-    file_path_lower = order.payment_proof_path.lower()
-    if file_path_lower.endswith('.pdf'):
-        media_type = "application/pdf"
-    elif file_path_lower.endswith('.png'):
-        media_type = "image/png"
-    elif file_path_lower.endswith('.jpg') or file_path_lower.endswith('.jpeg'):
-        media_type = "image/jpeg"
-    elif file_path_lower.endswith('.bmp'):
-        media_type = "image/bmp"
-    elif file_path_lower.endswith('.webp'):
-        media_type = "image/webp"
-    else:
-        media_type = "application/octet-stream"
-    return FileResponse(
-        order.payment_proof_path,
-        filename=os.path.basename(order.payment_proof_path),
-        media_type=media_type
+    return row
+
+
+@app.get("/orders/{order_id}/receipt")
+def download_receipt(order_id: int, request: Request, db: Session = Depends(get_db)):
+    row = _order_proof_row(order_id, request, db)
+    extension = os.path.splitext(row.payment_proof_path)[1].lower()
+    return upload_store.serve(
+        request, row.payment_proof_path, row.sha256, row.media_type, row.created_at,
+        filename=f"receipt_{order_id}{extension}", not_found_detail="Файл квитанции не найден",
     )
 
 
+@app.get("/orders/{order_id}/receipt/preview")
+async def receipt_preview(order_id: int, request: Request, db: Session = Depends(get_db)):
+    # Поиск строки — синхронные запросы к БД, не в event loop
+    row = await run_in_threadpool(_order_proof_row, order_id, request, db)
+    return await _proof_preview(request, row)
+
+
 @app.get("/orders", response_model=List[OrderResponse])
-def get_my_orders(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    orders = db.query(Order).filter(Order.user_id == user.id).order_by(Order.id.desc()).all()
-    return orders
+async def get_my_orders(request: Request, db: AsyncSession = Depends(get_async_db)):
+    user_id = get_current_user_id(request)
+    result = await db.execute(select(Order).where(Order.user_id == user_id).order_by(Order.id.desc()))
+    return result.scalars().all()
 
 
 @app.get("/orders/{order_id}", response_model=OrderResponse)
 def get_order_details(order_id: int, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user.id).first()
+    user_id = get_current_user_id(request)
+    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user_id).first()
 
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
@@ -800,20 +675,34 @@ def update_order_status(
         order_id: int,
         status: OrderStatus,
         db: Session = Depends(get_db),
-        admin: User = Depends(get_admin_user)
+        admin: Principal = Depends(get_admin_user)
 ):
     order = db.query(Order).filter(Order.id == order_id).first()
     if not order: raise HTTPException(404, "Заказ не найден")
-    order.status = status
+    old_status = order.status
+    # Условный UPDATE: если статус успел смениться (списание с баланса, другой админ), агрегат не трогаем
+    moved = db.execute(
+        update(Order).where(Order.id == order_id, Order.status == old_status).values(status=status)
+    ).rowcount
+    if moved != 1:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Статус заказа изменился, повторите запрос")
+    reports.on_order_status_change(db, order, old_status, status)
     db.commit()
     return {"message": f"Order marked as {status}"}
 
 
+@app.get("/admin/metrics")
+def get_metrics(admin: Principal = Depends(get_admin_user)):
+    """Задержки по маршрутам и число SQL-запросов на запрос (формат Prometheus)."""
+    return Response(content=metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
 @app.get("/admin/orders/ids")
 def get_order_ids_by_status(
         status: OrderStatus,
         db: Session = Depends(get_db),
-        admin: User = Depends(get_admin_user)
+        admin: Principal = Depends(get_admin_user)
 ):
     """
     Возвращает список ID заказов с указанным статусом.
@@ -824,101 +713,78 @@ def get_order_ids_by_status(
 
 @app.get("/admin/reports/docx")
 def download_table_report(
+    request: Request,
     date_query: Optional[date] = None,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     all_time: Optional[bool] = False,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_admin_user)
+    admin: Principal = Depends(get_admin_user)
 ):
     """
     Скачивание DOCX-отчёта (таблицы для столовой).
     Поддерживает те же режимы, что и summary: date_query, start_date+end_date, all_time.
-    Формат отчёта — список пользователей с их блюдами (каждая позиция по количеству раз).
+    Формат отчёта — таблица пользователей с их блюдами в виде «блюдо ×N».
+    Позиции группируются в БД, документ сохраняется один раз и кэшируется на диске
+    по (режим, период, версия оплаченных заказов); повторные скачивания отдаются
+    из кэша с поддержкой ETag / If-None-Match.
     """
     try:
-        # Подготовляем список OrderItem-ов в зависимости от режима
-        items = []
-
         if all_time:
-            items = db.query(OrderItem).join(Order).join(User).join(Dish).filter(Order.status == OrderStatus.PAID).all()
+            mode, period_start, period_end = 'all_time', None, None
             filename_suffix = 'all_time'
+            period_text = 'За всё время'
         elif start_date and end_date:
             if start_date > end_date:
                 start_date, end_date = end_date, start_date
-            # Заберём все оплаченные позиции и отфильтруем в Python по дате
-            candidates = db.query(OrderItem).join(Order).join(User).join(Dish).filter(Order.status == OrderStatus.PAID).all()
-            for it in candidates:
-                if not it.order or not it.order.week_start_date:
-                    continue
-                actual_date = it.order.week_start_date + timedelta(days=(it.day_of_week - 1))
-                actual_date_only = actual_date if isinstance(actual_date, date) else actual_date.date()
-                if start_date <= actual_date_only <= end_date:
-                    items.append(it)
+            mode, period_start, period_end = 'range', start_date, end_date
             filename_suffix = f"{start_date}_to_{end_date}"
+            period_text = f"За период: {start_date} — {end_date}"
         elif date_query:
             # single day — use isoweekday to match 1..7
-            day_idx = date_query.isoweekday()
-            items = db.query(OrderItem).join(Order).join(User).join(Dish) \
-                .filter(OrderItem.day_of_week == day_idx) \
-                .filter(Order.status == OrderStatus.PAID) \
-                .all()
+            mode, period_start, period_end = 'weekday', date_query, None
             filename_suffix = f"{date_query}"
+            period_text = f"За день: {date_query}"
         else:
             raise HTTPException(status_code=400, detail="Укажите date_query или start_date+end_date или all_time=true")
 
-        user_map = {}
-        for it in items:
-            uid = it.order.user_id if it.order else None
-            if uid is None:
-                continue
-            if uid not in user_map:
-                user_map[uid] = {
-                    "user_name": f"{it.order.user.name} {it.order.user.secondary_name}",
-                    "user_class": it.order.user.status,
-                    "dishes": [],
-                    "total": 0.0
-                }
-
-            d_name = it.dish.short_name if it.dish.short_name else it.dish.name
-            # Добавляем dish столько раз, сколько quantity и аккумулируем сумму
-            try:
-                qty = int(it.quantity or 0)
-            except Exception:
-                qty = 0
-            price = float(it.dish.price_rub or 0.0)
-            for _ in range(qty):
-                user_map[uid]["dishes"].append(d_name)
-            user_map[uid]["total"] += qty * price
-
-        report_data = list(user_map.values())
+        version = reports.get_data_version(db, reports.PAID_ORDERS_VERSION)
+        # Для weekday-режима ключ — сама дата: она входит в заголовок документа
+        key = report_cache.cache_key(mode, period_start, period_end, version)
+        cached = report_cache.lookup(key)
 
-        # Рассчитываем общий итог по всем пользователям
-        grand_total = sum(u.get('total', 0.0) for u in report_data)
+        if cached is None:
+            if mode == 'all_time':
+                rows = reports.iter_table_setting_rows(db)
+            elif mode == 'range':
+                rows = reports.iter_table_setting_rows(db, start_date=start_date, end_date=end_date)
+            else:
+                rows = reports.iter_table_setting_rows(db, day_idx=date_query.isoweekday())
 
-        # Формируем удобочитаемый заголовок периода
-        if all_time:
-            period_text = 'За всё время'
-        elif start_date and end_date:
-            period_text = f"За период: {start_date} — {end_date}"
-        elif date_query:
-            period_text = f"За день: {date_query}"
-        else:
-            period_text = ''
-
-        # Генерируем и возвращаем DOCX (передаём period и общий итог)
-        os.makedirs("reports", exist_ok=True)
-        path = docx_utils.generate_table_setting_report(report_data, filename=f"Report_{filename_suffix}.docx", period=period_text, grand_total=grand_total)
-        return FileResponse(path, filename=f"Table_Report_{filename_suffix}.docx")
+            path = report_cache.new_temp_path()
+            try:
+                docx_utils.generate_table_setting_report(rows, path, period=period_text)
+            except Exception:
+                os.remove(path)
+                raise
+            cached = report_cache.store(key, path)
+        elif request.headers.get("if-none-match") == cached.etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": cached.etag})
+
+        return FileResponse(
+            cached.path,
+            filename=f"Table_Report_{filename_suffix}.docx",
+            headers={"ETag": cached.etag, "Cache-Control": "private, no-cache"}
+        )
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Error while generating docx report: {e}")
+        logger.exception("Error while generating docx report: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/module-menu/export")
-def export_module_menu(db: Session = Depends(get_db), admin: User = Depends(get_cook_or_admin_user)):
+def export_module_menu(db: Session = Depends(get_db), admin: Principal = Depends(get_cook_or_admin_user)):
     menu_items = db.query(ModuleMenu).join(Dish).order_by(ModuleMenu.day_of_week).all()
 
     output = io.StringIO()
@@ -951,7 +817,7 @@ def get_summary_report(
     end_date: Optional[date] = None,
     all_time: Optional[bool] = False,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_admin_user)
+    admin: Principal = Depends(get_admin_user)
 ):
     """
     Возвращает сводку по выручке/количеству блюд.
@@ -966,98 +832,35 @@ def get_summary_report(
     try:
         # Приоритет: all_time
         if all_time:
-            items = db.query(OrderItem).join(Order).join(Dish).filter(Order.status == OrderStatus.PAID).all()
-
-            stats_map = {}
-            for it in items:
-                d_id = it.dish.id
-                if d_id not in stats_map:
-                    stats_map[d_id] = {"name": it.dish.name, "qty": 0, "revenue": 0.0}
-                stats_map[d_id]["qty"] += (it.quantity or 0)
-                stats_map[d_id]["revenue"] += (it.quantity or 0) * (it.dish.price_rub or 0.0)
+            summary = reports.summary_all_time(db)
+            return {"date": "all_time", **summary}
 
-            items_list = [
-                {"dish": v["name"], "count": v["qty"], "revenue": v["revenue"]}
-                for v in stats_map.values()
-            ]
-            total_revenue = sum(v["revenue"] for v in stats_map.values())
-
-            return {"date": "all_time", "total_revenue": total_revenue, "items": items_list}
-
-        # Диапазон дат
+        # Диапазон дат: фактическая дата позиции вычисляется в самом запросе
         if start_date and end_date:
             if start_date > end_date:
                 # поменяем местами для удобства
                 start_date, end_date = end_date, start_date
 
-            items = db.query(OrderItem).join(Order).join(Dish).filter(Order.status == OrderStatus.PAID).all()
-
-            stats_map = {}
-            for it in items:
-                # Вычисляем фактическую дату позиции
-                if not it.order or not it.order.week_start_date:
-                    continue
-                actual_date = it.order.week_start_date + timedelta(days=(it.day_of_week - 1))
-                # Сравниваем как date
-                actual_date_only = actual_date if isinstance(actual_date, date) else actual_date.date()
-                if actual_date_only < start_date or actual_date_only > end_date:
-                    continue
-
-                d_id = it.dish.id
-                if d_id not in stats_map:
-                    stats_map[d_id] = {"name": it.dish.name, "qty": 0, "revenue": 0.0}
-                stats_map[d_id]["qty"] += (it.quantity or 0)
-                stats_map[d_id]["revenue"] += (it.quantity or 0) * (it.dish.price_rub or 0.0)
-
-            items_list = [
-                {"dish": v["name"], "count": v["qty"], "revenue": v["revenue"]}
-                for v in stats_map.values()
-            ]
-            total_revenue = sum(v["revenue"] for v in stats_map.values())
-
-            return {"date": {"start": start_date, "end": end_date}, "total_revenue": total_revenue, "items": items_list}
+            summary = reports.summary_for_range(db, start_date, end_date)
+            return {"date": {"start": start_date, "end": end_date}, **summary}
 
         # Совместимость: одиночная дата (weekday)
         if date_query:
             # Используем isoweekday: 1 = Monday, ..., 7 = Sunday — это соответствует значениям day_of_week в OrderItem
-            day_idx = date_query.isoweekday()
-
-            stats = db.query(
-                Dish.name,
-                func.sum(OrderItem.quantity).label("total_qty"),
-                func.sum(OrderItem.quantity * Dish.price_rub).label("total_revenue")
-            ).join(OrderItem, OrderItem.dish_id == Dish.id) \
-                .join(Order, OrderItem.order_id == Order.id) \
-                .filter(OrderItem.day_of_week == day_idx) \
-                .filter(Order.status == OrderStatus.PAID) \
-                .group_by(Dish.id).all()
-
-            total_day_revenue = sum(s.total_revenue for s in stats) if stats else 0
-
-            return {
-                "date": date_query,
-                "total_revenue": total_day_revenue,
-                "items": [
-                    {
-                        "dish": s.name,
-                        "count": s.total_qty,
-                        "revenue": s.total_revenue
-                    }
-                    for s in stats
-                ]
-            }
+            summary = reports.summary_for_weekday(db, date_query.isoweekday())
+            return {"date": date_query, **summary}
 
         # Если ничего явно не указано — просим клиента передать параметры
         raise HTTPException(status_code=400, detail="Укажите date_query или start_date+end_date или all_time=true")
     except HTTPException:
         raise
     except Exception as e:
-        logger.exception(f"Error while building summary report: {e}")
+        logger.exception("Error while building summary report: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.patch("/admin/users/by-email", response_model=UserResponse)
-def update_admin_status_by_email(data: AdminUpdateByEmailRequest, db: Session = Depends(get_db), admin: User = Depends(get_admin_user)):
+def update_admin_status_by_email(data: AdminUpdateByEmailRequest, db: Session = Depends(get_db), admin: Principal = Depends(get_admin_user)):
     user = db.query(User).filter(User.email == data.email).first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -1070,17 +873,19 @@ def update_admin_status_by_email(data: AdminUpdateByEmailRequest, db: Session =
         user.is_cook = data.is_cook
     db.commit()
     db.refresh(user)
+    # Роли изменились — закэшированный Principal больше не актуален
+    principal_cache.invalidate(user.id)
     return UserResponse.model_validate(user)
 
 
 # Новые эндпоинты для поваров/админов — просмотр заказов и статусов
 @app.get("/staff/orders", response_model=List[OrderResponse])
-def staff_get_orders(db: Session = Depends(get_db), staff: User = Depends(get_cook_or_admin_user)):
+def staff_get_orders(db: Session = Depends(get_db), staff: Principal = Depends(get_cook_or_admin_user)):
     orders = db.query(Order).order_by(Order.id.desc()).all()
     return orders
 
 @app.get("/staff/orders/{order_id}", response_model=OrderResponse)
-def staff_get_order(order_id: int, db: Session = Depends(get_db), staff: User = Depends(get_cook_or_admin_user)):
+def staff_get_order(order_id: int, db: Session = Depends(get_db), staff: Principal = Depends(get_cook_or_admin_user)):
     order = db.query(Order).filter(Order.id == order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
@@ -1088,87 +893,67 @@ def staff_get_order(order_id: int, db: Session = Depends(get_db), staff: User =
 
 
 @app.post('/balance/topups', response_model=TopupResponse)
-def create_topup(data: TopupCreateRequest, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+async def create_topup(data: TopupCreateRequest, request: Request, db: AsyncSession = Depends(get_async_db)):
+    user_id = get_current_user_id(request)
     if data.amount <= 0:
         raise HTTPException(status_code=400, detail='Amount must be positive')
 
-    topup = BalanceTopup(user_id=user.id, amount=data.amount, status=TopupStatus.PENDING)
+    topup = BalanceTopup(user_id=user_id, amount=data.amount, status=TopupStatus.PENDING)
     db.add(topup)
-    db.commit()
-    db.refresh(topup)
+    await db.commit()
+    await db.refresh(topup)
     return topup
 
 
 @app.post('/balance/topups/{topup_id}/proof')
-async def upload_topup_proof(topup_id: int, request: Request, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    topup = db.query(BalanceTopup).filter(BalanceTopup.id == topup_id).first()
+async def upload_topup_proof(topup_id: int, request: Request, file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    user_id = get_current_user_id(request)
+    topup = await db.get(BalanceTopup, topup_id)
     if not topup:
         raise HTTPException(status_code=404, detail='Topup not found')
-    if topup.user_id != user.id:
+    if topup.user_id != user_id:
         raise HTTPException(status_code=403, detail='Forbidden')
 
-    allowed_mime_types = [
-        "application/pdf",
-        "image/jpeg",
-        "image/jpg",
-        "image/png",
-        "image/bmp",
-        "image/webp",
-    ]
-    if file.content_type not in allowed_mime_types:
-        raise HTTPException(status_code=400, detail="Недопустимый тип файла. Разрешены только PDF и изображения (JPEG, PNG, JPG, BMP, WEBP).")
-
-    forbidden_extensions = {".exe", ".zip", ".rar", ".7z", ".tar", ".gz", ".sh", ".bat", ".cmd", ".msi", ".dmg"}
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext in forbidden_extensions:
-        raise HTTPException(status_code=400, detail="Загрузка исполняемых файлов и архивов запрещена.")
-
-    os.makedirs("uploads", exist_ok=True)
-    file_location = f"uploads/topup_{topup_id}_{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        file_object.write(await file.read())
+    stored = await upload_store.save_upload(file)
 
-    topup.payment_proof_path = file_location
+    topup.payment_proof_path = await db.run_sync(upload_store.replace_reference, topup.payment_proof_path, stored)
     topup.status = TopupStatus.ON_REVIEW
-    db.commit()
+    await db.commit()
+    thumbnails.schedule(stored)
 
     return {"message": "Topup proof uploaded"}
 
 
-@app.get('/balance/topups/{topup_id}/proof')
-async def download_topup_proof(topup_id: int, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
-    topup = db.query(BalanceTopup).filter(BalanceTopup.id == topup_id).first()
-    if not topup:
+def _topup_proof_row(topup_id: int, request: Request, db: Session):
+    principal = get_principal(request, db)
+    row = _proof_row(db, BalanceTopup, topup_id)
+    if not row:
         raise HTTPException(status_code=404, detail='Topup not found')
-    if topup.user_id != user.id and not user.is_admin:
+    if row.user_id != principal.user_id and not principal.is_admin:
         raise HTTPException(status_code=403, detail='Forbidden')
-    if not topup.payment_proof_path:
+    if not row.payment_proof_path:
         raise HTTPException(status_code=404, detail='Proof not uploaded')
-    if not os.path.exists(topup.payment_proof_path):
-        raise HTTPException(status_code=404, detail='File not found')
-
-    file_path_lower = topup.payment_proof_path.lower()
-    if file_path_lower.endswith('.pdf'):
-        media_type = "application/pdf"
-    elif file_path_lower.endswith('.png'):
-        media_type = "image/png"
-    elif file_path_lower.endswith('.jpg') or file_path_lower.endswith('.jpeg'):
-        media_type = "image/jpeg"
-    elif file_path_lower.endswith('.bmp'):
-        media_type = "image/bmp"
-    elif file_path_lower.endswith('.webp'):
-        media_type = "image/webp"
-    else:
-        media_type = "application/octet-stream"
+    return row
 
-    return FileResponse(topup.payment_proof_path, filename=os.path.basename(topup.payment_proof_path), media_type=media_type)
+
+@app.get('/balance/topups/{topup_id}/proof')
+def download_topup_proof(topup_id: int, request: Request, db: Session = Depends(get_db)):
+    row = _topup_proof_row(topup_id, request, db)
+    extension = os.path.splitext(row.payment_proof_path)[1].lower()
+    return upload_store.serve(
+        request, row.payment_proof_path, row.sha256, row.media_type, row.created_at,
+        filename=f"topup_{topup_id}{extension}", not_found_detail='File not found',
+    )
+
+
+@app.get('/balance/topups/{topup_id}/proof/preview')
+async def topup_proof_preview(topup_id: int, request: Request, db: Session = Depends(get_db)):
+    row = await run_in_threadpool(_topup_proof_row, topup_id, request, db)
+    return await _proof_preview(request, row)
 
 
 @app.patch('/admin/balance/topups/{topup_id}/status')
-def admin_update_topup_status(topup_id: int, status: TopupStatus, amount: Optional[float] = None, db: Session = Depends(get_db), admin: User = Depends(get_admin_user)):
+def admin_update_topup_status(topup_id: int, status: TopupStatus, amount: Optional[float] = None, db: Session = Depends(get_db), admin: Principal = Depends(get_admin_user)):
     topup = db.query(BalanceTopup).filter(BalanceTopup.id == topup_id).first()
     if not topup:
         raise HTTPException(status_code=404, detail='Topup not found')
@@ -1176,11 +961,8 @@ def admin_update_topup_status(topup_id: int, status: TopupStatus, amount: Option
     if topup.status == status:
         return {"message": f"Status already {status.value}"}
 
-    # Если переводим в PAID, прибавляем баланс
+    # Если переводим в PAID, зачисляем сумму на баланс (запись в журнале balance_ledger)
     if status == TopupStatus.PAID:
-        user = db.query(User).filter(User.id == topup.user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail='User not found')
         # Определяем сумму, которую админ хочет зачислить: если передан параметр amount — используем его и запишем в topup.amount;
         # иначе используем ранее заявленную сумму в topup.amount.
         used_amount = topup.amount or 0.0
@@ -1189,17 +971,36 @@ def admin_update_topup_status(topup_id: int, status: TopupStatus, amount: Option
                 used_amount = float(amount)
             except Exception:
                 raise HTTPException(status_code=400, detail='Invalid amount')
-            topup.amount = used_amount
-
-        user.balance = (user.balance or 0.0) + used_amount
-
-    topup.status = status
+        kopecks = ledger.to_kopecks(used_amount)
+        if kopecks < 0:
+            raise HTTPException(status_code=400, detail='Invalid amount')
+
+        # Условный переход в PAID: параллельный запрос того же админа не зачислит сумму второй раз
+        moved = db.execute(
+            update(BalanceTopup)
+            .where(BalanceTopup.id == topup_id, BalanceTopup.status != TopupStatus.PAID)
+            .values(status=TopupStatus.PAID, amount=ledger.to_rubles(kopecks))
+        ).rowcount
+        if not moved:
+            db.rollback()
+            return {"message": f"Status already {status.value}"}
+        try:
+            credited = ledger.credit(db, topup.user_id, kopecks, LedgerEntryKind.TOPUP, topup_id=topup_id)
+        except IntegrityError:
+            # Пополнение уже зачислялось раньше (PAID -> другой статус -> PAID)
+            db.rollback()
+            raise HTTPException(status_code=409, detail='Topup already credited')
+        if credited is None:
+            db.rollback()
+            raise HTTPException(status_code=404, detail='User not found')
+    else:
+        topup.status = status
     db.commit()
 
     return {"message": f"Topup {topup_id} marked as {status.value}"}
 
 @app.get('/admin/balance/topups_all', response_model=List[TopupResponse])
-def admin_list_topups(db: Session = Depends(get_db), admin: User = Depends(get_admin_user)):
+def admin_list_topups(db: Session = Depends(get_db), admin: Principal = Depends(get_admin_user)):
     """Возвращает список всех пополнений для админов (новые вверху)"""
     topups = db.query(BalanceTopup).order_by(BalanceTopup.id.desc()).all()
     return topups
@@ -1207,8 +1008,8 @@ def admin_list_topups(db: Session = Depends(get_db), admin: User = Depends(get_a
 @app.post("/orders/{order_id}/charge")
 def charge_order_from_balance(order_id: int, request: Request, db: Session = Depends(get_db)):
     """Списать сумму заказа с баланса пользователя и пометить заказ как PAID, если хватает средств."""
-    user = get_current_user(request, db)
-    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user.id).first()
+    user_id = get_current_user_id(request)
+    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user_id).first()
 
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
@@ -1216,27 +1017,32 @@ def charge_order_from_balance(order_id: int, request: Request, db: Session = Dep
     if order.status != OrderStatus.PENDING:
         raise HTTPException(status_code=400, detail="Списать можно только заказы в статусе PENDING")
 
-    amount = float(order.total_amount or 0.0)
+    # Переход PENDING -> PAID условным UPDATE: из параллельных запросов на один заказ пройдёт только один
+    moved = db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == OrderStatus.PENDING)
+        .values(status=OrderStatus.PAID)
+    ).rowcount
+    if not moved:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Списать можно только заказы в статусе PENDING")
 
-    # Проверка достаточности баланса
-    if (user.balance or 0.0) < amount:
+    # Списание только при достаточном балансе — проверку делает сама БД (ledger.py)
+    try:
+        balance = ledger.debit(
+            db, user_id, ledger.to_kopecks(order.total_amount or 0.0), LedgerEntryKind.ORDER_CHARGE, order_id=order_id
+        )
+    except ledger.InsufficientFunds:
+        db.rollback()
         raise HTTPException(status_code=400, detail='Недостаточно средств на балансе')
 
-    # Выполняем списание — гарантия, что баланс не станет < 0
-    new_balance = (user.balance or 0.0) - amount
-    if new_balance < 0:
-        # На всякий случай, не допускаем отрицательного баланса
-        new_balance = 0.0
-
-    user.balance = new_balance
-    order.status = OrderStatus.PAID
+    reports.on_order_status_change(db, order, OrderStatus.PENDING, OrderStatus.PAID)
     # Не меняем поле payment_proof_path — чеки остаются
 
     db.commit()
-    db.refresh(user)
-    db.refresh(order)
 
-    return {"message": f"Заказ #{order_id} оплачен со счёта. Остаток: {user.balance:.2f} ₽", "balance": user.balance}
+    balance_rub = ledger.to_rubles(balance)
+    return {"message": f"Заказ #{order_id} оплачен со счёта. Остаток: {balance_rub:.2f} ₽", "balance": balance_rub}
 
 if __name__ == "__main__":
     import init_db
@@ -0,0 +1,67 @@
+"""
+Кэш меню в памяти процесса.
+
+GET /menu и GET /module-menu меняются только когда повар загружает меню,
+поэтому ответы хранятся уже сериализованными в JSON (bytes) вместе с ETag.
+Любое изменение меню вызывает bump(), который поднимает версию и очищает кэш.
+"""
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable
+
+from fastapi import Request, Response, status
+
+
+@dataclass(frozen=True)
+class CachedPayload:
+    body: bytes
+    etag: str
+
+
+class VersionedCache:
+    def __init__(self):
+        self._version = 0
+        self._entries: Dict[Hashable, CachedPayload] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def bump(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def _store(self, key: Hashable, body: bytes, version: int) -> CachedPayload:
+        payload = CachedPayload(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        with self._lock:
+            # Если меню поменялось во время построения — не сохраняем устаревший ответ
+            if version == self._version:
+                self._entries[key] = payload
+        return payload
+
+    def get_or_build(self, key: Hashable, builder: Callable[[], bytes]) -> CachedPayload:
+        payload = self._entries.get(key)
+        if payload is not None:
+            return payload
+        version = self._version
+        return self._store(key, builder(), version)
+
+    async def get_or_build_async(self, key: Hashable, builder: Callable[[], Awaitable[bytes]]) -> CachedPayload:
+        payload = self._entries.get(key)
+        if payload is not None:
+            return payload
+        version = self._version
+        return self._store(key, await builder(), version)
+
+
+menu_cache = VersionedCache()
+
+
+def cached_json_response(request: Request, payload: CachedPayload) -> Response:
+    headers = {"ETag": payload.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == payload.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
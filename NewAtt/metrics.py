@@ -0,0 +1,205 @@
+"""
+Метрики запросов и SQL в формате Prometheus.
+
+RequestMetricsMiddleware замеряет каждый HTTP-запрос: длительность, число
+SQL-запросов и время в БД. SQL считается через события SQLAlchemy на всех
+Engine (синхронных и async), а запрос, к которому относится SQL, определяется
+через contextvar — он виден и в потоках threadpool, и в async-сессиях.
+Middleware стоит и на render_front.app, и на /api; запрос замеряет внешний
+из них, внутренний только пропускает его дальше.
+
+Настройки (.env):
+    METRICS_SLOW_REQUEST_SECONDS — запросы дольше порога пишутся в лог (WARNING)
+
+Данные отдаёт GET /admin/metrics (text/plain, формат экспозиции Prometheus).
+"""
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from logger import logger
+
+METRICS_SLOW_REQUEST_SECONDS = float(os.getenv("METRICS_SLOW_REQUEST_SECONDS", 1.0))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами; значения хранятся по набору меток."""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Labels) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(snapshot):
+            base = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+            prefix = base + "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.help_text}\n# TYPE {self.name} counter\n{self.name} {self.value}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", LATENCY_BUCKETS)
+request_db_queries = Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request", QUERY_COUNT_BUCKETS)
+request_db_duration = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL per HTTP request", LATENCY_BUCKETS)
+db_queries_total = Counter("db_queries_total", "SQL statements executed (including background tasks)")
+db_query_seconds_total = Counter("db_query_seconds_total", "Time spent in SQL (including background tasks)")
+slow_requests_total = Counter("http_slow_requests_total", "Requests slower than METRICS_SLOW_REQUEST_SECONDS")
+
+
+def render() -> str:
+    metrics = (request_duration, request_db_queries, request_db_duration,
+               db_queries_total, db_query_seconds_total, slow_requests_total)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# --- SQL ---
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db_queries_total.inc()
+    db_query_seconds_total.inc(elapsed)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # after_cursor_execute не вызывается при ошибке — снимаем отметку времени
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+# --- HTTP ---
+
+def _route_label(scope: Scope) -> str:
+    # После маршрутизации Starlette/FastAPI кладут в scope найденный маршрут (шаблон пути)
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return "unmatched"
+    return scope.get("root_path", "") + path
+
+
+class RequestMetricsMiddleware:
+    """Чистый ASGI-middleware: замер запроса целиком, включая отправку тела ответа."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Запрос уже замеряет внешний middleware (render_front -> /api)
+        if scope["type"] != "http" or _current_request.get() is not None:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_request.reset(token)
+            self._record(scope, status_code, elapsed, stats)
+
+    @staticmethod
+    def _record(scope: Scope, status_code: int, elapsed: float, stats: RequestStats) -> None:
+        route = _route_label(scope)
+        labels = (("method", scope["method"]), ("route", route), ("status", str(status_code)))
+        request_duration.observe(elapsed, labels)
+        route_labels = (("method", scope["method"]), ("route", route))
+        request_db_queries.observe(stats.queries, route_labels)
+        request_db_duration.observe(stats.db_seconds, route_labels)
+
+        if elapsed >= METRICS_SLOW_REQUEST_SECONDS:
+            slow_requests_total.inc()
+            logger.warning(
+                "Slow request %s %s (%s): %.3fs, status %s, %d SQL queries (%.3fs)",
+                scope["method"], scope["path"], route, elapsed, status_code, stats.queries, stats.db_seconds,
+            )
@@ -0,0 +1,143 @@
+"""
+Версионные миграции схемы БД.
+
+Миграции лежат в пакете migrations/ в файлах вида NNNN_описание.py и применяются
+по порядку номеров. Каждая миграция определяет функцию upgrade(conn) и
+выполняется в отдельной транзакции; номер применённой миграции записывается
+в таблицу schema_version.
+
+Запуск:
+    python migrate.py upgrade [database_url]   — применить недостающие миграции
+    python migrate.py status  [database_url]   — показать текущую и последнюю версию
+"""
+import importlib
+import os
+import pkgutil
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from types import ModuleType
+from typing import List
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from logger import logger
+
+MIGRATIONS_PACKAGE = "migrations"
+_MIGRATION_NAME = re.compile(r"^(\d{4})_(\w+)$")
+
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    module: ModuleType
+
+
+def load_migrations() -> List[Migration]:
+    package = importlib.import_module(MIGRATIONS_PACKAGE)
+    migrations = []
+    for info in pkgutil.iter_modules(package.__path__):
+        match = _MIGRATION_NAME.match(info.name)
+        if not match:
+            continue
+        module = importlib.import_module(f"{MIGRATIONS_PACKAGE}.{info.name}")
+        migrations.append(Migration(version=int(match.group(1)), name=match.group(2), module=module))
+    migrations.sort(key=lambda m: m.version)
+    return migrations
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(schema_version.name):
+            return 0
+        return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine: Engine) -> int:
+    """Применяет все недостающие миграции. Возвращает итоговую версию схемы."""
+    schema_version.create(bind=engine, checkfirst=True)
+    version = current_version(engine)
+    for migration in load_migrations():
+        if migration.version <= version:
+            continue
+        logger.info("Applying migration %04d_%s", migration.version, migration.name)
+        with engine.begin() as conn:
+            migration.module.upgrade(conn)
+            conn.execute(schema_version.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+            ))
+        version = migration.version
+    return version
+
+
+_schema_checked = False
+
+
+def ensure_schema(engine: Engine) -> None:
+    """
+    Проверка при старте приложения: один запрос версии схемы.
+    Если база отстаёт — применяем недостающие миграции (отключается MIGRATE_ON_STARTUP=0).
+    """
+    global _schema_checked
+    if _schema_checked:
+        return
+
+    latest = load_migrations()[-1].version
+    version = current_version(engine)
+    if version < latest:
+        if os.getenv("MIGRATE_ON_STARTUP", "1").lower() in ("0", "false", "no"):
+            raise RuntimeError(
+                f"Database schema version {version} is behind {latest}; run `python migrate.py upgrade`"
+            )
+        logger.info("Database schema version %s is behind %s, upgrading", version, latest)
+        upgrade(engine)
+    _schema_checked = True
+
+
+# --- Помощники для идемпотентных миграций ---
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl: str) -> None:
+    """ddl — тип и опции колонки, например 'BOOLEAN DEFAULT 0'."""
+    if not has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        logger.info("Added column %s to %s table", column, table)
+
+
+def drop_column_if_exists(conn: Connection, table: str, column: str) -> None:
+    """Индексы на колонке нужно удалить заранее: SQLite не удаляет колонку с индексом."""
+    if has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+        logger.info("Dropped column %s from %s table", column, table)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import DATABASE_URL, create_db_engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command not in ("upgrade", "status"):
+        print("Usage: python migrate.py upgrade|status [database_url]")
+        sys.exit(1)
+
+    database_url = sys.argv[2] if len(sys.argv) > 2 else DATABASE_URL
+    engine = create_db_engine(database_url)
+    if command == "upgrade":
+        print(f"Schema version: {upgrade(engine)}")
+    else:
+        print(f"Schema version: {current_version(engine)} (latest: {load_migrations()[-1].version})")
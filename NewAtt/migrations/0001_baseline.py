@@ -0,0 +1,95 @@
+"""
+Базовая схема: таблицы на момент перехода на миграции.
+
+Схема зафиксирована здесь, а не берётся из models.py: результат миграции не
+должен меняться вместе с моделями, всё последующее добавляют свои миграции.
+Устаревшая колонка users.balance (REAL) в новые базы не попадает — баланс
+хранится в balance_kopecks (0007).
+
+Для старых баз, созданных до появления миграций, дополнительно добавляются
+колонки users, которые раньше досоздавались функциями ensure_*_column при
+импорте main.py (и скриптом add_allergies_column.py).
+"""
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, Enum, Float, ForeignKey, Integer, MetaData, String, Table, Text
+)
+from sqlalchemy.engine import Connection
+
+from migrate import add_column_if_missing
+
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, index=True),
+    Column("secondary_name", String),
+    Column("email", String, unique=True, index=True),
+    Column("status", String),
+    Column("is_admin", Boolean),
+    Column("is_cook", Boolean),
+    Column("email_verified", Boolean),
+    Column("verification_code", String, nullable=True),
+    Column("password_hash", String, nullable=True),
+    Column("password_reset_code", String, nullable=True),
+    Column("allergies", Text, nullable=True),
+)
+
+Table(
+    "dishes", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, index=True),
+    Column("short_name", String, nullable=True),
+    Column("type", Enum("MAIN", "GARNISH", "PREPARED", "DRINK", "SALAD", "SOUP", "BREAD", name="dishtype")),
+    Column("composition", String),
+    Column("quantity_grams", Integer),
+    Column("price_rub", Float),
+    Column("is_provider", Boolean),
+)
+
+Table(
+    "module_menu", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("day_of_week", Integer),
+    Column("dish_id", Integer, ForeignKey("dishes.id")),
+    Column("week_start_date", Date),
+)
+
+Table(
+    "orders", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("week_start_date", Date),
+    Column("created_at", DateTime),
+    Column("status", Enum("PENDING", "PAID", "PROBLEM", "CANCELED", "ON_REVIEW", name="orderstatus")),
+    Column("total_amount", Float),
+    Column("payment_proof_path", String, nullable=True),
+)
+
+Table(
+    "order_items", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("order_id", Integer, ForeignKey("orders.id")),
+    Column("dish_id", Integer, ForeignKey("dishes.id")),
+    Column("day_of_week", Integer),
+    Column("quantity", Integer),
+)
+
+Table(
+    "balance_topups", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("amount", Float),
+    Column("status", Enum("PENDING", "ON_REVIEW", "PAID", "REJECTED", name="topupstatus")),
+    Column("payment_proof_path", String, nullable=True),
+    Column("created_at", DateTime),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    metadata.create_all(bind=conn)
+
+    add_column_if_missing(conn, "users", "password_hash", "TEXT")
+    add_column_if_missing(conn, "users", "is_cook", "BOOLEAN DEFAULT FALSE")
+    add_column_if_missing(conn, "users", "password_reset_code", "TEXT")
+    add_column_if_missing(conn, "users", "allergies", "TEXT")
@@ -0,0 +1,21 @@
+"""Вторичные индексы под запросы эндпоинтов заказов, позиций, пополнений и меню."""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Зафиксированы здесь, а не берутся из models.py: индексы, добавленные в модели
+# позже, создают свои миграции
+INDEXES = [
+    ("ix_orders_user_id_id", "orders", "user_id, id"),
+    ("ix_orders_status_id", "orders", "status, id"),
+    ("ix_orders_status_week", "orders", "status, week_start_date"),
+    ("ix_order_items_order_id", "order_items", "order_id"),
+    ("ix_order_items_day_order", "order_items", "day_of_week, order_id"),
+    ("ix_module_menu_week_day_dish", "module_menu", "week_start_date, day_of_week, dish_id"),
+    ("ix_balance_topups_user_id", "balance_topups", "user_id"),
+    ("ix_users_password_reset_code", "users", "password_reset_code"),
+]
+
+
+def upgrade(conn: Connection) -> None:
+    for name, table, columns in INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
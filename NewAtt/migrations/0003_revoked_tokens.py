@@ -0,0 +1,17 @@
+"""Таблица отозванных токенов (logout и ротация refresh-токенов)."""
+from sqlalchemy import Column, DateTime, MetaData, String, Table
+from sqlalchemy.engine import Connection
+
+# Схема зафиксирована здесь, а не берётся из models.py (см. 0001)
+metadata = MetaData()
+
+revoked_tokens = Table(
+    "revoked_tokens", metadata,
+    Column("jti", String, primary_key=True),
+    Column("expires_at", DateTime, nullable=False),
+    Column("revoked_at", DateTime, nullable=False, index=True),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    revoked_tokens.create(bind=conn, checkfirst=True)
@@ -0,0 +1,25 @@
+"""Очередь исходящих писем (email_outbox)."""
+from sqlalchemy import Column, DateTime, Enum, Index, Integer, MetaData, String, Table, Text
+from sqlalchemy.engine import Connection
+
+# Схема зафиксирована здесь, а не берётся из models.py (см. 0001)
+metadata = MetaData()
+
+email_outbox = Table(
+    "email_outbox", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("to_email", String, nullable=False),
+    Column("subject", String, nullable=False),
+    Column("body_html", Text, nullable=False),
+    Column("status", Enum("PENDING", "SENT", "FAILED", name="emailstatus"), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("next_attempt_at", DateTime, nullable=False),
+    Column("last_error", Text, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("sent_at", DateTime, nullable=True),
+    Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    email_outbox.create(bind=conn, checkfirst=True)
@@ -0,0 +1,28 @@
+"""Таблица одноразовых кодов вместо users.verification_code / users.password_reset_code."""
+from sqlalchemy import Column, DateTime, Enum, ForeignKey, Index, Integer, MetaData, String, Table, text
+from sqlalchemy.engine import Connection
+
+# Схема зафиксирована здесь, а не берётся из models.py (см. 0001)
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True),
+)
+
+one_time_codes = Table(
+    "one_time_codes", metadata,
+    Column("code_hash", String, primary_key=True),
+    Column("purpose", Enum("VERIFY_EMAIL", "PASSWORD_RESET", name="codepurpose"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("expires_at", DateTime, nullable=False, index=True),
+    Column("attempts", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_one_time_codes_user_purpose", "user_id", "purpose"),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    one_time_codes.create(bind=conn, checkfirst=True)
+    # Старые коды хранились открытым текстом и без срока действия — больше не принимаются
+    conn.execute(text("UPDATE users SET verification_code = NULL, password_reset_code = NULL"))
@@ -0,0 +1,128 @@
+"""
+Хранилище загрузок по хэшу содержимого: таблица blobs и перенос существующих чеков.
+
+Схема и перенос зафиксированы здесь, а не берутся из models.py и upload_store.py
+(см. 0001): файлы, на которые ссылаются заказы и пополнения, копируются в
+UPLOAD_DIR/ab/cd/<sha256>.<ext>, payment_proof_path переписывается. Исходные
+файлы остаются — их удалит сборщик мусора upload_store.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, text
+from sqlalchemy.engine import Connection
+
+from logger import logger
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+_CHUNK_SIZE = 64 * 1024
+_SIGNATURES = (
+    (b"%PDF-", 0, "application/pdf", ".pdf"),
+    (b"\xff\xd8\xff", 0, "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png", ".png"),
+    (b"BM", 0, "image/bmp", ".bmp"),
+    (b"WEBP", 8, "image/webp", ".webp"),  # RIFF....WEBP
+)
+
+metadata = MetaData()
+
+blobs = Table(
+    "blobs", metadata,
+    Column("sha256", String(64), primary_key=True),
+    Column("path", String, nullable=False, unique=True),
+    Column("size", Integer, nullable=False),
+    Column("media_type", String, nullable=False),
+    Column("refcount", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_blobs_refcount_created", "refcount", "created_at"),
+)
+
+INDEXES = [
+    ("ix_orders_payment_proof_path", "orders", "payment_proof_path"),
+    ("ix_balance_topups_payment_proof_path", "balance_topups", "payment_proof_path"),
+]
+
+
+def _media_type(head: bytes, path: str):
+    for signature, offset, media_type, extension in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            if media_type == "image/webp" and not head.startswith(b"RIFF"):
+                continue
+            return media_type, extension
+    # Старые загрузки без распознанной сигнатуры: тип по имени файла
+    return mimetypes.guess_type(path)[0] or "application/octet-stream", os.path.splitext(path)[1].lower()
+
+
+def _copy_to_store(path: str):
+    """Копирует файл в хранилище по хэшу. Возвращает (sha256, новый путь, размер, media type)."""
+    tmp_dir = os.path.join(UPLOAD_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=tmp_dir)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        with open(path, "rb") as source, os.fdopen(fd, "wb") as target:
+            while chunk := source.read(_CHUNK_SIZE):
+                if not head:
+                    head = chunk
+                size += len(chunk)
+                digest.update(chunk)
+                target.write(chunk)
+        media_type, extension = _media_type(head, path)
+        sha256 = digest.hexdigest()
+        new_path = os.path.join(UPLOAD_DIR, sha256[:2], sha256[2:4], sha256 + extension)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(tmp_path, new_path)
+        return sha256, new_path, size, media_type
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _import_legacy(conn: Connection) -> int:
+    rows = conn.execute(text(
+        "SELECT path, count(*) FROM ("
+        " SELECT payment_proof_path AS path FROM orders WHERE payment_proof_path IS NOT NULL"
+        " UNION ALL"
+        " SELECT payment_proof_path AS path FROM balance_topups WHERE payment_proof_path IS NOT NULL"
+        ") AS proofs GROUP BY path"
+    )).all()
+    imported = 0
+    for path, references in rows:
+        if conn.execute(text("SELECT 1 FROM blobs WHERE path = :path"), {"path": path}).first():
+            continue
+        if not os.path.isfile(path):
+            logger.warning("Upload not found, reference kept as is: %s", path)
+            continue
+        sha256, new_path, size, media_type = _copy_to_store(path)
+        stored_path = conn.execute(text("SELECT path FROM blobs WHERE sha256 = :sha256"), {"sha256": sha256}).scalar()
+        if stored_path is None:
+            conn.execute(blobs.insert().values(
+                sha256=sha256, path=new_path, size=size, media_type=media_type,
+                refcount=references, created_at=datetime.utcnow(),
+            ))
+            stored_path = new_path
+        else:
+            # Тот же файл уже перенесён под другим старым именем
+            conn.execute(text("UPDATE blobs SET refcount = refcount + :count WHERE sha256 = :sha256"),
+                         {"count": references, "sha256": sha256})
+        for table in ("orders", "balance_topups"):
+            conn.execute(text(f"UPDATE {table} SET payment_proof_path = :new WHERE payment_proof_path = :old"),
+                         {"new": stored_path, "old": path})
+        imported += 1
+    logger.info("Imported %d legacy uploads into the blob store", imported)
+    return imported
+
+
+def upgrade(conn: Connection) -> None:
+    blobs.create(bind=conn, checkfirst=True)
+    for name, table, columns in INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+    _import_legacy(conn)
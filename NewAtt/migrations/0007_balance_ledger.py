@@ -0,0 +1,46 @@
+"""Баланс в целых копейках (users.balance_kopecks) и журнал balance_ledger."""
+from datetime import datetime
+
+from sqlalchemy import (
+    Column, DateTime, Enum, ForeignKey, Index, Integer, MetaData, Table, UniqueConstraint, text
+)
+from sqlalchemy.engine import Connection
+
+from migrate import add_column_if_missing, has_column
+
+# Схема зафиксирована здесь, а не берётся из models.py (см. 0001)
+metadata = MetaData()
+
+for _name in ("users", "orders", "balance_topups"):
+    Table(_name, metadata, Column("id", Integer, primary_key=True))
+
+balance_ledger = Table(
+    "balance_ledger", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("kind", Enum("OPENING", "TOPUP", "ORDER_CHARGE", name="ledgerentrykind"), nullable=False),
+    Column("amount_kopecks", Integer, nullable=False),
+    Column("balance_after_kopecks", Integer, nullable=False),
+    Column("order_id", Integer, ForeignKey("orders.id"), nullable=True),
+    Column("topup_id", Integer, ForeignKey("balance_topups.id"), nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_balance_ledger_user_id_id", "user_id", "id"),
+    UniqueConstraint("order_id", "kind", name="uq_balance_ledger_order_kind"),
+    UniqueConstraint("topup_id", "kind", name="uq_balance_ledger_topup_kind"),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    balance_ledger.create(bind=conn, checkfirst=True)
+    add_column_if_missing(conn, "users", "balance_kopecks", "INTEGER NOT NULL DEFAULT 0")
+    # Старая колонка balance (REAL) удаляется в 0010
+    if has_column(conn, "users", "balance"):
+        conn.execute(text(
+            "UPDATE users SET balance_kopecks = CAST(ROUND(COALESCE(balance, 0) * 100) AS INTEGER)"
+        ))
+
+    # Перенесённый остаток — первая запись журнала, чтобы сумма журнала совпадала с балансом
+    conn.execute(text(
+        "INSERT INTO balance_ledger (user_id, kind, amount_kopecks, balance_after_kopecks, created_at) "
+        "SELECT id, 'OPENING', balance_kopecks, balance_kopecks, :now FROM users WHERE balance_kopecks != 0"
+    ), {"now": datetime.utcnow()})
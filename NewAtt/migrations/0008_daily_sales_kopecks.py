@@ -0,0 +1,60 @@
+"""
+Агрегат daily_dish_sales с выручкой в целых копейках (revenue_kopecks вместо REAL revenue)
+и его заполнение по уже оплаченным заказам.
+
+Схема и заполнение зафиксированы здесь, а не берутся из models.py и reports.py (см. 0001).
+"""
+from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table, text
+from sqlalchemy.engine import Connection
+
+metadata = MetaData()
+
+Table(
+    "dishes", metadata,
+    Column("id", Integer, primary_key=True),
+)
+
+daily_dish_sales = Table(
+    "daily_dish_sales", metadata,
+    Column("sale_date", Date, primary_key=True),
+    Column("dish_id", Integer, ForeignKey("dishes.id"), primary_key=True),
+    Column("quantity", Integer, nullable=False, server_default="0"),
+    Column("revenue_kopecks", Integer, nullable=False, server_default="0"),
+)
+
+data_versions = Table(
+    "data_versions", metadata,
+    Column("name", String, primary_key=True),
+    Column("version", Integer, nullable=False, server_default="0"),
+)
+
+
+def _sale_date_sql(conn: Connection) -> str:
+    # Фактическая дата позиции: week_start_date + (day_of_week - 1) дней
+    if conn.dialect.name == "sqlite":
+        return "date(o.week_start_date, printf('+%d days', oi.day_of_week - 1))"
+    return "o.week_start_date + (oi.day_of_week - 1)"
+
+
+def upgrade(conn: Connection) -> None:
+    # Агрегат целиком выводится из заказов, поэтому таблица пересоздаётся, а не мигрируется
+    conn.execute(text("DROP TABLE IF EXISTS daily_dish_sales"))
+    daily_dish_sales.create(bind=conn)
+    data_versions.create(bind=conn, checkfirst=True)
+
+    sale_date = _sale_date_sql(conn)
+    conn.execute(text(
+        "INSERT INTO daily_dish_sales (sale_date, dish_id, quantity, revenue_kopecks) "
+        f"SELECT {sale_date}, oi.dish_id, sum(oi.quantity), "
+        "sum(oi.quantity * CAST(ROUND(d.price_rub * 100) AS INTEGER)) "
+        "FROM order_items oi "
+        "JOIN orders o ON oi.order_id = o.id "
+        "JOIN dishes d ON oi.dish_id = d.id "
+        "WHERE o.status = 'PAID' "
+        f"GROUP BY {sale_date}, oi.dish_id "
+        "HAVING sum(oi.quantity) > 0"
+    ))
+
+    # Кэш отчётов (report_cache) построен по старым данным — новая версия paid_orders
+    if not conn.execute(text("UPDATE data_versions SET version = version + 1 WHERE name = 'paid_orders'")).rowcount:
+        conn.execute(text("INSERT INTO data_versions (name, version) VALUES ('paid_orders', 1)"))
@@ -0,0 +1,11 @@
+"""Удаление users.verification_code и users.password_reset_code: коды живут в one_time_codes (0005)."""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from migrate import drop_column_if_exists
+
+
+def upgrade(conn: Connection) -> None:
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_password_reset_code"))
+    drop_column_if_exists(conn, "users", "verification_code")
+    drop_column_if_exists(conn, "users", "password_reset_code")
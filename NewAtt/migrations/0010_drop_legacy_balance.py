@@ -0,0 +1,8 @@
+"""Удаление users.balance (REAL): остаток перенесён в balance_kopecks и журнал в 0007."""
+from sqlalchemy.engine import Connection
+
+from migrate import drop_column_if_exists
+
+
+def upgrade(conn: Connection) -> None:
+    drop_column_if_exists(conn, "users", "balance")
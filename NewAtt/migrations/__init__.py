@@ -0,0 +1 @@
+"""Миграции схемы БД (см. migrate.py). Файлы: NNNN_описание.py с функцией upgrade(conn)."""
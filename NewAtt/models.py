@@ -1,4 +1,6 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Enum, Date, DateTime, Text
+from sqlalchemy import (
+    Boolean, Column, ForeignKey, Integer, String, Float, Enum, Date, DateTime, Text, Index, UniqueConstraint
+)
 from sqlalchemy.orm import relationship, declarative_base
 import enum
 from datetime import datetime
@@ -31,6 +33,23 @@ class TopupStatus(str, enum.Enum):
     REJECTED = "REJECTED"
 
 
+class CodePurpose(str, enum.Enum):
+    VERIFY_EMAIL = "VERIFY_EMAIL"
+    PASSWORD_RESET = "PASSWORD_RESET"
+
+
+class LedgerEntryKind(str, enum.Enum):
+    OPENING = "OPENING"  # остаток, перенесённый из старого users.balance
+    TOPUP = "TOPUP"
+    ORDER_CHARGE = "ORDER_CHARGE"
+
+
+class EmailStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    SENT = "SENT"
+    FAILED = "FAILED"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -42,15 +61,19 @@ class User(Base):
     is_admin = Column(Boolean, default=False)
     is_cook = Column(Boolean, default=False)
     email_verified = Column(Boolean, default=False)
-    verification_code = Column(String, nullable=True)
     password_hash = Column(String, nullable=True)  # Добавлено поле для хэша пароля
-    password_reset_code = Column(String, nullable=True)  # Код для сброса пароля
-    balance = Column(Float, default=0.0)
+    # Баланс в копейках; меняется только через ledger.py (вместе с записью в balance_ledger)
+    balance_kopecks = Column(Integer, default=0, nullable=False)
     allergies = Column(Text, nullable=True)  # Текстовое поле для записи аллергий
 
     orders = relationship("Order", back_populates="user")
     topups = relationship("BalanceTopup", back_populates="user")
 
+    @property
+    def balance(self) -> float:
+        """Баланс в рублях (для ответов API)."""
+        return (self.balance_kopecks or 0) / 100
+
 
 class Dish(Base):
     __tablename__ = "dishes"
@@ -67,6 +90,10 @@ class Dish(Base):
 
 class ModuleMenu(Base):
     __tablename__ = "module_menu"
+    __table_args__ = (
+        # GET /module-menu и проверка блюд в create_order: выборка по неделе
+        Index("ix_module_menu_week_day_dish", "week_start_date", "day_of_week", "dish_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     day_of_week = Column(Integer)
@@ -78,6 +105,15 @@ class ModuleMenu(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # GET /orders: заказы пользователя, новые сверху
+        Index("ix_orders_user_id_id", "user_id", "id"),
+        # /admin/orders/ids и отчёты по оплаченным заказам за период
+        Index("ix_orders_status_id", "status", "id"),
+        Index("ix_orders_status_week", "status", "week_start_date"),
+        # Ссылки на файлы чеков (счётчики blobs, сборщик мусора upload_store)
+        Index("ix_orders_payment_proof_path", "payment_proof_path"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -94,6 +130,12 @@ class Order(Base):
 
 class OrderItem(Base):
     __tablename__ = "order_items"
+    __table_args__ = (
+        # Позиции конкретного заказа (агрегат продаж, отчёты)
+        Index("ix_order_items_order_id", "order_id"),
+        # Отчёты за день недели
+        Index("ix_order_items_day_order", "day_of_week", "order_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"))
@@ -107,6 +149,10 @@ class OrderItem(Base):
 
 class BalanceTopup(Base):
     __tablename__ = "balance_topups"
+    __table_args__ = (
+        Index("ix_balance_topups_user_id", "user_id"),
+        Index("ix_balance_topups_payment_proof_path", "payment_proof_path"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -116,3 +162,109 @@ class BalanceTopup(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="topups")
+
+
+class DailyDishSales(Base):
+    """Агрегат продаж по календарной дате и блюду (обновляется при переходе заказа в/из PAID)."""
+    __tablename__ = "daily_dish_sales"
+
+    sale_date = Column(Date, primary_key=True)
+    dish_id = Column(Integer, ForeignKey("dishes.id"), primary_key=True)
+    quantity = Column(Integer, default=0, nullable=False)
+    revenue_kopecks = Column(Integer, default=0, nullable=False)
+
+    dish = relationship("Dish")
+
+
+class DataVersion(Base):
+    """Счётчики версий данных (например, для инвалидации кэша отчётов)."""
+    __tablename__ = "data_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+
+class RevokedToken(Base):
+    """Отозванные JWT (по jti); строки с истёкшим expires_at можно удалять."""
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String, primary_key=True)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class EmailOutbox(Base):
+    """Очередь исходящих писем; отправляет фоновый воркер (mailer.py)."""
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        # Выборка воркера: ожидающие письма, срок отправки которых наступил
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body_html = Column(Text, nullable=False)
+    status = Column(Enum(EmailStatus), default=EmailStatus.PENDING, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+
+class OneTimeCode(Base):
+    """Одноразовые коды (подтверждение почты, сброс пароля); хранится только хэш кода."""
+    __tablename__ = "one_time_codes"
+    __table_args__ = (
+        Index("ix_one_time_codes_user_purpose", "user_id", "purpose"),
+    )
+
+    code_hash = Column(String, primary_key=True)
+    purpose = Column(Enum(CodePurpose), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Blob(Base):
+    """
+    Файл в хранилище загрузок (upload_store.py), ключ — SHA-256 содержимого.
+    refcount — число заказов и пополнений, у которых payment_proof_path == path.
+    """
+    __tablename__ = "blobs"
+    __table_args__ = (
+        # Поиск кандидатов на удаление сборщиком мусора
+        Index("ix_blobs_refcount_created", "refcount", "created_at"),
+    )
+
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String, nullable=False, unique=True)
+    size = Column(Integer, nullable=False)
+    media_type = Column(String, nullable=False)
+    refcount = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class BalanceLedger(Base):
+    """
+    Журнал движений баланса (только добавление). Для каждого пользователя
+    сумма amount_kopecks равна users.balance_kopecks.
+    """
+    __tablename__ = "balance_ledger"
+    __table_args__ = (
+        Index("ix_balance_ledger_user_id_id", "user_id", "id"),
+        # Заказ списывается и пополнение зачисляется не больше одного раза
+        UniqueConstraint("order_id", "kind", name="uq_balance_ledger_order_kind"),
+        UniqueConstraint("topup_id", "kind", name="uq_balance_ledger_topup_kind"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(Enum(LedgerEntryKind), nullable=False)
+    amount_kopecks = Column(Integer, nullable=False)  # > 0 — зачисление, < 0 — списание
+    balance_after_kopecks = Column(Integer, nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    topup_id = Column(Integer, ForeignKey("balance_topups.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
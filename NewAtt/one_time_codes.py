@@ -0,0 +1,117 @@
+"""
+Одноразовые коды: подтверждение почты и сброс пароля.
+
+В таблице one_time_codes хранится только HMAC кода (вместе с назначением),
+поэтому проверка — поиск по первичному ключу без просмотра users.
+У кода есть срок действия и счётчик неверных попыток: после CODE_MAX_ATTEMPTS
+ошибок код удаляется и нужно запросить новый. Просроченные строки удаляет
+периодическая задача sweep_loop (запускается в lifespan).
+
+Настройки (.env): VERIFY_CODE_TTL_MINUTES, RESET_CODE_TTL_MINUTES,
+CODE_MAX_ATTEMPTS, CODE_SWEEP_INTERVAL.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from auth import SECRET_KEY
+from logger import logger
+from models import CodePurpose, OneTimeCode
+
+CODE_LENGTH = 6
+CODE_TTL_MINUTES = {
+    CodePurpose.VERIFY_EMAIL: int(os.getenv("VERIFY_CODE_TTL_MINUTES", 60)),
+    CodePurpose.PASSWORD_RESET: int(os.getenv("RESET_CODE_TTL_MINUTES", 15)),
+}
+CODE_MAX_ATTEMPTS = int(os.getenv("CODE_MAX_ATTEMPTS", 5))
+CODE_SWEEP_INTERVAL = float(os.getenv("CODE_SWEEP_INTERVAL", 300))
+
+
+def hash_code(purpose: CodePurpose, code: str) -> str:
+    message = f"{purpose.value}:{code.strip()}".encode()
+    return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def issue(db: Session, user_id: int, purpose: CodePurpose) -> str:
+    """Создаёт новый код (предыдущий код того же назначения удаляется). Коммитит вызывающий код."""
+    db.query(OneTimeCode).filter(
+        OneTimeCode.user_id == user_id, OneTimeCode.purpose == purpose
+    ).delete(synchronize_session=False)
+
+    while True:
+        code = f"{secrets.randbelow(10 ** CODE_LENGTH):0{CODE_LENGTH}d}"
+        code_hash = hash_code(purpose, code)
+        # Коды ищутся без email, поэтому среди действующих они должны быть уникальны
+        if db.get(OneTimeCode, code_hash) is None:
+            break
+
+    db.add(OneTimeCode(
+        code_hash=code_hash,
+        purpose=purpose,
+        user_id=user_id,
+        expires_at=datetime.utcnow() + timedelta(minutes=CODE_TTL_MINUTES[purpose]),
+    ))
+    return code
+
+
+def _record_failure(db: Session, user_id: int, purpose: CodePurpose) -> None:
+    row = db.query(OneTimeCode).filter(
+        OneTimeCode.user_id == user_id, OneTimeCode.purpose == purpose
+    ).first()
+    if row is None:
+        return
+    row.attempts += 1
+    if row.attempts >= CODE_MAX_ATTEMPTS:
+        logger.info("One-time code for user %s (%s) discarded after %s attempts", user_id, purpose.value, row.attempts)
+        db.delete(row)
+    db.commit()
+
+
+def consume(db: Session, purpose: CodePurpose, code: str, user_id: int) -> Optional[int]:
+    """
+    Проверяет код пользователя user_id и удаляет его. Возвращает user_id или None.
+    Неверная попытка засчитывается в счётчик его действующего кода.
+    """
+    row = db.get(OneTimeCode, hash_code(purpose, code))
+    valid = row is not None and row.expires_at > datetime.utcnow() and row.user_id == user_id
+    if not valid:
+        _record_failure(db, user_id, purpose)
+        return None
+
+    owner_id = row.user_id
+    db.delete(row)
+    return owner_id
+
+
+def sweep(db: Session) -> int:
+    """Удаляет просроченные коды."""
+    deleted = db.query(OneTimeCode).filter(OneTimeCode.expires_at <= datetime.utcnow()).delete()
+    db.commit()
+    return deleted
+
+
+def _sweep(session_factory: Callable[[], Session]) -> None:
+    db = session_factory()
+    try:
+        deleted = sweep(db)
+        if deleted:
+            logger.debug("Swept %s expired one-time codes", deleted)
+    finally:
+        db.close()
+
+
+async def sweep_loop(session_factory: Callable[[], Session], interval: float = None) -> None:
+    """Фоновая задача: периодически удаляет просроченные коды."""
+    interval = CODE_SWEEP_INTERVAL if interval is None else interval
+    while True:
+        try:
+            await asyncio.to_thread(_sweep, session_factory)
+        except Exception as e:
+            logger.error("One-time code sweep failed: %s", e)
+        await asyncio.sleep(interval)
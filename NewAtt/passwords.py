@@ -0,0 +1,238 @@
+"""
+Хеширование и проверка паролей.
+
+PBKDF2 (100k раундов) — тяжёлая операция, поэтому она выполняется в отдельном
+ограниченном пуле потоков (hashlib.pbkdf2_hmac отпускает GIL), а не в потоке
+обработчика запроса. Очередь на пул ограничена: при перегрузке запрос сразу
+получает 503 вместо того, чтобы занимать поток Starlette. Дополнительно
+ограничивается число неудачных попыток входа на один email.
+
+Настройки (.env):
+    PASSWORD_HASH_WORKERS      — размер пула (по умолчанию min(4, CPU))
+    PASSWORD_HASH_QUEUE        — сколько задач может ждать в очереди
+    LOGIN_MAX_FAILED_ATTEMPTS  — неудачных попыток на email за окно
+    LOGIN_ATTEMPT_WINDOW       — окно в секундах
+    LOGIN_THROTTLE_MAX_KEYS    — сколько email помнить (старые вытесняются)
+"""
+import asyncio
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from logger import logger
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 32))
+LOGIN_MAX_FAILED_ATTEMPTS = int(os.getenv("LOGIN_MAX_FAILED_ATTEMPTS", 10))
+LOGIN_ATTEMPT_WINDOW = float(os.getenv("LOGIN_ATTEMPT_WINDOW", 300))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", 10000))
+
+# Инициализация контекста для хеширования паролей
+# Используем PBKDF2-SHA256 как основной метод
+# Поддерживаем bcrypt для обратной совместимости со старыми хешами
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__rounds=100000  # Уменьшено для совместимости
+)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Проверка пароля против хеша"""
+    if not hashed_password:
+        return False
+
+    try:
+        # Очищаем пароль
+        plain_password = plain_password.strip()
+
+        # bcrypt имеет ограничение в 72 байта
+        if len(plain_password) > 72:
+            plain_password = plain_password[:72]
+
+        # Пробуем встроенную верификацию passlib
+        is_valid = pwd_context.verify(plain_password, hashed_password)
+        return is_valid
+    except Exception as e:
+        logger.debug("CryptContext verification failed: %s", e)
+
+        # Резервная попытка: проверить вручную если это наш формат
+        if hashed_password.startswith("pbkdf2:sha256:"):
+            try:
+                parts = hashed_password.split("$")
+                if len(parts) == 3:
+                    rounds = int(parts[0].split(":")[-1])
+                    salt = parts[1]
+                    stored_hash = parts[2]
+
+                    test_hash = hashlib.pbkdf2_hmac(
+                        'sha256',
+                        plain_password.encode(),
+                        salt.encode(),
+                        rounds
+                    )
+
+                    is_valid = test_hash.hex() == stored_hash
+                    if is_valid:
+                        logger.debug("Password verified using fallback method")
+                    return is_valid
+            except Exception as e2:
+                logger.debug("Fallback verification failed: %s", e2)
+
+        logger.error("Error verifying password: %s", e)
+        return False
+
+
+def get_password_hash(password: str) -> str:
+    """Хеширование пароля с безопасностью"""
+    # Убедимся, что пароль это строка
+    if not isinstance(password, str):
+        password = str(password)
+
+    # Очищаем от пробелов
+    password = password.strip()
+
+    # bcrypt имеет ограничение в 72 байта
+    if len(password) > 72:
+        logger.warning("Password truncated from %s to 72 bytes", len(password))
+        password = password[:72]
+
+    try:
+        # Используем встроенный PBKDF2 из passlib
+        hash_result = pwd_context.hash(password)
+        logger.debug("Password hashed successfully using pbkdf2_sha256")
+        return hash_result
+    except Exception as e:
+        logger.error("Error with CryptContext: %s", e)
+        # Резервный вариант - ручной PBKDF2
+        try:
+            salt = secrets.token_hex(32)
+            password_hash = hashlib.pbkdf2_hmac(
+                'sha256',
+                password.encode(),
+                salt.encode(),
+                100000
+            )
+            # Формат совместимый с нашей верификацией
+            hash_result = f"pbkdf2:sha256:100000${salt}${password_hash.hex()}"
+            logger.debug("Password hashed using fallback PBKDF2 method")
+            return hash_result
+        except Exception as e2:
+            logger.critical("Critical error hashing password: %s", e2)
+            raise HTTPException(status_code=500, detail="Error hashing password")
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Хеш в старом резервном формате или с устаревшими параметрами — пересчитать при входе."""
+    if not hashed_password:
+        return False
+    if hashed_password.startswith("pbkdf2:sha256:"):
+        return True
+    try:
+        return pwd_context.needs_update(hashed_password)
+    except Exception:
+        return False
+
+
+# --- Ограниченный пул для хеширования ---
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+# Выполняющиеся + ожидающие задачи; сверх лимита — отказ без ожидания
+_admission = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+def _submit(fn: Callable, *args) -> Future:
+    if not _admission.acquire(blocking=False):
+        logger.warning("Password hashing queue is full, rejecting request")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, попробуйте позже",
+            headers={"Retry-After": "1"},
+        )
+    future = _executor.submit(fn, *args)
+    future.add_done_callback(lambda _: _admission.release())
+    return future
+
+
+async def run_async(fn: Callable, *args):
+    """Выполнить fn (verify_password / get_password_hash) в пуле, не блокируя event loop."""
+    return await asyncio.wrap_future(_submit(fn, *args))
+
+
+def run_sync(fn: Callable, *args):
+    """То же для синхронных обработчиков: ждём результат из пула."""
+    return _submit(fn, *args).result()
+
+
+# --- Ограничение попыток входа ---
+
+class LoginThrottle:
+    """
+    Скользящее окно неудачных попыток входа по email. Ключи упорядочены по
+    последней неудаче, поэтому email с истёкшим окном и сверх max_keys
+    выбрасываются с начала — перебор случайных адресов не растит память.
+    """
+
+    def __init__(self, max_attempts: int, window: float, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._failures: OrderedDict[str, Deque[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._failures)
+
+    def _prune(self, now: float) -> None:
+        while self._failures:
+            failures = next(iter(self._failures.values()))
+            if failures[-1] > now - self.window and len(self._failures) <= self.max_keys:
+                break
+            self._failures.popitem(last=False)
+
+    def _recent(self, key: str, now: float) -> Deque[float]:
+        failures = self._failures.get(key)
+        if failures is None:
+            return deque()
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            self._failures.pop(key, None)
+        return failures
+
+    def check(self, email: str) -> None:
+        key = email.lower()
+        now = time.monotonic()
+        with self._lock:
+            failures = self._recent(key, now)
+            if len(failures) >= self.max_attempts:
+                retry_after = int(failures[0] + self.window - now) + 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Слишком много попыток входа, попробуйте позже",
+                    headers={"Retry-After": str(retry_after)},
+                )
+
+    def record_failure(self, email: str) -> None:
+        key = email.lower()
+        now = time.monotonic()
+        with self._lock:
+            failures = self._recent(key, now)
+            failures.append(now)
+            self._failures[key] = failures
+            self._failures.move_to_end(key)
+            self._prune(now)
+
+    def reset(self, email: str) -> None:
+        with self._lock:
+            self._failures.pop(email.lower(), None)
+
+
+login_throttle = LoginThrottle(LOGIN_MAX_FAILED_ATTEMPTS, LOGIN_ATTEMPT_WINDOW)
@@ -0,0 +1,113 @@
+"""
+Проверка планов горячих запросов (SQLite EXPLAIN QUERY PLAN).
+
+Для каждого запроса из hot_queries строится план; если хоть один шаг — полный
+просмотр таблицы (SCAN без индекса) или ожидаемый индекс из EXPECTED_INDEXES
+не используется, проверка завершается с кодом 1. Та же проверка есть в
+tests/test_query_plans.py.
+Запуск: python query_plans.py [database_url]
+"""
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import reports
+from models import BalanceTopup, Blob, CodePurpose, ModuleMenu, Order, OrderItem, OrderStatus, OneTimeCode
+
+
+# Индекс, по которому должен искать каждый горячий запрос; None — поиск по первичному ключу
+EXPECTED_INDEXES: Dict[str, Optional[str]] = {
+    "GET /orders": "ix_orders_user_id_id",
+    "GET /orders/{id}": None,
+    "GET /admin/orders/ids": "ix_orders_status_id",
+    "order items of order": "ix_order_items_order_id",
+    "GET /module-menu": "ix_module_menu_week_day_dish",
+    "POST /orders menu check": "ix_module_menu_week_day_dish",
+    "topups of user": "ix_balance_topups_user_id",
+    # Уникальные колонки SQLite индексирует автоматически
+    "POST /password/reset/confirm": "sqlite_autoindex_one_time_codes_1",
+    "one-time code of user": "ix_one_time_codes_user_purpose",
+    "expired codes sweep": "ix_one_time_codes_expires_at",
+    "upload refcount release": "sqlite_autoindex_blobs_2",
+    "orders referencing upload": "ix_orders_payment_proof_path",
+    "DOCX report for range": "ix_orders_status_week",
+}
+
+
+def hot_queries(db: Session) -> Dict[str, object]:
+    """Запросы эндпоинтов с параметрами-заглушками (значения на план не влияют)."""
+    return {
+        "GET /orders": select(Order).where(Order.user_id == 1).order_by(Order.id.desc()),
+        "GET /orders/{id}": select(Order).where(Order.id == 1, Order.user_id == 1),
+        "GET /admin/orders/ids": select(Order.id).where(Order.status == OrderStatus.PAID).order_by(Order.id),
+        "order items of order": select(OrderItem).where(OrderItem.order_id == 1),
+        "GET /module-menu": select(ModuleMenu).where(ModuleMenu.week_start_date == date(2026, 1, 5)),
+        "POST /orders menu check": select(ModuleMenu.day_of_week, ModuleMenu.dish_id)
+            .where(ModuleMenu.week_start_date == date(2026, 1, 5)),
+        "topups of user": select(BalanceTopup).where(BalanceTopup.user_id == 1),
+        "POST /password/reset/confirm": select(OneTimeCode).where(OneTimeCode.code_hash == "0" * 64),
+        "one-time code of user": select(OneTimeCode)
+            .where(OneTimeCode.user_id == 1, OneTimeCode.purpose == CodePurpose.PASSWORD_RESET),
+        "expired codes sweep": select(OneTimeCode).where(OneTimeCode.expires_at <= date(2026, 1, 5)),
+        "upload refcount release": select(Blob).where(Blob.path == "uploads/00/00/0.png"),
+        "orders referencing upload": select(Order.id).where(Order.payment_proof_path == "uploads/00/00/0.png"),
+        "DOCX report for range": reports._table_setting_query(db, date(2026, 1, 5), date(2026, 1, 9)).statement,
+    }
+
+
+def query_plan(engine: Engine, statement) -> List[str]:
+    compiled = statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+    # Строка плана: (id, parent, notused, detail)
+    return [row[3] for row in plan]
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    # «SCAN t» без «USING ... INDEX» — полный просмотр таблицы
+    return [step for step in plan if step.startswith("SCAN ") and "INDEX" not in step]
+
+
+def uses_index(plan: List[str], index: Optional[str]) -> bool:
+    if index is None:
+        return any("USING INTEGER PRIMARY KEY" in step for step in plan)
+    return any(f"USING INDEX {index} " in step or f"USING COVERING INDEX {index} " in step for step in plan)
+
+
+def problems(engine: Engine, statement, index: Optional[str]) -> List[str]:
+    plan = query_plan(engine, statement)
+    found = full_scans(plan)
+    if not uses_index(plan, index):
+        found.append(f"expected {index or 'primary key'} lookup, got: {' / '.join(plan)}")
+    return found
+
+
+def check(engine: Engine) -> bool:
+    ok = True
+    with Session(engine) as db:
+        for name, statement in hot_queries(db).items():
+            found = problems(engine, statement, EXPECTED_INDEXES[name])
+            if found:
+                ok = False
+                print(f"FAIL {name}: {'; '.join(found)}")
+            else:
+                print(f"ok   {name}")
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+
+    import migrate
+    from database import DATABASE_URL, create_db_engine
+
+    database_url = sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL
+    engine = create_db_engine(database_url)
+    if engine.dialect.name != "sqlite":
+        print("Query plan check supports SQLite only")
+        sys.exit(1)
+    migrate.upgrade(engine)
+    sys.exit(0 if check(engine) else 1)
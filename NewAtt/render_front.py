@@ -5,21 +5,18 @@ API доступно по тем же путям, что и раньше (без
 """
 from __future__ import annotations
 
-import os
+import asyncio
 import sys
-from datetime import datetime
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from starlette.responses import FileResponse
 
-from logger import logger
-from fastapi import Request, Depends, HTTPException
-from sqlalchemy.orm import Session
-from auth import require_admin
-from main import get_db
+from main import lifespan as api_lifespan
+from metrics import RequestMetricsMiddleware
+import frontend_assets
+from frontend_assets import STATIC_EXTENSIONS, AssetIndex, PageRouter
 
 # Добавляем путь к модулям бэкенда
 sys.path.insert(0, str(Path(__file__).parent / "NewAtt"))
@@ -30,8 +27,26 @@ from main import app as api_app
 # Определяем путь к фронтенду
 frontend_path = Path(__file__).parent.parent / "front12345"
 
+# JS/CSS/картинки читаются в память один раз при старте
+static_assets = AssetIndex(frontend_path)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # lifespan смонтированного api_app не вызывается, поэтому запускаем его здесь
+    async with api_lifespan(api_app):
+        # В режиме разработки перечитываем изменённые файлы фронтенда
+        watcher = None
+        if frontend_assets.FRONTEND_DEV:
+            watcher = asyncio.create_task(frontend_assets.watch(static_assets, pages))
+        try:
+            yield
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
 # Создаём основное приложение
-app = FastAPI(title="Canteen API with Frontend", version="1.0")
+app = FastAPI(title="Canteen API with Frontend", version="1.0", lifespan=lifespan)
 
 # Настраиваем CORS (повторяем настройки из NewAtt/main.py)
 app.add_middleware(
@@ -47,6 +62,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Замер всех запросов (и страниц, и /api); middleware внутри api_app такие запросы пропускает
+app.add_middleware(RequestMetricsMiddleware)
+
 # Монтируем API приложение под префиксом /api
 app.mount("/api", api_app)
 
@@ -95,77 +113,20 @@ HTML_MAPPING: dict[str, str] = (
 } | OLD_HTML_MAPPING | DEBUG_HTML_MAPPING)
 
 
+# Таблица маршрутов страниц: алиас -> страница в памяти
+pages = PageRouter(frontend_path, HTML_MAPPING, static_assets)
+
+
 @app.get("/{path:path}")
-async def catch_all(path: str, request: Request, db: Session = Depends(get_db)):
-    try:
-        if (path.endswith(".js") or
-            path.endswith(".css") or
-            path.endswith(".png") or
-            path.endswith(".jpg") or
-            path.endswith(".jpeg") or
-            path.endswith(".svg") or
-            path.endswith(".ico")):
-            # Если запрашивается статический файл, пробуем его отдать
-            logger.debug(f"Request for static file: {path}")
-            base_name_of_path = os.path.basename(path)
-            file_path = frontend_path / base_name_of_path
-            if file_path.is_file():
-                return FileResponse(file_path)
-            else:
-                logger.warning(f"Static file not found: {file_path}")
-                file_path = frontend_path / base_name_of_path[base_name_of_path.rfind('.')+1:] / base_name_of_path
-                if file_path.is_file():
-                    return FileResponse(file_path)
-                raise HTTPException(status_code=404, detail="Static file not found")
-        if path.endswith(".html"):
-            path = path[:-5]
-        elif "." in path:
-            logger.warning(f"Unsupported file type requested: {path}")
-            return FileResponse(frontend_path / "404.html", status_code=404)
-        html_file = HTML_MAPPING.get(path)
-        logger.debug(f"Request for path {path}, HTML file: {html_file}")
-        if html_file:
-            if (frontend_path / html_file).is_file():
-                return FileResponse(frontend_path / html_file)
-            else:
-                raise FileNotFoundError(f"File {frontend_path / html_file} doesn't exist")
-        else:
-            try:
-                logger.warning(f"File {path} not found, serving 404.html")
-                return FileResponse(frontend_path / "404.html", status_code=404)
-            except Exception as e:
-                logger.error(f"Error serving 404.html: {e}")
-                return {"error": "Internal server error: 404.html not found, please try again later."}, 500
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        logger.error(repr(e))
-        from starlette.responses import RedirectResponse, Response
-        import urllib.parse
-        
-        # Если запрашивается error.html, не делаем редирект, чтобы избежать цикла
-        if path == 'error.html' or path == 'error':
-            logger.error(f"Error occurred while serving error page: {e}")
-            return Response(
-                content=f"Internal Server Error: {e}",
-                status_code=500,
-                media_type="text/plain"
-            )
-        
-        # Create error details
-        error_message = str(e)
-        error_details = f"Exception occurred: {e.__class__.__name__}"
-        error_code = 500
-        
-        # Create URL with error parameters
-        error_url = f"/error.html?code={error_code}&message={urllib.parse.quote(error_message)}&details={urllib.parse.quote(error_details)}&timestamp={urllib.parse.quote(str(datetime.now().isoformat()))}"
-        logger.debug(f"Redirecting to error page: {error_url}")
-        
-        # Use 307 Temporary Redirect to preserve method and body, but we want to show error page
-        return RedirectResponse(url=error_url, status_code=307)
-
-# Статические файлы (CSS, JS, etc.) обслуживаем через StaticFiles
-# app.mount("/", StaticFiles(directory=str(frontend_path), html=True), name="static_root")
+async def catch_all(path: str, request: Request):
+    if path.endswith(STATIC_EXTENSIONS):
+        # Статика — из памяти, без обращения к диску
+        asset = static_assets.lookup(path)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Static file not found")
+        return asset.response(request)
+    return pages.respond(path, request)
+
 
 if __name__ == "__main__":
     # Инициализируем базу данных (если нужно)
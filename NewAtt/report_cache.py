@@ -0,0 +1,160 @@
+"""
+Дисковый кэш сгенерированных DOCX-отчётов.
+
+Отчёт хранится под хэшем своего содержимого (reports/cache/<sha256>.docx),
+а ключ запроса (режим, период, версия оплаченных заказов) указывает на него
+через маленький файл-ссылку <key>.ref. Запись атомарная (os.replace), поэтому
+параллельные скачивания не портят файлы друг друга. При превышении лимита
+размера удаляются давно не использованные отчёты (LRU по mtime). Отчёты,
+найденные или сохранённые за последние REPORT_CACHE_MIN_AGE секунд, не
+вытесняются: их путь уже мог быть отдан в FileResponse, который откроет файл
+только при отправке ответа. Вместе с отчётами удаляются ссылки на них и
+брошенные временные файлы (старше REPORT_CACHE_TMP_MAX_AGE).
+"""
+import hashlib
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from logger import logger
+
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join("reports", "cache"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", 100 << 20))  # 100MB
+REPORT_CACHE_MIN_AGE = float(os.getenv("REPORT_CACHE_MIN_AGE", 60))
+# Временный файл старше этого — остаток упавшей генерации отчёта
+REPORT_CACHE_TMP_MAX_AGE = float(os.getenv("REPORT_CACHE_TMP_MAX_AGE", 3600))
+
+_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class CachedReport:
+    path: str
+    content_hash: str
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.content_hash}"'
+
+
+def cache_key(mode: str, start: Optional[object], end: Optional[object], data_version: int) -> str:
+    raw = f"{mode}|{start or ''}|{end or ''}|{data_version}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _ref_path(key: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, f"{key}.ref")
+
+
+def _blob_path(content_hash: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, f"{content_hash}.docx")
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def lookup(key: str) -> Optional[CachedReport]:
+    """Возвращает закэшированный отчёт по ключу или None."""
+    try:
+        with open(_ref_path(key), "r", encoding="utf-8") as f:
+            content_hash = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    path = _blob_path(content_hash)
+    try:
+        # Обновляем mtime — отметка «недавно использован» для LRU
+        os.utime(path)
+    except FileNotFoundError:
+        # Отчёт вытеснен — ссылка больше не нужна
+        _remove(_ref_path(key))
+        return None
+    return CachedReport(path=path, content_hash=content_hash)
+
+
+def new_temp_path() -> str:
+    """Уникальный временный путь внутри каталога кэша (для атомарного переименования)."""
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".tmp", dir=REPORT_CACHE_DIR)
+    os.close(fd)
+    return path
+
+
+def store(key: str, temp_path: str) -> CachedReport:
+    """Перемещает готовый файл в кэш под хэшем содержимого и связывает с ним ключ."""
+    content_hash = _file_sha256(temp_path)
+    os.replace(temp_path, _blob_path(content_hash))
+
+    fd, ref_tmp = tempfile.mkstemp(suffix=".tmp", dir=REPORT_CACHE_DIR)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(content_hash)
+    os.replace(ref_tmp, _ref_path(key))
+
+    evict()
+    return CachedReport(path=_blob_path(content_hash), content_hash=content_hash)
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _read_ref(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def evict(max_bytes: int = None, min_age: float = None) -> None:
+    """
+    Удаляет самые давно использованные отчёты, пока кэш не уложится в лимит,
+    затем ссылки на отсутствующие отчёты (в том числе от прошлых версий данных)
+    и временные файлы, брошенные упавшей генерацией. Отчёты и ссылки новее
+    min_age секунд не трогаются.
+    """
+    max_bytes = REPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    min_age = REPORT_CACHE_MIN_AGE if min_age is None else min_age
+    blobs, refs, temps = [], [], []
+    total = 0
+    with os.scandir(REPORT_CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(".docx"):
+                st = entry.stat()
+                blobs.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+            elif entry.name.endswith(".ref"):
+                refs.append((entry.stat().st_mtime, entry.path))
+            elif entry.name.endswith(".tmp"):
+                temps.append((entry.stat().st_mtime, entry.path))
+
+    now = time.time()
+    recent_since = now - min_age
+    present = {os.path.basename(path)[:-len(".docx")] for _, _, path in blobs}
+    if total > max_bytes:
+        blobs.sort()
+        for mtime, size, path in blobs:
+            if total <= max_bytes or mtime > recent_since:
+                break
+            if _remove(path):
+                total -= size
+                logger.debug("Report cache evicted: %s", path)
+            present.discard(os.path.basename(path)[:-len(".docx")])
+
+    for mtime, path in refs:
+        if mtime <= recent_since and _read_ref(path) not in present:
+            _remove(path)
+    for mtime, path in temps:
+        if mtime <= now - REPORT_CACHE_TMP_MAX_AGE:
+            _remove(path)
@@ -0,0 +1,284 @@
+"""
+Агрегации для админских отчётов.
+Все суммы считаются на стороне БД одним GROUP BY-запросом, чтобы время ответа
+зависело от количества блюд, а не от количества строк заказов.
+
+Диапазонные отчёты читают предрассчитанную таблицу daily_dish_sales, которая
+обновляется при переходе заказа в статус PAID и обратно. Выручка считается в
+целых копейках и переводится в рубли только в ответе.
+Пересборка агрегата: python reports.py rebuild [database_url]
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import Date, Integer, cast, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import ledger
+from logger import logger
+from models import DailyDishSales, DataVersion, Dish, Order, OrderItem, OrderStatus, User
+
+
+def actual_date_expr(db: Session):
+    """SQL-выражение фактической даты позиции: week_start_date + (day_of_week - 1) дней."""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.date(Order.week_start_date, func.printf("+%d days", OrderItem.day_of_week - 1), type_=Date)
+    # PostgreSQL и прочие: date + integer -> date
+    return Order.week_start_date + (OrderItem.day_of_week - 1)
+
+
+def price_kopecks_expr():
+    """Цена блюда в целых копейках."""
+    return cast(func.round(Dish.price_rub * 100), Integer)
+
+
+def _dish_stats_query(db: Session):
+    return db.query(
+        Dish.name.label("name"),
+        func.sum(OrderItem.quantity).label("total_qty"),
+        func.sum(OrderItem.quantity * price_kopecks_expr()).label("total_kopecks"),
+    ).join(OrderItem, OrderItem.dish_id == Dish.id) \
+        .join(Order, OrderItem.order_id == Order.id) \
+        .filter(Order.status == OrderStatus.PAID)
+
+
+def _to_summary(rows) -> Dict:
+    rows = [r for r in rows if (r.total_qty or 0) > 0]
+    items = [
+        {"dish": r.name, "count": int(r.total_qty), "revenue": ledger.to_rubles(int(r.total_kopecks or 0))}
+        for r in rows
+    ]
+    total_kopecks = sum(int(r.total_kopecks or 0) for r in rows)
+    return {"total_revenue": ledger.to_rubles(total_kopecks), "items": items}
+
+
+def _rollup_stats_query(db: Session):
+    return db.query(
+        Dish.name.label("name"),
+        func.sum(DailyDishSales.quantity).label("total_qty"),
+        func.sum(DailyDishSales.revenue_kopecks).label("total_kopecks"),
+    ).join(DailyDishSales, DailyDishSales.dish_id == Dish.id)
+
+
+def summary_all_time(db: Session) -> Dict:
+    rows = _rollup_stats_query(db).group_by(Dish.id, Dish.name) \
+        .having(func.sum(DailyDishSales.quantity) > 0).all()
+    return _to_summary(rows)
+
+
+def summary_for_range(db: Session, start_date: date, end_date: date) -> Dict:
+    rows = _rollup_stats_query(db) \
+        .filter(DailyDishSales.sale_date.between(start_date, end_date)) \
+        .group_by(Dish.id, Dish.name) \
+        .having(func.sum(DailyDishSales.quantity) > 0).all()
+    return _to_summary(rows)
+
+
+def summary_for_weekday(db: Session, day_idx: int) -> Dict:
+    rows = _dish_stats_query(db) \
+        .filter(OrderItem.day_of_week == day_idx) \
+        .group_by(Dish.id, Dish.name).all()
+    return _to_summary(rows)
+
+
+# --- Отчёт для накрытия столов (DOCX) ---
+
+def _table_setting_query(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                         day_idx: Optional[int] = None):
+    """Позиции оплаченных заказов, сгруппированные по (пользователь, блюдо) и упорядоченные по пользователю."""
+    dish_label = func.coalesce(func.nullif(Dish.short_name, ""), Dish.name)
+    query = db.query(
+        User.id.label("user_id"),
+        User.name.label("name"),
+        User.secondary_name.label("secondary_name"),
+        User.status.label("user_class"),
+        dish_label.label("dish_name"),
+        func.sum(OrderItem.quantity).label("qty"),
+        func.sum(OrderItem.quantity * Dish.price_rub).label("total"),
+    ).select_from(OrderItem) \
+        .join(Order, OrderItem.order_id == Order.id) \
+        .join(User, Order.user_id == User.id) \
+        .join(Dish, OrderItem.dish_id == Dish.id) \
+        .filter(Order.status == OrderStatus.PAID)
+
+    if start_date and end_date:
+        query = query \
+            .filter(Order.week_start_date.between(start_date - timedelta(days=6), end_date)) \
+            .filter(actual_date_expr(db).between(start_date, end_date))
+    elif day_idx is not None:
+        query = query.filter(OrderItem.day_of_week == day_idx)
+
+    return query.group_by(User.id, User.name, User.secondary_name, User.status, dish_label) \
+        .order_by(User.id, dish_label)
+
+
+def iter_table_setting_rows(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                            day_idx: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Генератор блоков отчёта по пользователям:
+    { 'user_name': 'Имя Фамилия', 'user_class': ..., 'dishes': [('Суп', 2), ...], 'total': float }
+    Строки читаются из БД порциями, в памяти держится только текущий пользователь.
+    """
+    current = None
+    rows = _table_setting_query(db, start_date, end_date, day_idx).yield_per(500)
+    for row in rows:
+        if current is None or current["user_id"] != row.user_id:
+            if current is not None:
+                yield current
+            current = {
+                "user_id": row.user_id,
+                "user_name": f"{row.name} {row.secondary_name}",
+                "user_class": row.user_class,
+                "dishes": [],
+                "total": 0.0,
+            }
+        qty = int(row.qty or 0)
+        if qty <= 0:
+            continue
+        current["dishes"].append((row.dish_name, qty))
+        current["total"] += float(row.total or 0.0)
+    if current is not None:
+        yield current
+
+
+# --- Версии данных ---
+
+PAID_ORDERS_VERSION = "paid_orders"
+
+
+def get_data_version(db: Session, name: str) -> int:
+    version = db.query(DataVersion.version).filter(DataVersion.name == name).scalar()
+    return version or 0
+
+
+def bump_data_version(db: Session, name: str) -> None:
+    """Увеличивает версию в текущей транзакции. Коммит — на вызывающей стороне."""
+    updated = db.query(DataVersion).filter(DataVersion.name == name) \
+        .update({DataVersion.version: DataVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        db.add(DataVersion(name=name, version=1))
+
+
+# --- Агрегат daily_dish_sales ---
+
+def _daily_sales_select(db: Session, order_id: Optional[int] = None):
+    """Продажи по (дата, блюдо): для одного заказа или для всех оплаченных."""
+    actual_date = actual_date_expr(db)
+    query = db.query(
+        actual_date.label("sale_date"),
+        OrderItem.dish_id.label("dish_id"),
+        func.sum(OrderItem.quantity).label("quantity"),
+        func.sum(OrderItem.quantity * price_kopecks_expr()).label("revenue_kopecks"),
+    ).join(Order, OrderItem.order_id == Order.id) \
+        .join(Dish, OrderItem.dish_id == Dish.id)
+    if order_id is not None:
+        query = query.filter(OrderItem.order_id == order_id)
+    else:
+        query = query.filter(Order.status == OrderStatus.PAID)
+    return query.group_by(actual_date, OrderItem.dish_id)
+
+
+def _upsert_daily_sales(db: Session, rows: list) -> None:
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert_fn(DailyDishSales).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyDishSales.sale_date, DailyDishSales.dish_id],
+            set_={
+                "quantity": DailyDishSales.quantity + stmt.excluded.quantity,
+                "revenue_kopecks": DailyDishSales.revenue_kopecks + stmt.excluded.revenue_kopecks,
+            },
+        )
+        db.execute(stmt)
+        return
+
+    # Прочие диалекты: построчно через ORM
+    for row in rows:
+        entry = db.get(DailyDishSales, (row["sale_date"], row["dish_id"]))
+        if entry is None:
+            db.add(DailyDishSales(**row))
+        else:
+            entry.quantity = (entry.quantity or 0) + row["quantity"]
+            entry.revenue_kopecks = (entry.revenue_kopecks or 0) + row["revenue_kopecks"]
+    db.flush()
+
+
+def _delete_empty_daily_sales(db: Session, sale_dates: set) -> None:
+    """Убирает строки, обнулённые вычитанием заказа, чтобы в отчётах не было позиций с нулём."""
+    db.query(DailyDishSales) \
+        .filter(DailyDishSales.sale_date.in_(sale_dates), DailyDishSales.quantity <= 0) \
+        .delete(synchronize_session=False)
+
+
+def apply_order_to_daily_sales(db: Session, order: Order, sign: int) -> None:
+    """Добавляет (sign=1) или вычитает (sign=-1) позиции заказа из агрегата. Коммит — на вызывающей стороне."""
+    rows = [
+        {
+            "sale_date": r.sale_date,
+            "dish_id": r.dish_id,
+            "quantity": sign * int(r.quantity or 0),
+            "revenue_kopecks": sign * int(r.revenue_kopecks or 0),
+        }
+        for r in _daily_sales_select(db, order_id=order.id).all()
+        if r.sale_date is not None
+    ]
+    if not rows:
+        return
+    _upsert_daily_sales(db, rows)
+    if sign < 0:
+        _delete_empty_daily_sales(db, {row["sale_date"] for row in rows})
+
+
+def on_order_status_change(db: Session, order: Order, old_status: OrderStatus, new_status: OrderStatus) -> None:
+    """Поддерживает агрегат и версию данных отчётов при переходе заказа в PAID или из PAID."""
+    if old_status != OrderStatus.PAID and new_status == OrderStatus.PAID:
+        apply_order_to_daily_sales(db, order, 1)
+        bump_data_version(db, PAID_ORDERS_VERSION)
+    elif old_status == OrderStatus.PAID and new_status != OrderStatus.PAID:
+        apply_order_to_daily_sales(db, order, -1)
+        bump_data_version(db, PAID_ORDERS_VERSION)
+
+
+def fill_daily_sales(db: Session) -> None:
+    """Заполняет daily_dish_sales заново по оплаченным заказам. Коммит — на вызывающей стороне."""
+    db.query(DailyDishSales).delete(synchronize_session=False)
+    select_stmt = _daily_sales_select(db).statement
+    db.execute(
+        insert(DailyDishSales).from_select(
+            ["sale_date", "dish_id", "quantity", "revenue_kopecks"], select_stmt
+        )
+    )
+
+
+def rebuild_daily_sales(db: Session) -> int:
+    """Полностью пересобирает daily_dish_sales по оплаченным заказам. Возвращает число строк."""
+    fill_daily_sales(db)
+    bump_data_version(db, PAID_ORDERS_VERSION)
+    db.commit()
+    return db.query(func.count()).select_from(DailyDishSales).scalar()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from sqlalchemy.orm import sessionmaker
+
+    import migrate
+    from database import DATABASE_URL, create_db_engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command != "rebuild":
+        print("Usage: python reports.py rebuild [database_url]")
+        sys.exit(1)
+
+    database_url = sys.argv[2] if len(sys.argv) > 2 else DATABASE_URL
+    engine = create_db_engine(database_url)
+    migrate.upgrade(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        count = rebuild_daily_sales(session)
+        logger.info("daily_dish_sales rebuilt: %s rows", count)
+    finally:
+        session.close()
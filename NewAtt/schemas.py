@@ -100,6 +100,7 @@ class VerifyCodeResponse(BaseModel):
     access_token: str
     token_type: str
     user: UserResponse
+    refresh_token: Optional[str] = None
 
 class RegisterResponse(BaseModel):
     message: str
@@ -139,12 +140,19 @@ class PasswordResetConfirmRequest(BaseModel):
     code: str
     password: str
     password_confirm: str
-    email: Optional[EmailStr] = None
+    email: EmailStr
 
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
     user: UserResponse
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 # --- Баланс и пополнения ---
 class TopupCreateRequest(BaseModel):
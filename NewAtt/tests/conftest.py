@@ -0,0 +1,80 @@
+"""
+Общие фикстуры тестов.
+
+Модули приложения читают окружение при импорте, поэтому база, каталоги логов,
+загрузок и кэша отчётов настраиваются здесь до первого импорта.
+Запуск из каталога NewAtt: python -m pytest
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+TMP_DIR = Path(tempfile.mkdtemp(prefix="newatt-tests-"))
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{TMP_DIR / 'app.db'}",
+    "LOG_DIR": str(TMP_DIR / "logs"),
+    "LOG_FILES": "0",
+    "UPLOAD_DIR": str(TMP_DIR / "uploads"),
+    "REPORT_CACHE_DIR": str(TMP_DIR / "reports"),
+    "MAIL_BACKEND": "console",
+    "MAIL_WORKER": "0",
+    "MIGRATE_ON_STARTUP": "0",
+    "SECRET_KEY": "tests-secret-key-" + "0" * 32,
+})
+
+import auth  # noqa: E402
+import database  # noqa: E402
+import migrate  # noqa: E402
+from models import Base, User  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def engine():
+    migrate.upgrade(database.engine)
+    return database.engine
+
+
+@pytest.fixture
+def db(engine):
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        # Каждый тест начинает с пустыми таблицами (схема и schema_version остаются)
+        with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                conn.execute(table.delete())
+
+
+@pytest.fixture
+def client(engine):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    # Без контекстного менеджера: lifespan (фоновые задачи, миграции) в тестах не нужен
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def make_user(db):
+    def make(email: str = "user@example.com", **fields) -> User:
+        user = User(name="Иван", secondary_name="Иванов", email=email, status="active", **fields)
+        db.add(user)
+        db.commit()
+        return user
+    return make
+
+
+@pytest.fixture
+def auth_headers():
+    def headers(user: User) -> dict:
+        return {"Authorization": f"Bearer {auth.create_access_token({'sub': str(user.id)})}"}
+    return headers
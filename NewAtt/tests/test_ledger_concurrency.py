@@ -0,0 +1,76 @@
+"""
+Нагрузочная проверка баланса: параллельные зачисления пополнений и списания
+заказов одного пользователя через HTTP-эндпоинты, каждый запрос — дважды.
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy import func
+
+import ledger
+from models import (
+    BalanceLedger, BalanceTopup, LedgerEntryKind, Order, OrderStatus, TopupStatus, User
+)
+
+TOPUPS = 40
+TOPUP_RUB = 10.0
+ORDERS = 80
+ORDER_RUB = 7.5  # на все заказы не хватит: часть списаний должна получить отказ
+WORKERS = 16
+
+
+def test_concurrent_credits_and_debits_keep_ledger_consistent(client, db, make_user, auth_headers):
+    admin = make_user("admin@example.com", is_admin=True)
+    user = make_user("pupil@example.com")
+    topups = [BalanceTopup(user_id=user.id, amount=TOPUP_RUB, status=TopupStatus.ON_REVIEW) for _ in range(TOPUPS)]
+    orders = [
+        Order(user_id=user.id, week_start_date=date(2026, 1, 5), status=OrderStatus.PENDING, total_amount=ORDER_RUB)
+        for _ in range(ORDERS)
+    ]
+    db.add_all(topups + orders)
+    db.commit()
+
+    admin_headers, user_headers = auth_headers(admin), auth_headers(user)
+    requests = [("topup", t.id) for t in topups] * 2 + [("charge", o.id) for o in orders] * 2
+    random.Random(25).shuffle(requests)
+
+    def send(request):
+        kind, object_id = request
+        if kind == "topup":
+            response = client.patch(f"/admin/balance/topups/{object_id}/status",
+                                    params={"status": "PAID"}, headers=admin_headers)
+        else:
+            response = client.post(f"/orders/{object_id}/charge", headers=user_headers)
+        return kind, response.status_code
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        results = list(pool.map(send, requests))
+
+    # Ошибок сервера нет; отказы — только «уже оплачен» / «недостаточно средств»
+    assert {code for kind, code in results if kind == "topup"} == {200}
+    assert {code for kind, code in results if kind == "charge"} <= {200, 400}
+    charged = sum(1 for kind, code in results if kind == "charge" and code == 200)
+    assert 0 < charged < ORDERS
+
+    db.expire_all()
+    balance = db.get(User, user.id).balance_kopecks
+    entries = db.query(BalanceLedger).filter(BalanceLedger.user_id == user.id).all()
+
+    assert ledger.check(db) == []
+    assert balance == sum(e.amount_kopecks for e in entries)
+    assert balance == TOPUPS * ledger.to_kopecks(TOPUP_RUB) - charged * ledger.to_kopecks(ORDER_RUB)
+    # Остаток после каждой операции журнала — баланс ни разу не уходил в минус
+    assert min(e.balance_after_kopecks for e in entries) >= 0
+
+    topup_entries = [e.topup_id for e in entries if e.kind == LedgerEntryKind.TOPUP]
+    assert sorted(topup_entries) == sorted(t.id for t in topups)
+
+    paid_orders = [
+        order_id for (order_id,) in db.query(Order.id).filter(Order.status == OrderStatus.PAID)
+    ]
+    charge_entries = [e.order_id for e in entries if e.kind == LedgerEntryKind.ORDER_CHARGE]
+    assert len(paid_orders) == charged
+    assert sorted(charge_entries) == sorted(paid_orders)
+    assert db.query(func.count()).select_from(Order).filter(Order.status == OrderStatus.PENDING).scalar() \
+        == ORDERS - charged
@@ -0,0 +1,26 @@
+import logging
+import queue
+import sys
+
+import pytest
+
+import logger as app_logger
+
+
+def test_queue_handler_does_not_format_in_calling_thread(monkeypatch):
+    log_queue = queue.SimpleQueue()
+    handler = app_logger.RecordQueueHandler(log_queue)
+    monkeypatch.setattr(handler, "format", lambda record: pytest.fail("formatted in the calling thread"))
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("app", logging.ERROR, __file__, 1, "Order %s failed", (42,), sys.exc_info())
+    handler.emit(record)
+
+    queued = log_queue.get_nowait()
+    assert (queued.msg, queued.args) == ("Order 42 failed", None)
+    assert queued.exc_info is not None and queued.exc_text is None
+    # Трассировку форматирует обработчик listener
+    text = app_logger.LevelFormatter().format(queued)
+    assert "Order 42 failed" in text and "ValueError: boom" in text
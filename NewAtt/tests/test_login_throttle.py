@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import passwords
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(passwords, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_failures_over_limit_are_throttled(clock):
+    throttle = passwords.LoginThrottle(max_attempts=3, window=60)
+    for _ in range(3):
+        throttle.check("Pupil@example.com")
+        throttle.record_failure("pupil@example.com")
+
+    with pytest.raises(HTTPException) as error:
+        throttle.check("PUPIL@example.com")
+    assert error.value.status_code == 429
+
+    clock[0] += 61
+    throttle.check("pupil@example.com")
+
+
+def test_spraying_emails_does_not_grow_without_bound(clock):
+    throttle = passwords.LoginThrottle(max_attempts=3, window=60, max_keys=100)
+    for i in range(1000):
+        throttle.record_failure(f"random{i}@example.com")
+    assert len(throttle) == 100
+
+    # Истёкшие окна выбрасываются при следующей неудаче, даже по другому email
+    clock[0] += 61
+    throttle.record_failure("pupil@example.com")
+    assert len(throttle) == 1
+
+
+def test_recent_attacker_key_survives_older_keys(clock):
+    throttle = passwords.LoginThrottle(max_attempts=3, window=60, max_keys=10)
+    for _ in range(3):
+        throttle.record_failure("target@example.com")
+    for i in range(5):
+        throttle.record_failure(f"random{i}@example.com")
+    with pytest.raises(HTTPException):
+        throttle.check("target@example.com")
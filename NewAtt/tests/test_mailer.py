@@ -0,0 +1,208 @@
+"""Очередь писем против локального SMTP-сервера aiosmtpd."""
+import asyncio
+import socket
+import time
+from datetime import datetime, timedelta
+from email import message_from_bytes
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import database
+import mailer
+from models import EmailOutbox, EmailStatus
+
+
+class RecordingHandler:
+    """Запоминает письма и адрес клиента; первые fail_next писем отклоняет с кодом fail_code."""
+
+    def __init__(self):
+        self.messages = []
+        self.fail_next = 0
+        self.fail_code = "451 Try again later"
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.fail_next:
+            self.fail_next -= 1
+            return self.fail_code
+        self.messages.append((session.peer, message_from_bytes(envelope.content)))
+        return "250 OK"
+
+    @property
+    def connections(self) -> int:
+        return len({peer for peer, _ in self.messages})
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    monkeypatch.setattr(mailer, "SMTP_HOST", controller.hostname)
+    monkeypatch.setattr(mailer, "SMTP_PORT", controller.port)
+    monkeypatch.setattr(mailer, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(mailer, "SMTP_USER", None)
+    monkeypatch.setattr(mailer, "MAIL_BACKEND", "smtp")
+    try:
+        yield handler
+    finally:
+        controller.stop()
+
+
+@pytest.fixture
+def sender():
+    sender = mailer.SMTPSender()
+    try:
+        yield sender
+    finally:
+        sender.close()
+
+
+def _enqueue(db, count: int):
+    for i in range(count):
+        mailer.enqueue(db, f"user{i}@example.com", f"Письмо {i}", f"<p>{i}</p>")
+    db.commit()
+
+
+def _outbox(db):
+    db.expire_all()
+    return db.query(EmailOutbox).order_by(EmailOutbox.id).all()
+
+
+def _make_due(db):
+    db.query(EmailOutbox).update({EmailOutbox.next_attempt_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+
+def test_outbox_is_delivered_in_batches_over_one_connection(db, smtp, sender, monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_BATCH_SIZE", 3)
+    _enqueue(db, 5)
+
+    assert mailer.process_batch(database.SessionLocal, sender) == 3
+    assert mailer.process_batch(database.SessionLocal, sender) == 2
+    assert mailer.process_batch(database.SessionLocal, sender) == 0
+
+    assert sorted(m["To"] for _, m in smtp.messages) == [f"user{i}@example.com" for i in range(5)]
+    assert smtp.connections == 1
+    assert [(row.status, row.attempts) for row in _outbox(db)] == [(EmailStatus.SENT, 1)] * 5
+
+
+def test_transient_failure_is_retried_with_backoff(db, smtp, sender, monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_RETRY_BASE_SECONDS", 30)
+    smtp.fail_next = 2
+    _enqueue(db, 1)
+
+    before = datetime.utcnow()
+    mailer.process_batch(database.SessionLocal, sender)
+    (row,) = _outbox(db)
+    assert (row.status, row.attempts) == (EmailStatus.PENDING, 1)
+    assert "451" in row.last_error
+    assert timedelta(seconds=27) <= row.next_attempt_at - before <= timedelta(seconds=34)
+
+    # До наступления срока письмо не берётся повторно
+    assert mailer.process_batch(database.SessionLocal, sender) == 0
+
+    _make_due(db)
+    before = datetime.utcnow()
+    mailer.process_batch(database.SessionLocal, sender)
+    (row,) = _outbox(db)
+    assert (row.status, row.attempts) == (EmailStatus.PENDING, 2)
+    assert timedelta(seconds=54) <= row.next_attempt_at - before <= timedelta(seconds=67)
+
+    _make_due(db)
+    mailer.process_batch(database.SessionLocal, sender)
+    (row,) = _outbox(db)
+    assert (row.status, row.attempts, row.last_error) == (EmailStatus.SENT, 3, None)
+    assert len(smtp.messages) == 1
+
+
+def test_retry_delay_is_capped(monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_RETRY_BASE_SECONDS", 30)
+    monkeypatch.setattr(mailer, "MAIL_RETRY_MAX_SECONDS", 3600)
+    assert 27 <= mailer.retry_delay(1) <= 33
+    assert 108 <= mailer.retry_delay(3) <= 132
+    assert mailer.retry_delay(20) <= 3600 * 1.1
+
+
+def test_message_fails_after_max_attempts(db, smtp, sender, monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_MAX_ATTEMPTS", 2)
+    smtp.fail_next = 10
+    _enqueue(db, 1)
+
+    mailer.process_batch(database.SessionLocal, sender)
+    _make_due(db)
+    mailer.process_batch(database.SessionLocal, sender)
+
+    (row,) = _outbox(db)
+    assert (row.status, row.attempts) == (EmailStatus.FAILED, 2)
+    _make_due(db)
+    assert mailer.process_batch(database.SessionLocal, sender) == 0
+
+
+def test_permanent_rejection_is_not_retried(db, smtp, sender):
+    smtp.fail_next, smtp.fail_code = 1, "550 Mailbox unavailable"
+    _enqueue(db, 1)
+
+    mailer.process_batch(database.SessionLocal, sender)
+
+    (row,) = _outbox(db)
+    assert (row.status, row.attempts) == (EmailStatus.FAILED, 1)
+
+
+def test_unreachable_server_defers_rest_of_batch(db, sender, monkeypatch):
+    monkeypatch.setattr(mailer, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(mailer, "SMTP_PORT", _free_port())
+    monkeypatch.setattr(mailer, "SMTP_STARTTLS", False)
+    _enqueue(db, 3)
+
+    assert mailer.process_batch(database.SessionLocal, sender) == 3
+
+    rows = _outbox(db)
+    assert all(row.status == EmailStatus.PENDING for row in rows)
+    # Попытка тратится только на письмо, на котором упало соединение
+    assert [row.attempts for row in rows] == [1, 0, 0]
+    assert all(row.next_attempt_at > datetime.utcnow() for row in rows)
+
+
+def test_commit_wakes_worker(smtp, engine, monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_POLL_INTERVAL", 30)
+
+    def enqueue_and_commit():
+        db = database.SessionLocal()
+        try:
+            mailer.enqueue(db, "wake@example.com", "Тема", "<p>wake</p>")
+            db.commit()
+        finally:
+            db.close()
+
+    async def scenario() -> float:
+        worker = asyncio.create_task(mailer.mail_worker_loop(database.SessionLocal))
+        try:
+            # Дождаться, пока воркер обработает первую (пустую) пачку и уснёт на интервал опроса
+            while mailer._wakeup is None:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+
+            started = time.monotonic()
+            await asyncio.to_thread(enqueue_and_commit)
+            while not smtp.messages and time.monotonic() - started < 5:
+                await asyncio.sleep(0.02)
+            return time.monotonic() - started
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+
+    try:
+        elapsed = asyncio.run(scenario())
+    finally:
+        with engine.begin() as conn:
+            conn.execute(EmailOutbox.__table__.delete())
+
+    assert [m["To"] for _, m in smtp.messages] == ["wake@example.com"]
+    assert elapsed < 5
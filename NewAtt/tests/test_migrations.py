@@ -0,0 +1,89 @@
+import os
+
+from sqlalchemy import inspect, text
+
+import migrate
+from database import create_db_engine
+from models import Base
+
+
+def _new_engine(tmp_path, name="migrated.db"):
+    return create_db_engine(f"sqlite:///{tmp_path / name}")
+
+
+def test_fresh_database_matches_models(tmp_path):
+    engine = _new_engine(tmp_path)
+    assert migrate.upgrade(engine) == migrate.load_migrations()[-1].version
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        assert columns == {c.name for c in table.columns}, table.name
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        assert {i.name for i in table.indexes} <= indexes, table.name
+
+
+def test_upgrade_is_idempotent(tmp_path):
+    engine = _new_engine(tmp_path)
+    version = migrate.upgrade(engine)
+    assert migrate.upgrade(engine) == version
+
+
+def test_legacy_balance_is_carried_over(tmp_path):
+    engine = _new_engine(tmp_path, "legacy.db")
+    baseline = migrate.load_migrations()[0].module
+    with engine.begin() as conn:
+        # База до миграций: таблицы созданы create_all, balance досоздан ensure_balance_column
+        baseline.metadata.create_all(bind=conn)
+        conn.execute(text("ALTER TABLE users ADD COLUMN balance REAL DEFAULT 0.0"))
+        conn.execute(text("INSERT INTO users (id, name, email, balance) VALUES (1, 'Иван', 'a@b.c', 12.3)"))
+
+    migrate.upgrade(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT balance_kopecks FROM users WHERE id = 1")).scalar() == 1230
+        assert conn.execute(text("SELECT sum(amount_kopecks) FROM balance_ledger")).scalar() == 1230
+        assert not migrate.has_column(conn, "users", "balance")
+
+
+def _apply_until(engine, version):
+    with engine.begin() as conn:
+        for migration in migrate.load_migrations():
+            if migration.version <= version:
+                migration.module.upgrade(conn)
+
+
+def test_migrations_do_not_use_app_models():
+    # Результат старой миграции не должен меняться вместе с моделями и кодом приложения
+    for migration in migrate.load_migrations():
+        imported = {getattr(value, "__name__", "") for value in vars(migration.module).values()}
+        modules = {getattr(value, "__module__", "") for value in vars(migration.module).values()}
+        assert not (imported | modules) & {"models", "reports", "upload_store", "ledger"}, migration.name
+
+
+def test_legacy_uploads_are_moved_to_blob_store(tmp_path, monkeypatch):
+    engine = _new_engine(tmp_path)
+    _apply_until(engine, 5)
+    migration = migrate.load_migrations()[5].module
+    monkeypatch.setattr(migration, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    receipt = tmp_path / "receipt_1.dat"
+    receipt.write_bytes(b"\x89PNG\r\n\x1a\n" + b"0" * 100)
+    copy = tmp_path / "receipt_2.dat"
+    copy.write_bytes(receipt.read_bytes())
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, name, email) VALUES (1, 'Иван', 'a@b.c')"))
+        conn.execute(text("INSERT INTO orders (id, user_id, payment_proof_path) VALUES (1, 1, :p), (2, 1, :p)"),
+                     {"p": str(receipt)})
+        conn.execute(text("INSERT INTO balance_topups (id, user_id, payment_proof_path) VALUES (1, 1, :p)"),
+                     {"p": str(copy)})
+        conn.execute(text("INSERT INTO balance_topups (id, user_id, payment_proof_path) VALUES (2, 1, 'gone.png')"))
+
+        migration.upgrade(conn)
+
+        (blob,) = conn.execute(text("SELECT path, media_type, refcount FROM blobs")).all()
+        assert (blob.media_type, blob.refcount) == ("image/png", 3)
+        assert blob.path.endswith(".png")  # тип по сигнатуре, а не по имени
+        assert blob.path.startswith(str(tmp_path / "uploads")) and os.path.isfile(blob.path)
+        paths = conn.execute(text(
+            "SELECT payment_proof_path FROM orders UNION ALL SELECT payment_proof_path FROM balance_topups"
+        )).scalars().all()
+        assert sorted(paths) == sorted([blob.path] * 3 + ["gone.png"])
@@ -0,0 +1,53 @@
+import one_time_codes
+from models import CodePurpose
+
+
+def _confirm(client, email, code):
+    return client.post("/password/reset/confirm", json={
+        "email": email, "code": code, "password": "new-secret", "password_confirm": "new-secret",
+    })
+
+
+def test_reset_confirm_matches_email_case_insensitively(client, db, make_user):
+    user = make_user("ivan.petrov@example.com")
+    code = one_time_codes.issue(db, user.id, CodePurpose.PASSWORD_RESET)
+    db.commit()
+
+    response = _confirm(client, "Ivan.Petrov@Example.COM", code)
+
+    assert response.status_code == 200, response.text
+    db.refresh(user)
+    assert user.password_hash
+
+
+def test_reset_confirm_rejects_code_of_another_user(client, db, make_user):
+    owner = make_user("owner@example.com")
+    make_user("other@example.com")
+    code = one_time_codes.issue(db, owner.id, CodePurpose.PASSWORD_RESET)
+    db.commit()
+
+    assert _confirm(client, "Other@example.com", code).status_code == 400
+
+
+def test_reset_confirm_requires_email(client, db, make_user):
+    user = make_user("owner@example.com")
+    code = one_time_codes.issue(db, user.id, CodePurpose.PASSWORD_RESET)
+    db.commit()
+
+    response = client.post("/password/reset/confirm", json={
+        "code": code, "password": "new-secret", "password_confirm": "new-secret",
+    })
+    assert response.status_code == 422
+
+
+def test_wrong_guesses_discard_the_code(client, db, make_user, monkeypatch):
+    monkeypatch.setattr(one_time_codes, "CODE_MAX_ATTEMPTS", 3)
+    user = make_user("owner@example.com")
+    code = one_time_codes.issue(db, user.id, CodePurpose.PASSWORD_RESET)
+    db.commit()
+    wrong = f"{(int(code) + 1) % 10 ** one_time_codes.CODE_LENGTH:0{one_time_codes.CODE_LENGTH}d}"
+
+    for _ in range(3):
+        assert _confirm(client, "owner@example.com", wrong).status_code == 400
+    # После CODE_MAX_ATTEMPTS ошибок и верный код уже не подходит
+    assert _confirm(client, "owner@example.com", code).status_code == 400
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy.orm import Session
+
+import query_plans
+
+
+@pytest.mark.parametrize("name", sorted(query_plans.EXPECTED_INDEXES))
+def test_hot_query_uses_index(engine, name):
+    with Session(engine) as db:
+        statement = query_plans.hot_queries(db)[name]
+    plan = query_plans.query_plan(engine, statement)
+
+    assert query_plans.full_scans(plan) == []
+    assert query_plans.uses_index(plan, query_plans.EXPECTED_INDEXES[name]), plan
+
+
+def test_every_hot_query_has_expected_index(engine):
+    with Session(engine) as db:
+        assert set(query_plans.hot_queries(db)) == set(query_plans.EXPECTED_INDEXES)
@@ -0,0 +1,38 @@
+import io
+from datetime import date
+
+import pytest
+from PIL import Image
+
+import thumbnails
+import upload_store
+from models import Order, OrderStatus
+
+
+@pytest.fixture
+def order_with_receipt(db, make_user):
+    buffer = io.BytesIO()
+    Image.new("RGB", (600, 400), "blue").save(buffer, "PNG")
+    stored = upload_store._store(buffer, upload_store.UPLOAD_MAX_BYTES)
+
+    user = make_user("pupil@example.com")
+    order = Order(user_id=user.id, week_start_date=date(2026, 1, 5), status=OrderStatus.PENDING, total_amount=100.0)
+    order.payment_proof_path = upload_store.replace_reference(db, None, stored)
+    db.add(order)
+    db.commit()
+    yield user, order
+    thumbnails.shutdown()
+
+
+@pytest.mark.parametrize("path", ["/orders/{id}/receipt", "/orders/{id}/receipt/preview"])
+@pytest.mark.parametrize("since, expected", [
+    ("Sun, 18 Oct 2099 12:00:00 -0000", 304),
+    ("Sun, 18 Oct 2099 12:00:00", 304),
+    ("Sat, 01 Jan 2000 00:00:00 -0000", 200),
+    ("Sun, 18 Oct 2099 12:00:00 GMT", 304),
+])
+def test_if_modified_since_naive_date_is_utc(client, order_with_receipt, auth_headers, path, since, expected):
+    user, order = order_with_receipt
+    response = client.get(path.format(id=order.id), headers={**auth_headers(user), "If-Modified-Since": since})
+    assert response.status_code == expected
+    assert "Last-Modified" in response.headers
@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import auth
+
+
+def _refresh(client, token):
+    return client.post("/auth/refresh", json={"refresh_token": token})
+
+
+def test_refresh_token_is_rotated(client, make_user):
+    user = make_user("pupil@example.com")
+    token = auth.create_refresh_token(user.id)
+
+    first = _refresh(client, token)
+    assert first.status_code == 200
+    assert _refresh(client, token).status_code == 401
+    assert _refresh(client, first.json()["refresh_token"]).status_code == 200
+
+
+def test_concurrent_reuse_issues_one_pair(client, make_user, monkeypatch):
+    user = make_user("pupil@example.com")
+    token = auth.create_refresh_token(user.id)
+    # Проверка в памяти пропускает все запросы — как при гонке или в разных процессах
+    monkeypatch.setattr(auth.revocation_list, "is_revoked", lambda jti: False)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        codes = list(pool.map(lambda _: _refresh(client, token).status_code, range(8)))
+
+    assert sorted(codes) == [200] + [401] * 7
@@ -0,0 +1,78 @@
+import os
+import time
+from io import BytesIO
+
+from docx import Document
+
+import report_cache
+
+
+def _header(content: bytes) -> str:
+    return Document(BytesIO(content)).paragraphs[0].text
+
+
+def test_weekday_reports_are_cached_per_date(client, make_user, auth_headers):
+    headers = auth_headers(make_user("admin@example.com", is_admin=True))
+
+    # Оба дня — понедельники: один day_of_week, но разные документы
+    first = client.get("/admin/reports/docx", params={"date_query": "2026-01-05"}, headers=headers)
+    second = client.get("/admin/reports/docx", params={"date_query": "2026-01-12"}, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers["etag"] != second.headers["etag"]
+    assert first.content != second.content
+    assert _header(first.content) == "За день: 2026-01-05"
+    assert _header(second.content) == "За день: 2026-01-12"
+
+    again = client.get("/admin/reports/docx", params={"date_query": "2026-01-05"},
+                       headers={**headers, "If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+
+
+def test_evict_keeps_recently_used_reports(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "REPORT_CACHE_DIR", str(tmp_path))
+    stored = {}
+    for key, body in (("old", b"old report"), ("used", b"used report"), ("new", b"new report")):
+        path = report_cache.new_temp_path()
+        with open(path, "wb") as f:
+            f.write(body)
+        stored[key] = report_cache.store(key, path)
+
+    hour_ago = time.time() - 3600
+    for report in stored.values():
+        os.utime(report.path, (hour_ago, hour_ago))
+    # lookup отмечает отчёт как использованный: его путь сейчас отдаётся клиенту
+    assert report_cache.lookup("used").path == stored["used"].path
+    os.utime(stored["new"].path)
+
+    report_cache.evict(max_bytes=0, min_age=60)
+
+    assert not os.path.exists(stored["old"].path)
+    assert os.path.exists(stored["used"].path)
+    assert os.path.exists(stored["new"].path)
+    assert report_cache.lookup("old") is None
+
+
+def test_evict_removes_dangling_refs_and_stale_temp_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "REPORT_CACHE_DIR", str(tmp_path))
+    for key, body in (("v1", b"report v1"), ("v2", b"report v2")):
+        path = report_cache.new_temp_path()
+        with open(path, "wb") as f:
+            f.write(body)
+        report_cache.store(key, path)
+    abandoned = report_cache.new_temp_path()  # генерация упала, файл остался
+    rendering = report_cache.new_temp_path()  # генерация идёт прямо сейчас
+
+    hour_ago = time.time() - 3600
+    v1 = report_cache.lookup("v1")
+    os.remove(v1.path)  # отчёт прошлой версии данных уже вытеснен
+    for path in (report_cache._ref_path("v1"), report_cache._ref_path("v2"), abandoned):
+        os.utime(path, (hour_ago, hour_ago))
+
+    report_cache.evict(min_age=60)
+
+    assert sorted(os.listdir(tmp_path)) == sorted([
+        os.path.basename(report_cache._ref_path("v2")),
+        os.path.basename(report_cache.lookup("v2").path),
+        os.path.basename(rendering),
+    ])
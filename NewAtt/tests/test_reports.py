@@ -0,0 +1,111 @@
+import importlib
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy import func
+
+import ledger
+import reports
+from models import DailyDishSales, Dish, DishType, LedgerEntryKind, Order, OrderItem, OrderStatus
+
+WEEK = date(2026, 1, 5)
+
+
+def _order(db, user, dish, quantity, status=OrderStatus.PENDING, day_of_week=1):
+    order = Order(user_id=user.id, week_start_date=WEEK, status=status)
+    db.add(order)
+    db.flush()
+    db.add(OrderItem(order_id=order.id, dish_id=dish.id, day_of_week=day_of_week, quantity=quantity))
+    db.commit()
+    return order
+
+
+def _set_status(db, order, status):
+    reports.on_order_status_change(db, order, order.status, status)
+    order.status = status
+    db.commit()
+
+
+def _dish(db, name, price):
+    dish = Dish(name=name, type=DishType.SOUP, composition="", quantity_grams=250, price_rub=price)
+    db.add(dish)
+    db.commit()
+    return dish
+
+
+def test_unpaid_order_leaves_no_zero_rows(db, make_user):
+    user = make_user()
+    order = _order(db, user, _dish(db, "Суп", 120.0), 2)
+
+    _set_status(db, order, OrderStatus.PAID)
+    assert reports.summary_all_time(db)["items"] == [{"dish": "Суп", "count": 2, "revenue": 240.0}]
+
+    _set_status(db, order, OrderStatus.PENDING)
+    assert reports.summary_all_time(db) == {"total_revenue": 0.0, "items": []}
+    assert reports.summary_for_range(db, WEEK, WEEK)["items"] == []
+    assert db.query(func.count()).select_from(DailyDishSales).scalar() == 0
+
+
+def test_revenue_is_summed_in_kopecks(db, make_user):
+    user = make_user()
+    tea = _dish(db, "Чай", 0.1)
+    bun = _dish(db, "Булочка", 0.2)
+    for order in (_order(db, user, tea, 3), _order(db, user, bun, 1, day_of_week=2)):
+        _set_status(db, order, OrderStatus.PAID)
+
+    assert db.query(DailyDishSales.revenue_kopecks).order_by(DailyDishSales.sale_date).all() == [(30,), (20,)]
+    assert reports.summary_all_time(db)["total_revenue"] == 0.5
+    assert reports.summary_for_range(db, WEEK, date(2026, 1, 6))["total_revenue"] == 0.5
+    assert reports.summary_for_weekday(db, 1)["total_revenue"] == 0.3
+
+
+def test_migration_backfills_rollup(db, engine, make_user):
+    user = make_user()
+    _order(db, user, _dish(db, "Суп", 99.99), 3, status=OrderStatus.PAID)
+    _order(db, user, _dish(db, "Каша", 50.0), 1)
+    assert db.query(DailyDishSales).count() == 0
+
+    migration = importlib.import_module("migrations.0008_daily_sales_kopecks")
+    with engine.begin() as conn:
+        migration.upgrade(conn)
+
+    db.expire_all()
+    assert [(r.quantity, r.revenue_kopecks) for r in db.query(DailyDishSales)] == [(3, 29997)]
+    assert reports.summary_all_time(db)["items"] == [{"dish": "Суп", "count": 3, "revenue": 299.97}]
+
+    # Замороженный SQL миграции даёт то же, что текущая пересборка агрегата
+    migrated = sorted(db.query(DailyDishSales.sale_date, DailyDishSales.dish_id, DailyDishSales.quantity,
+                               DailyDishSales.revenue_kopecks).all())
+    reports.rebuild_daily_sales(db)
+    assert sorted(db.query(DailyDishSales.sale_date, DailyDishSales.dish_id, DailyDishSales.quantity,
+                           DailyDishSales.revenue_kopecks).all()) == migrated
+
+
+def test_concurrent_status_changes_count_order_once(client, db, make_user, auth_headers):
+    admin = make_user("admin@example.com", is_admin=True)
+    user = make_user()
+    orders = [_order(db, user, _dish(db, f"Суп {i}", 100.0), 2) for i in range(10)]
+    for order in orders:
+        order.total_amount = 200.0
+    db.commit()
+    ledger.credit(db, user.id, ledger.to_kopecks(10000), LedgerEntryKind.OPENING)
+    db.commit()
+
+    admin_headers, user_headers = auth_headers(admin), auth_headers(user)
+    requests = [(o.id, "admin") for o in orders] * 4 + [(o.id, "charge") for o in orders] * 2
+    random.Random(2).shuffle(requests)
+
+    def send(request):
+        order_id, kind = request
+        if kind == "admin":
+            return client.patch(f"/admin/orders/{order_id}/status", params={"status": "PAID"}, headers=admin_headers)
+        return client.post(f"/orders/{order_id}/charge", headers=user_headers)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        codes = {response.status_code for response in pool.map(send, requests)}
+
+    assert codes <= {200, 400, 409}
+    db.expire_all()
+    assert db.query(func.count()).select_from(Order).filter(Order.status == OrderStatus.PAID).scalar() == 10
+    assert db.query(func.sum(DailyDishSales.quantity)).scalar() == 20
@@ -0,0 +1,67 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pymupdf
+from PIL import Image
+
+import thumbnails
+import upload_store
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (1200, 800), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _pdf() -> bytes:
+    with pymupdf.open() as document:
+        document.new_page(width=595, height=842).insert_text((72, 72), "Чек")
+        return document.tobytes()
+
+
+def _preview(tmp_path, name, content, media_type, sha256):
+    source = tmp_path / name
+    source.write_bytes(content)
+    return asyncio.run(thumbnails.ensure_preview(sha256, str(source), media_type))
+
+
+def test_previews_for_image_and_pdf(tmp_path):
+    for name, content, media_type, sha256 in (
+        ("proof.png", _png(), "image/png", "a" * 64),
+        ("proof.pdf", _pdf(), "application/pdf", "b" * 64),
+    ):
+        preview = _preview(tmp_path, name, content, media_type, sha256)
+        assert preview == upload_store.preview_path(sha256)
+        with Image.open(preview) as image:
+            assert image.format == "WEBP"
+            assert max(image.size) == thumbnails.PREVIEW_SIZE
+    thumbnails.shutdown()
+
+
+def test_failed_preview_is_retried_after_timeout(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(thumbnails, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(thumbnails, "PREVIEW_RETRY_SECONDS", 60)
+    sha256 = "c" * 64
+
+    assert _preview(tmp_path, "broken.png", b"not an image", "image/png", sha256) is None
+    assert thumbnails._recently_failed(sha256)
+
+    # Файл тот же, но пока не истёк срок — рендер не запускается повторно
+    clock[0] += 30
+    assert _preview(tmp_path, "fixed.png", _png(), "image/png", sha256) is None
+
+    clock[0] += 31
+    assert _preview(tmp_path, "fixed.png", _png(), "image/png", sha256) == upload_store.preview_path(sha256)
+    assert sha256 not in thumbnails._failed
+    thumbnails.shutdown()
+
+
+def test_failure_cache_is_capped(monkeypatch):
+    monkeypatch.setattr(thumbnails, "_failed", {})
+    monkeypatch.setattr(thumbnails, "PREVIEW_FAILED_MAX", 3)
+    for i in range(5):
+        thumbnails._remember_failure(str(i))
+    assert list(thumbnails._failed) == ["2", "3", "4"]
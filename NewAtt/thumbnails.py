@@ -0,0 +1,145 @@
+"""
+Превью чеков для проверки оплат администратором.
+
+Сразу после загрузки schedule() ставит построение маленькой WebP-картинки
+(не больше PREVIEW_SIZE пикселей по большей стороне) в пул процессов: для
+изображений — уменьшенная копия, для PDF — первая страница. Превью хранится
+по SHA-256 исходного файла (upload_store.preview_path), поэтому одинаковые
+чеки обрабатываются один раз. Если превью ещё нет, ensure_preview() строит
+его по запросу, одновременные запросы ждут одну и ту же задачу.
+
+Изображения обрабатывает Pillow, PDF — PyMuPDF. Если превью построить не
+удалось (битый файл), повторная попытка для того же файла делается не раньше
+чем через PREVIEW_RETRY_SECONDS; помнится не больше PREVIEW_FAILED_MAX таких файлов.
+
+Настройки (.env): PREVIEW_SIZE, PREVIEW_QUALITY, PREVIEW_WORKERS,
+PREVIEW_RETRY_SECONDS, PREVIEW_FAILED_MAX.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Set
+
+import pymupdf
+from PIL import Image, ImageOps
+
+import upload_store
+from logger import logger
+
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", 480))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", 75))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", 2))
+PREVIEW_RETRY_SECONDS = float(os.getenv("PREVIEW_RETRY_SECONDS", 600))
+PREVIEW_FAILED_MAX = int(os.getenv("PREVIEW_FAILED_MAX", 1000))
+PREVIEW_MEDIA_TYPE = "image/webp"
+
+
+def supports(media_type: str) -> bool:
+    return media_type == "application/pdf" or media_type.startswith("image/")
+
+
+def render(source: str, media_type: str, target: str, size: int, quality: int) -> None:
+    """Строит превью (выполняется в процессе пула)."""
+    if media_type == "application/pdf":
+        with pymupdf.open(source) as document:
+            page = document[0]
+            zoom = size / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        image = Image.open(source)
+        # JPEG декодируется сразу в уменьшенном масштабе — в разы быстрее на фото с телефона
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("LA", "PA", "P") else "RGB")
+    image.thumbnail((size, size))
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(target))
+    try:
+        with os.fdopen(fd, "wb") as output:
+            image.save(output, "WEBP", quality=quality)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending: Dict[str, asyncio.Future] = {}
+# sha256 -> время неудачи (time.monotonic); старые записи впереди
+_failed: Dict[str, float] = {}
+_tasks: Set[asyncio.Task] = set()
+
+
+def _recently_failed(sha256: str) -> bool:
+    failed_at = _failed.get(sha256)
+    if failed_at is None:
+        return False
+    if time.monotonic() - failed_at < PREVIEW_RETRY_SECONDS:
+        return True
+    del _failed[sha256]
+    return False
+
+
+def _remember_failure(sha256: str) -> None:
+    _failed.pop(sha256, None)
+    _failed[sha256] = time.monotonic()
+    while len(_failed) > PREVIEW_FAILED_MAX:
+        del _failed[next(iter(_failed))]
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PREVIEW_WORKERS)
+    return _executor
+
+
+async def ensure_preview(sha256: str, source: str, media_type: str) -> Optional[str]:
+    """Путь к превью файла (строит при необходимости) или None, если превью сделать нельзя."""
+    if not supports(media_type) or _recently_failed(sha256):
+        return None
+    target = upload_store.preview_path(sha256)
+    if os.path.exists(target):
+        return target
+
+    future = _pending.get(sha256)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            _get_executor(), render, source, media_type, target, PREVIEW_SIZE, PREVIEW_QUALITY)
+        _pending[sha256] = future
+        future.add_done_callback(lambda _: _pending.pop(sha256, None))
+    try:
+        # shield: отмена одного запроса не отменяет построение для остальных
+        await asyncio.shield(future)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _remember_failure(sha256)
+        logger.warning("Preview for %s failed: %s", source, e)
+        return None
+    return target
+
+
+def schedule(stored: upload_store.StoredUpload) -> None:
+    """Построение превью в фоне сразу после загрузки; результата не ждём."""
+    if not supports(stored.media_type):
+        return
+    task = asyncio.get_running_loop().create_task(
+        ensure_preview(stored.sha256, stored.path, stored.media_type))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def shutdown() -> None:
+    global _executor
+    for task in _tasks:
+        task.cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
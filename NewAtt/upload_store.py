@@ -0,0 +1,378 @@
+"""
+Приём загружаемых файлов (чеки оплаты заказов и пополнений).
+
+Файл копируется из UploadFile во временный файл блоками по UPLOAD_CHUNK_SIZE
+в потоке threadpool (event loop не блокируется), по ходу копирования
+считаются SHA-256 и размер; при превышении UPLOAD_MAX_BYTES копирование
+прерывается (413). Тип определяется по сигнатуре (первым байтам), а не по
+присланному клиентом content_type и расширению. Готовый файл атомарно
+переносится (os.replace) в хранилище по хэшу содержимого:
+    uploads/ab/cd/abcd...<sha256>.<ext>
+
+Одинаковые файлы хранятся один раз. Таблица blobs ведёт счётчик ссылок
+(refcount) из Order.payment_proof_path и BalanceTopup.payment_proof_path:
+replace_reference() увеличивает его для нового файла и уменьшает для
+заменённого. Файлы без ссылок удаляет сборщик мусора:
+    python upload_store.py gc [--dry-run] [database_url]
+Он также пересчитывает refcount по таблицам и удаляет файлы в UPLOAD_DIR,
+о которых не знает БД (старые загрузки, недокачанные временные файлы).
+Превью удаляются вместе со своим файлом. Всё, что моложе
+UPLOAD_GC_GRACE_SECONDS, не трогается.
+
+serve() отдаёт файл чека: тип из blobs, ETag — хэш содержимого, поэтому
+повторный просмотр (If-None-Match / If-Modified-Since) получает 304 без
+обращения к диску; Range и отдача файла — средствами FileResponse.
+
+Настройки (.env): UPLOAD_DIR, UPLOAD_MAX_BYTES, UPLOAD_GC_GRACE_SECONDS.
+"""
+import calendar
+import hashlib
+import mimetypes
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import BinaryIO, Dict, Optional, Union
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import delete, exists, func, insert, or_, select, union_all, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+from logger import logger
+from models import BalanceTopup, Blob, Order
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 10 << 20))  # 10MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_GC_GRACE_SECONDS = float(os.getenv("UPLOAD_GC_GRACE_SECONDS", 3600))
+
+# Сигнатуры разрешённых форматов: (префикс, смещение) -> (media type, расширение)
+_SIGNATURES = (
+    (b"%PDF-", 0, "application/pdf", ".pdf"),
+    (b"\xff\xd8\xff", 0, "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png", ".png"),
+    (b"BM", 0, "image/bmp", ".bmp"),
+    (b"WEBP", 8, "image/webp", ".webp"),  # RIFF....WEBP
+)
+
+EXTENSION_MEDIA_TYPES = {extension: media_type for _, _, media_type, extension in _SIGNATURES}
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    path: str
+    sha256: str
+    size: int
+    media_type: str
+
+
+def sniff(head: bytes) -> Optional[tuple]:
+    """(media type, расширение) по первым байтам файла или None."""
+    for signature, offset, media_type, extension in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            if media_type == "image/webp" and not head.startswith(b"RIFF"):
+                continue
+            return media_type, extension
+    return None
+
+
+def blob_path(sha256: str, extension: str) -> str:
+    # Два уровня каталогов по префиксу хэша, чтобы не копить файлы в одном каталоге
+    return os.path.join(UPLOAD_DIR, sha256[:2], sha256[2:4], sha256 + extension)
+
+
+PREVIEW_DIR = os.path.join(UPLOAD_DIR, "previews")
+
+
+def preview_path(sha256: str) -> str:
+    """Превью (thumbnails.py) хранится по тому же хэшу, что и исходный файл."""
+    return os.path.join(PREVIEW_DIR, sha256[:2], sha256[2:4], sha256 + ".webp")
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _store(source: BinaryIO, max_bytes: int) -> StoredUpload:
+    tmp_dir = os.path.join(UPLOAD_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=tmp_dir)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        detected = None
+        source.seek(0)
+        with os.fdopen(fd, "wb") as target:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0:
+                    detected = sniff(chunk)
+                    if detected is None:
+                        raise UploadRejected(
+                            400,
+                            "Недопустимый тип файла. Разрешены только PDF и изображения (JPEG, PNG, BMP, WEBP).",
+                        )
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(
+                        413,
+                        f"Файл слишком большой (максимум {round(max_bytes / (1 << 20), 1):g} МБ)",
+                    )
+                digest.update(chunk)
+                target.write(chunk)
+
+        if detected is None:
+            raise UploadRejected(400, "Пустой файл")
+
+        media_type, extension = detected
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Тот же файл уже есть — содержимое одинаковое, заменять безопасно
+        os.replace(tmp_path, path)
+        return StoredUpload(path=path, sha256=sha256, size=size, media_type=media_type)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+async def save_upload(file: UploadFile, max_bytes: int = None) -> StoredUpload:
+    """Сохраняет загруженный файл в хранилище; 400 — неподдерживаемый тип, 413 — слишком большой."""
+    max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        return await run_in_threadpool(_store, file.file, max_bytes)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+# --- Отдача файлов ---
+
+# Адрес чека (/orders/{id}/receipt) не меняется при повторной загрузке — браузер перепроверяет ETag
+PROOF_CACHE_CONTROL = "private, no-cache"
+
+
+def validators(sha256: str, created_at: datetime, variant: str = "") -> Dict[str, str]:
+    """ETag и Last-Modified файла из хранилища — без обращения к диску."""
+    return {
+        "ETag": f'"{sha256}{variant}"',
+        "Last-Modified": formatdate(calendar.timegm(created_at.utctimetuple()), usegmt=True),
+    }
+
+
+def not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match главнее If-Modified-Since; слабое сравнение (W/ не учитывается)
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or headers["ETag"] in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)  # зона -0000 или без зоны — считаем UTC
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+
+def media_type_for(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    return EXTENSION_MEDIA_TYPES.get(extension) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def file_response(path: str, media_type: str, headers: Dict[str, str], filename: str = None,
+                  not_found_detail: str = "Файл не найден") -> FileResponse:
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    # stat_result передаём сами — FileResponse не делает второй stat; Range и If-Range он обрабатывает сам
+    return FileResponse(path, media_type=media_type, filename=filename, headers=headers, stat_result=stat_result)
+
+
+def serve(request: Request, path: str, sha256: Optional[str], media_type: Optional[str],
+          created_at: Optional[datetime], filename: str = None, not_found_detail: str = "Файл не найден") -> Response:
+    """
+    Ответ с файлом чека. sha256/media_type/created_at — из blobs; для старых
+    загрузок без строки в blobs (None) тип определяется по расширению.
+    """
+    headers = {"Cache-Control": PROOF_CACHE_CONTROL}
+    if sha256 is not None:
+        headers.update(validators(sha256, created_at))
+        if not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+    return file_response(path, media_type or media_type_for(path), headers, filename, not_found_detail)
+
+
+# --- Счётчики ссылок ---
+
+DB = Union[Session, Connection]
+
+
+def _acquire(db: DB, stored: StoredUpload, count: int = 1) -> str:
+    """Добавляет count ссылок на blob (создаёт строку при первой). Возвращает путь для payment_proof_path."""
+    for _ in range(2):
+        result = db.execute(
+            update(Blob).where(Blob.sha256 == stored.sha256).values(refcount=Blob.refcount + count)
+        )
+        if result.rowcount:
+            return db.execute(select(Blob.path).where(Blob.sha256 == stored.sha256)).scalar_one()
+        try:
+            with db.begin_nested():
+                db.execute(insert(Blob).values(
+                    sha256=stored.sha256, path=stored.path, size=stored.size,
+                    media_type=stored.media_type, refcount=count, created_at=datetime.utcnow(),
+                ))
+            return stored.path
+        except IntegrityError:
+            # Ту же строку одновременно вставил другой запрос — увеличиваем её счётчик
+            continue
+    raise RuntimeError(f"Could not register blob {stored.sha256}")
+
+
+def _release(db: DB, path: str) -> None:
+    db.execute(
+        update(Blob).where(Blob.path == path, Blob.refcount > 0).values(refcount=Blob.refcount - 1)
+    )
+
+
+def replace_reference(db: DB, old_path: Optional[str], stored: StoredUpload) -> str:
+    """
+    Новый чек вместо old_path: возвращает путь, который нужно записать в payment_proof_path.
+    Коммитит вызывающий код (из AsyncSession — через db.run_sync).
+    """
+    path = _acquire(db, stored)
+    if old_path:
+        _release(db, old_path)
+    return path
+
+
+# --- Сборка мусора ---
+
+def _proof_paths():
+    return union_all(
+        select(Order.payment_proof_path.label("path")).where(Order.payment_proof_path.isnot(None)),
+        select(BalanceTopup.payment_proof_path.label("path")).where(BalanceTopup.payment_proof_path.isnot(None)),
+    ).subquery()
+
+
+@dataclass
+class GcStats:
+    recounted: int = 0
+    blobs_deleted: int = 0
+    files_deleted: int = 0
+    bytes_freed: int = 0
+
+
+def _is_stale(path: str, cutoff: float) -> bool:
+    try:
+        return os.stat(path).st_mtime < cutoff
+    except FileNotFoundError:
+        return False
+
+
+def collect_garbage(db: Session, grace_seconds: float = None, dry_run: bool = False) -> GcStats:
+    grace_seconds = UPLOAD_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = time.time() - grace_seconds
+    stats = GcStats()
+
+    # 1. refcount по фактическим ссылкам (одним UPDATE, исправляет расхождения)
+    actual = (
+        select(func.count()).where(Order.payment_proof_path == Blob.path).scalar_subquery()
+        + select(func.count()).where(BalanceTopup.payment_proof_path == Blob.path).scalar_subquery()
+    )
+    if not dry_run:
+        stats.recounted = db.execute(
+            update(Blob).where(Blob.refcount != actual).values(refcount=actual)
+        ).rowcount
+        db.commit()
+
+    # 2. Blob без ссылок: строка удаляется условно, файл — только если его давно не перезаписывали
+    referenced = or_(
+        exists().where(Order.payment_proof_path == Blob.path),
+        exists().where(BalanceTopup.payment_proof_path == Blob.path),
+    )
+    orphaned = (Blob.refcount <= 0) & (Blob.created_at < datetime.utcnow() - timedelta(seconds=grace_seconds)) & ~referenced
+    for sha256, path, size in db.execute(select(Blob.sha256, Blob.path, Blob.size).where(orphaned)).all():
+        if dry_run:
+            logger.info("Would delete orphaned blob %s", path)
+            stats.blobs_deleted += 1
+            if _is_stale(path, cutoff):
+                stats.files_deleted += 1
+                stats.bytes_freed += size
+            continue
+        deleted = db.execute(delete(Blob).where(Blob.sha256 == sha256, orphaned)).rowcount
+        db.commit()
+        if deleted:
+            stats.blobs_deleted += 1
+            if _is_stale(path, cutoff):
+                os.remove(path)
+                stats.files_deleted += 1
+                stats.bytes_freed += size
+            try:
+                os.remove(preview_path(sha256))
+            except FileNotFoundError:
+                pass
+
+    # 3. Файлы, о которых не знает БД (превью — по хэшу существующих blob)
+    known = set()
+    for sha256, path in db.execute(select(Blob.sha256, Blob.path)):
+        known.update((os.path.normpath(path), os.path.normpath(preview_path(sha256))))
+    paths = _proof_paths()
+    known.update(os.path.normpath(path) for path in db.scalars(select(paths.c.path)))
+    for directory, _, filenames in os.walk(UPLOAD_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if os.path.normpath(path) in known or not _is_stale(path, cutoff):
+                continue
+            size = os.path.getsize(path)
+            if dry_run:
+                logger.info("Would delete unreferenced file %s", path)
+            else:
+                os.remove(path)
+            stats.files_deleted += 1
+            stats.bytes_freed += size
+
+    logger.info(
+        "Upload GC%s: %d refcounts fixed, %d blobs, %d files, %d bytes",
+        " (dry run)" if dry_run else "", stats.recounted, stats.blobs_deleted, stats.files_deleted, stats.bytes_freed,
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    import sys
+
+    from sqlalchemy.orm import sessionmaker
+
+    from database import DATABASE_URL, create_db_engine
+
+    args = sys.argv[1:]
+    dry_run = "--dry-run" in args
+    args = [arg for arg in args if arg != "--dry-run"]
+    if not args or args[0] != "gc":
+        print("Usage: python upload_store.py gc [--dry-run] [database_url]")
+        sys.exit(1)
+
+    database_url = args[1] if len(args) > 1 else DATABASE_URL
+    session_factory = sessionmaker(bind=create_db_engine(database_url), autoflush=False)
+    with session_factory() as session:
+        print(collect_garbage(session, dry_run=dry_run))
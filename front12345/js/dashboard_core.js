@@ -32,7 +32,8 @@ let state = {
 };
 
 // === 1. Базовая функция запроса ===
-async function request(endpoint, method = 'GET', body = null) {
+async function request(endpoint, method = 'GET', body = null, retried = false) {
+    await ensureFreshToken();
     const token = localStorage.getItem('token');
     if (!token) {
         window.location.href = '/register_login/register';
@@ -49,6 +50,7 @@ async function request(endpoint, method = 'GET', body = null) {
         const response = await fetch(`${API_URL}${endpoint}`, config);
 
         if (response.status === 401) {
+            if (!retried && await refreshAccessToken()) return request(endpoint, method, body, true);
             localStorage.removeItem('token');
             window.location.href = '/register_login/register';
             return;
@@ -115,7 +117,7 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     // Привязка кнопок
     const btnLogout = document.getElementById('logoutBtn');
-    if(btnLogout) btnLogout.onclick = () => { localStorage.clear(); window.location.href = '/register_login/register'; };
+    if(btnLogout) btnLogout.onclick = () => { revokeTokens(); localStorage.clear(); window.location.href = '/register_login/register'; };
 
     const navNew = document.getElementById('nav-newOrder');
     const navHist = document.getElementById('nav-history');
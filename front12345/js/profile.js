@@ -6,7 +6,8 @@ try {
     // alert('Ошибка конфигурации приложения. Проверьте консоль для деталей.');
     // throw e;
 }
-async function apiRequest(endpoint, method = 'GET', body = null, isForm = false) {
+async function apiRequest(endpoint, method = 'GET', body = null, isForm = false, retried = false) {
+    await ensureFreshToken();
     const token = localStorage.getItem('token');
     console.debug(`[apiRequest] ${method} ${API_URL}${endpoint} - token present: ${!!token}`);
     if (!token) {
@@ -29,6 +30,7 @@ async function apiRequest(endpoint, method = 'GET', body = null, isForm = false)
 
         // Если не авторизован — удаляем токен и перенаправляем
         if (response.status === 401) {
+            if (!retried && await refreshAccessToken()) return apiRequest(endpoint, method, body, isForm, true);
             console.warn('[apiRequest] 401 Unauthorized - удаляю токен и перенаправляю');
             localStorage.removeItem('token');
             window.location.href = '/register_login/register';
@@ -387,6 +389,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     if (cancelBtn) cancelBtn.addEventListener('click', cancelEdit);
     const logoutBtn = document.getElementById('logoutBtn');
     if (logoutBtn) logoutBtn.addEventListener('click', () => {
+        revokeTokens();
         localStorage.clear();
         window.location.href = '/register_login/register';
     });
@@ -2,8 +2,67 @@
 
 const API_URL = '/api';
 
+// --- Обновление токена ---
+// Access-токен живёт недолго; перед запросом, если он скоро истечёт, получаем новую пару
+// по refresh-токену. Refresh-токен одноразовый, поэтому параллельные вызовы ждут один запрос.
+const TOKEN_REFRESH_MARGIN_MS = 60 * 1000;
+let refreshInFlight = null;
+
+function tokenExpiresAt(token) {
+    try {
+        const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+        return payload.exp * 1000;
+    } catch (e) {
+        return 0;
+    }
+}
+
+async function doRefreshAccessToken() {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!refreshToken) return false;
+    try {
+        const response = await fetch(`${API_URL}/auth/refresh`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: refreshToken })
+        });
+        if (!response.ok) {
+            localStorage.removeItem('refresh_token');
+            return false;
+        }
+        const result = await response.json();
+        localStorage.setItem('token', result.access_token);
+        localStorage.setItem('refresh_token', result.refresh_token);
+        return true;
+    } catch (e) {
+        console.error('Ошибка обновления токена', e);
+        return false;
+    }
+}
+
+function refreshAccessToken() {
+    if (!refreshInFlight) {
+        refreshInFlight = doRefreshAccessToken().finally(() => { refreshInFlight = null; });
+    }
+    return refreshInFlight;
+}
+
+async function ensureFreshToken() {
+    const token = localStorage.getItem('token');
+    if (token && tokenExpiresAt(token) - Date.now() < TOKEN_REFRESH_MARGIN_MS) {
+        await refreshAccessToken();
+    }
+}
+
+// Страницы с прямыми fetch (админка) тоже получают свежий токен
+if (localStorage.getItem('refresh_token')) {
+    ensureFreshToken();
+    setInterval(ensureFreshToken, TOKEN_REFRESH_MARGIN_MS / 2);
+}
+
 // Хелпер для запросов
-async function apiRequest(endpoint, method = 'GET', body = null, isFile = false) {
+async function apiRequest(endpoint, method = 'GET', body = null, isFile = false, retried = false) {
+    await ensureFreshToken();
     const token = localStorage.getItem('token');
     const headers = {};
 
@@ -28,6 +87,9 @@ async function apiRequest(endpoint, method = 'GET', body = null, isFile = false)
         const response = await fetch(`${API_URL}${endpoint}`, config);
 
         if (response.status === 401) {
+            if (!retried && token && await refreshAccessToken()) {
+                return apiRequest(endpoint, method, body, isFile, true);
+            }
             alert("Сессия истекла");
             localStorage.removeItem('token');
             window.location.href = '/register_login/register';
@@ -68,6 +130,7 @@ async function apiRequest(endpoint, method = 'GET', body = null, isFile = false)
 
 // Хелпер для скачивания файлов (для админа)
 async function downloadFile(endpoint, filename) {
+    await ensureFreshToken();
     const token = localStorage.getItem('token');
     try {
         const response = await fetch(`${API_URL}${endpoint}`, {
@@ -88,7 +151,37 @@ async function downloadFile(endpoint, filename) {
     }
 }
 
+// Превью чека в <img> (запрос с токеном, картинка через blob URL); false — превью нет
+async function loadPreviewImage(img, endpoint) {
+    await ensureFreshToken();
+    const token = localStorage.getItem('token');
+    const response = await fetch(`${API_URL}${endpoint}`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+    });
+    if (!response.ok) return false;
+    const url = window.URL.createObjectURL(await response.blob());
+    img.onload = () => window.URL.revokeObjectURL(url);
+    img.src = url;
+    return true;
+}
+
+// Отзыв токенов на сервере; ответ не ждём, keepalive переживает переход на другую страницу
+function revokeTokens() {
+    const token = localStorage.getItem('token');
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!token && !refreshToken) return;
+    const headers = { 'Content-Type': 'application/json' };
+    if (token) headers['Authorization'] = `Bearer ${token}`;
+    fetch(`${API_URL}/auth/logout`, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({ refresh_token: refreshToken }),
+        keepalive: true
+    }).catch(() => {});
+}
+
 function logout() {
+    revokeTokens();
     localStorage.clear();
     window.location.href = '/register_login/login';
 }